@@ -0,0 +1,100 @@
+"""
+Бенчмарк проверки сообщений на признаки опасного состояния.
+
+Собирает корпус сообщений обычной длины (от пары слов до нескольких
+абзацев, часть - с экстренными фразами) и сравнивает автомат
+PhraseAutomaton с прежним подходом "any(фраза in текст)" по тем же
+основам слов. Список фраз дополняется синтетическими до patterns штук,
+чтобы было видно: время автомата на символ не растёт с числом фраз,
+а время перебора растёт линейно.
+
+Запуск из корня репозитория:
+    python benchmarks/emergency_benchmark.py --messages 20000 --patterns 40 200 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emergency import EMERGENCY_PHRASES, PhraseAutomaton, normalizeWords
+
+WORDS = ['здравствуйте', 'подскажите', 'пожалуйста', 'как', 'записаться', 'к', 'терапевту', 'на', 'завтра',
+         'утром', 'у', 'меня', 'нет', 'полиса', 'можно', 'ли', 'получить', 'справку', 'для', 'бассейна',
+         'ребёнку', 'нужна', 'прививка', 'когда', 'работает', 'регистратура', 'в', 'субботу', 'где',
+         'результаты', 'анализов', 'крови', 'я', 'сдавал', 'неделю', 'назад', 'врач', 'не', 'пришёл',
+         'очередь', 'большая', 'сколько', 'ждать', 'талон', 'к', 'кардиологу', 'больничный', 'продлить',
+         'спасибо', 'за', 'ответ', 'флюорографию', 'сделать', 'адрес', 'поликлиники', 'телефон', 'занят']
+SYLLABLES = ['ка', 'ро', 'ми', 'зу', 'ле', 'на', 'ту', 'ви', 'со', 'пе', 'ды', 'ча', 'гри', 'бло', 'ст']
+
+
+def generateMessages(count: int, emergency_share: float, seed: int = 5) -> list:
+    rnd = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        # Длина как у настоящих сообщений: чаще короткие, иногда длинные
+        length = min(150, int(rnd.expovariate(1 / 12)) + 2)
+        words = [rnd.choice(WORDS) for _ in range(length)]
+        if rnd.random() < emergency_share:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(EMERGENCY_PHRASES))
+        messages.append(' '.join(words).capitalize() + rnd.choice(['.', '?', '!', '']))
+    return messages
+
+
+def syntheticPhrases(count: int, seed: int = 7) -> tuple:
+    rnd = random.Random(seed)
+    phrases = list(EMERGENCY_PHRASES)
+    while len(phrases) < count:
+        phrases.append(' '.join(
+            'зз' + ''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))) for _ in range(rnd.randint(1, 3))
+        ))
+    return tuple(phrases[:count])
+
+
+def naiveFind(patterns: list, text: str):
+    normalized = normalizeWords(text)
+    return next((pattern for pattern in patterns if pattern in normalized), None)
+
+
+def measure(func, messages: list) -> tuple:
+    started = time.perf_counter()
+    found = sum(func(message) is not None for message in messages)
+    return time.perf_counter() - started, found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--emergency-share', type=float, default=0.02)
+    parser.add_argument('--patterns', type=int, nargs='+', default=[40, 200, 1000])
+    args = parser.parse_args()
+
+    messages = generateMessages(args.messages, args.emergency_share)
+    characters = sum(len(message) for message in messages)
+    # Прогрев кэша основ слов, чтобы обе реализации были в равных условиях
+    for message in messages:
+        normalizeWords(message)
+    started = time.perf_counter()
+    for message in messages:
+        normalizeWords(message)
+    normalize = time.perf_counter() - started
+
+    print(f"Сообщений: {len(messages)}, символов: {characters} (в среднем {characters / len(messages):.0f}), "
+          f"приведение к основам: {normalize / characters * 1e9:.0f} нс на символ")
+    print(f"{'фраз':>6}{'автомат, мкс':>15}{'нс/символ':>11}{'перебор, мкс':>15}{'нс/символ':>11}{'найдено':>10}")
+    for count in args.patterns:
+        phrases = syntheticPhrases(count)
+        automaton = PhraseAutomaton(phrases)
+        patterns = [normalizeWords(phrase) for phrase in phrases]
+        automaton_seconds, automaton_found = measure(automaton.find, messages)
+        naive_seconds, naive_found = measure(lambda text: naiveFind(patterns, text), messages)
+        if automaton_found != naive_found:
+            print(f"Расхождение: автомат нашёл {automaton_found}, перебор {naive_found}")
+        print(f"{count:>6}{automaton_seconds / len(messages) * 1e6:>15.1f}{automaton_seconds / characters * 1e9:>11.0f}"
+              f"{naive_seconds / len(messages) * 1e6:>15.1f}{naive_seconds / characters * 1e9:>11.0f}{automaton_found:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Локальная заглушка Telegram Bot API для бенчмарков и проверки без Telegram.
+
+Отвечает на методы Bot API правдоподобными результатами и считает вызовы.
+Бот направляется на заглушку переменной окружения BOT_API_URL.
+FakeSession отвечает теми же результатами без HTTP, внутри процесса.
+
+Запуск отдельно:
+    python benchmarks/fake_bot_api.py --port 8081
+    BOT_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook python main.py
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from aiohttp import web
+from aiogram.client.session.base import BaseSession
+
+BOT_USER = {'id': 1000001, 'is_bot': True, 'first_name': 'Поликлиника', 'username': 'clinic_test_bot'}
+
+
+def fakeResult(method: str, params: dict, message_ids) -> object:
+    """
+    Правдоподобный результат метода Bot API.
+
+    :param message_ids: Итератор номеров отправленных сообщений
+    """
+    lowered = method.lower()
+    if lowered == 'getme':
+        return BOT_USER
+    if lowered == 'getupdates':
+        return []
+    if lowered.startswith('send') or (lowered.startswith('edit') and params.get('chat_id') is not None):
+        return {
+            'message_id': next(message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id') or 0), 'type': 'private'},
+            'from': BOT_USER,
+            'text': '',
+        }
+    return True
+
+
+class FakeBotApi:
+    """
+    aiohttp-сервер с путями /bot{token}/{method}.
+
+    :param latency: Искусственная задержка ответа, секунды
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.chats = Counter()
+        self._message_ids = itertools.count(1)
+        self._runner = None
+        self.url = None
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.calls[method] += 1
+        if 'chat_id' in params:
+            self.chats[params['chat_id']] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'ok': True, 'result': fakeResult(method, params, self._message_ids)})
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия бота, отвечающая на запросы без сети.
+
+    Ответ проходит обычный разбор aiogram (check_response), поэтому
+    обработчики получают такие же объекты, как от настоящего Bot API.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = {'chat_id': getattr(method, 'chat_id', None)}
+        content = json.dumps({'ok': True, 'result': fakeResult(name, params, self._message_ids)})
+        return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+async def serve(host: str, port: int, latency: float):
+    api = FakeBotApi(latency)
+    url = await api.start(host, port)
+    print(f'Заглушка Bot API слушает {url}')
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f'Вызовов: {api.total} {dict(api.calls)}')
+    finally:
+        await api.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port, args.latency))
@@ -0,0 +1,113 @@
+"""
+Бенчмарк поиска ответа на свободный вопрос по FAQ.
+
+Строит FaqIndex на синтетическом корпусе из entries записей (вопросы и
+ответы собраны из медицинской лексики в разных словоформах) и измеряет
+время построения, задержку поиска на сообщение (среднее, p50, p99) и
+долю запросов, для которых первым найден вопрос, из слов которого
+запрос составлен. Отдельно проверяются перефразированные вопросы к
+настоящему faq.json.
+
+Запуск из корня репозитория:
+    python benchmarks/faq_benchmark.py --entries 5000 --queries 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from faq import FaqIndex, loadFaqEntries
+
+STEMS = ['анализ', 'справк', 'выписк', 'полис', 'прием', 'врач', 'терапевт', 'кардиолог', 'хирург', 'запис',
+         'талон', 'больничн', 'лист', 'карт', 'рецепт', 'направлени', 'обследовани', 'прививк', 'вакцин',
+         'осмотр', 'кабинет', 'регистратур', 'очеред', 'результат', 'давлени', 'кров', 'моч', 'узи', 'рентген',
+         'снимк', 'флюорографи', 'диспансеризаци', 'профосмотр', 'стоматолог', 'зуб', 'окулист', 'зрени',
+         'невролог', 'лор', 'педиатр', 'детск', 'взросл', 'пенсионер', 'инвалидност', 'комисси', 'льгот',
+         'лекарств', 'аптек', 'оплат', 'платн', 'бесплатн', 'страхов', 'паспорт', 'снилс', 'адрес', 'телефон']
+ENDINGS = ['', 'а', 'у', 'ом', 'ов', 'ы', 'и', 'ой', 'е', 'ам', 'ами', 'ах']
+QUESTION_STARTS = ['Как получить', 'Где сделать', 'Можно ли оформить', 'Когда будет', 'Сколько ждать',
+                   'Кому нужна', 'Зачем нужен', 'Что делать, если нет']
+PARAPHRASES = {
+    'Запись на прием к врачу': ['как попасть на прием к терапевту', 'где взять талон к врачу'],
+    'Получить результаты анализов': ['где посмотреть результаты анализа крови', 'анализы готовы?'],
+    'Потерял полис ОМС': ['у меня пропал полис что делать', 'восстановить страховой полис'],
+    'Получить больничный лист': ['как открыть больничный', 'нужен листок нетрудоспособности'],
+    'Флюорография': ['где сделать флюшку', 'рентген легких без записи'],
+    'Контакты поликлиники': ['какой у вас телефон', 'где находится поликлиника'],
+    'Запись на диспансеризацию': ['пройти диспансеризацию', 'профосмотр для взрослых'],
+    'Получить справку / Выписку': ['справка для бассейна', 'выписка из медицинской карты'],
+}
+
+
+def word(rnd: random.Random) -> str:
+    return rnd.choice(STEMS) + rnd.choice(ENDINGS)
+
+
+def generateEntries(count: int, seed: int = 19) -> list:
+    rnd = random.Random(seed)
+    entries = []
+    for number in range(count):
+        topic = [word(rnd) for _ in range(rnd.randint(2, 4))]
+        question = f"{rnd.choice(QUESTION_STARTS)} {' '.join(topic)} №{number}"
+        answer = ' '.join(word(rnd) for _ in range(rnd.randint(40, 120)))
+        entries.append({'question': question, 'answer': answer, 'keywords': [f"тема{number}"]})
+    return entries
+
+
+def generateQueries(entries: list, count: int, seed: int = 23) -> list:
+    """Запросы из части слов вопроса (с номером записи, чтобы ответ был однозначен)"""
+    rnd = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        index = rnd.randrange(len(entries))
+        words = entries[index]['question'].split()[:-1]
+        picked = rnd.sample(words, k=max(1, len(words) - 2))
+        queries.append((index, ' '.join(picked + [f"тема{index}"])))
+    return queries
+
+
+def measure(index: FaqIndex, queries: list) -> tuple:
+    timings = []
+    hits = 0
+    for expected, text in queries:
+        started = time.perf_counter()
+        found = index.search(text)
+        timings.append(time.perf_counter() - started)
+        hits += bool(found) and found[0][0] == expected
+    timings.sort()
+    return timings, hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=20000)
+    args = parser.parse_args()
+
+    entries = generateEntries(args.entries)
+    index = FaqIndex()
+    started = time.perf_counter()
+    index.build(entries)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    queries = generateQueries(entries, args.queries)
+    timings, hits = measure(index, queries)
+    print(f"Записей: {args.entries}, построение индекса: {build_ms:.1f} мс")
+    print(f"Запросов: {len(queries)}, среднее {sum(timings) / len(timings) * 1e6:.1f} мкс, "
+          f"p50 {timings[len(timings) // 2] * 1e6:.1f} мкс, p99 {timings[int(len(timings) * 0.99)] * 1e6:.1f} мкс, "
+          f"верный первый ответ: {hits / len(queries):.1%}")
+
+    faq = loadFaqEntries()
+    index.build(faq)
+    questions = [entry['question'] for entry in faq]
+    real = [(questions.index(question), text) for question, texts in PARAPHRASES.items() for text in texts]
+    timings, hits = measure(index, real)
+    print(f"faq.json: {len(faq)} записей, перефразированных вопросов {len(real)}, "
+          f"верный первый ответ: {hits} из {len(real)}, среднее {sum(timings) / len(timings) * 1e6:.1f} мкс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Бенчмарк очереди исходящих сообщений.
+
+Поднимает заглушку Bot API и временную базу с users получателями, ставит
+рассылку всем и измеряет, за сколько она доставлена при заданном лимите
+запросов в секунду. Параллельно бот раз в полсекунды отвечает "пользователю"
+напрямую, как обработчик, - по этим ответам видно, насколько рассылка
+задерживает интерактивную работу.
+
+Запуск из корня репозитория:
+    python benchmarks/outbox_benchmark.py --users 600 --rate 30 --api-latency 0.05
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+async def measureInteractive(bot, latencies: list, stop: asyncio.Event):
+    chat_id = 0
+    while not stop.is_set():
+        # Каждый раз новый чат, чтобы не упираться в лимит одного чата
+        chat_id += 1
+        started = time.perf_counter()
+        await bot.send_message(chat_id, 'ответ пользователю')
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.5)
+
+
+async def run(args):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from fake_bot_api import FakeBotApi
+
+    api = FakeBotApi(latency=args.api_latency)
+    url = await api.start()
+
+    from database import dbWrite, initDatabase, rememberChats
+    from outbox import outbox
+    from throttling import RateLimitMiddleware
+
+    await dbWrite(initDatabase)
+    now = time.time()
+    await dbWrite(rememberChats, [(200000 + number, now) for number in range(args.users)])
+    await outbox.registry.load()
+
+    bot = Bot(token='42:TEST', session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    bot.session.middleware(RateLimitMiddleware(args.rate, chat_rate=1))
+    outbox.start(bot)
+
+    latencies = []
+    stop = asyncio.Event()
+    interactive = asyncio.create_task(measureInteractive(bot, latencies, stop))
+
+    started = time.perf_counter()
+    result = await outbox.broadcast('Плановое сообщение всем пациентам')
+    while True:
+        progress = await outbox.progress(result['id'])
+        if not progress['pending']:
+            break
+        await asyncio.sleep(0.2)
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await interactive
+    await outbox.stop()
+    await bot.session.close()
+    await api.stop()
+
+    print(f"Рассылка {progress['sent']} из {progress['total']} за {elapsed:.2f} с "
+          f"({progress['sent'] / elapsed:.1f} в с; минимум при лимите {args.rate}/с: {args.users / args.rate:.2f} с)")
+    if latencies:
+        print(f"Ответы пользователю во время рассылки: {len(latencies)}, медиана "
+              f"{statistics.median(latencies) * 1000:.1f} мс, максимум {max(latencies) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=600)
+    parser.add_argument('--rate', type=float, default=30)
+    parser.add_argument('--api-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BOT_DATABASE'] = os.path.join(tmp, 'bench.db')
+        try:
+            asyncio.run(run(args))
+        finally:
+            from database import closeDatabase
+            closeDatabase()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Проверка планов запросов: ни один запрос не должен читать таблицу целиком.
+
+Находит в исходниках (по умолчанию database.py и main.py) строки SQL -
+SELECT, INSERT, UPDATE, DELETE, - подставляет в f-строки значения из той
+же функции (списки плейсхолдеров, необязательные условия) и выполняет для
+каждого запроса EXPLAIN QUERY PLAN на временной базе с актуальной схемой
+(initDatabase со всеми миграциями). Запрос с шагом «SCAN <таблица>» без
+индекса считается регрессией, если его функция не указана в EXPECTED_SCANS
+с причиной. Код возврата 1 при регрессиях или нераспознанных запросах,
+поэтому проверку можно запускать перед выкладкой.
+
+Запуск из корня репозитория:
+    python benchmarks/query_plans.py
+    python benchmarks/query_plans.py --verbose database.py main.py outbox.py
+"""
+import argparse
+import ast
+import os
+import re
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SQL_START = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b', re.IGNORECASE)
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+# Функции, которым полное чтение таблицы нужно по смыслу: {функция: причина}
+EXPECTED_SCANS = {
+    'applyDoctorSnapshot': 'сравнивает снимок со всей таблицей doctors',
+    'getAllDoctorsForTimetable': 'справочник врачей загружается целиком',
+    'getDoctorSchedules': 'без списка id читает все расписания',
+    'getDoctorsWithSurname': 'прежний поиск по LIKE, бот ищет по search_index',
+    'getActiveChatIds': 'рассылка идёт всем получателям',
+    'createBroadcast': 'рассылка идёт всем получателям',
+    'deleteExpiredFsmStates': 'редкая очистка; индекс по updated_at замедлил бы каждое сохранение состояния',
+    'getDoctorShifts': 'интервалы приёма загружаются целиком',
+    'replaceDoctorShifts': 'возвращает все интервалы после замены',
+    'getShiftParseErrorCount': 'небольшая таблица ошибок разбора',
+    'getShiftParseErrors': 'небольшая таблица ошибок разбора, выводится целиком',
+}
+
+
+class QueryCollector(ast.NodeVisitor):
+    """Собирает (функция, строка, SQL) из модуля, подставляя значения в f-строки"""
+
+    def __init__(self):
+        self.queries = []
+        self.unresolved = []
+        self._function = '<module>'
+        self._names = {}
+
+    def visit_FunctionDef(self, node):
+        outer = self._function, self._names
+        self._function, self._names = node.name, self._localValues(node)
+        self.generic_visit(node)
+        self._function, self._names = outer
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _localValues(self, function) -> dict:
+        """Значения имён функции: присвоенные строки и списки, собранные через append"""
+        names = {}
+        for node in ast.walk(function):
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                names[node.targets[0].id] = node.value
+            elif (
+                isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'append'
+                and isinstance(node.func.value, ast.Name) and node.args
+            ):
+                names.setdefault(f'{node.func.value.id}[]', []).append(node.args[0])
+        return names
+
+    def _render(self, node) -> list:
+        """Варианты текста SQL из выражения; пустой список, если его не вычислить"""
+        if isinstance(node, ast.Constant):
+            return [node.value] if isinstance(node.value, str) else []
+        if isinstance(node, ast.JoinedStr):
+            variants = ['']
+            for value in node.values:
+                parts = self._render(value.value if isinstance(value, ast.FormattedValue) else value)
+                variants = [variant + part for variant in variants for part in parts]
+            return variants
+        if isinstance(node, ast.Name) and node.id in self._names:
+            return self._render(self._names[node.id])
+        if isinstance(node, ast.IfExp):
+            # Необязательное условие: проверяются запросы с ним и без него
+            return self._render(node.body) + self._render(node.orelse)
+        if (
+            isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'join'
+            and isinstance(node.func.value, ast.Constant) and node.args
+        ):
+            argument = node.args[0]
+            items = self._names.get(f'{argument.id}[]') if isinstance(argument, ast.Name) else None
+            if items is None:
+                # ', '.join('?' * len(chunk)) - список плейсхолдеров
+                return ['?']
+            texts = [self._render(item) for item in items]
+            return [] if not all(texts) else [node.func.value.value.join(text[0] for text in texts)]
+        return []
+
+    def _collect(self, node):
+        variants = self._render(node)
+        if not variants:
+            self.unresolved.append((self._function, node.lineno))
+        for text in dict.fromkeys(variants):
+            if SQL_START.match(text):
+                self.queries.append((self._function, node.lineno, text))
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, str) and SQL_START.match(node.value):
+            self._collect(node)
+
+    def visit_JoinedStr(self, node):
+        prefix = node.values[0] if node.values else None
+        if isinstance(prefix, ast.Constant) and SQL_START.match(prefix.value):
+            self._collect(node)
+        elif isinstance(prefix, ast.FormattedValue) and any(SQL_START.match(text) for text in self._render(prefix.value)):
+            self._collect(node)
+        # Строки внутри f-строки - это части запроса, а не отдельные запросы
+
+
+def collectQueries(path: str) -> tuple:
+    with open(path, encoding='utf-8') as file:
+        tree = ast.parse(file.read(), filename=path)
+    collector = QueryCollector()
+    collector.visit(tree)
+    return collector.queries, collector.unresolved
+
+
+def fullScans(conn, sql: str) -> tuple:
+    """:return: (таблицы, прочитанные целиком без индекса, строки плана)"""
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, (None,) * sql.count('?'))]
+    tables = []
+    for detail in plan:
+        match = FULL_SCAN.match(detail)
+        if match and not match.group(1).startswith('sqlite_'):
+            tables.append(match.group(1))
+    return tables, plan
+
+
+def check(paths: list, verbose: bool = False) -> int:
+    from database import initDatabase, pool
+
+    initDatabase()
+    failures = 0
+    with pool.connection() as conn:
+        for path in paths:
+            queries, unresolved = collectQueries(os.path.join(ROOT, path))
+            for function, line in unresolved:
+                failures += 1
+                print(f"{path}:{line} {function}: не удалось восстановить текст запроса")
+            for function, line, sql in queries:
+                tables, plan = fullScans(conn, sql)
+                expected = EXPECTED_SCANS.get(function)
+                if tables and expected is None:
+                    failures += 1
+                    status = 'ПОЛНОЕ ЧТЕНИЕ'
+                elif tables:
+                    status = 'ожидаемо'
+                else:
+                    status = 'ok'
+                if verbose or status != 'ok':
+                    print(f"{path}:{line} {function}: {status}" + (f" ({expected})" if status == 'ожидаемо' else ''))
+                    for detail in plan:
+                        print(f"    {detail}")
+            print(f"{path}: запросов {len(queries)}")
+    print(f"Регрессий: {failures}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=['database.py', 'main.py'], help='файлы относительно корня репозитория')
+    parser.add_argument('--verbose', action='store_true', help='печатать планы всех запросов')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BOT_DATABASE'] = os.path.join(tmp, 'plans.db')
+        failures = check(args.paths, args.verbose)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
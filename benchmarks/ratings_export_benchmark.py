@@ -0,0 +1,116 @@
+"""
+Бенчмарк выгрузки оценок и аналитики по окнам.
+
+Заполняет временную базу синтетическими оценками и измеряет:
+- выгрузку всех оценок в CSV и JSON Lines из event loop (exportRatingsToFile):
+  время и наибольшую задержку event loop, затем отдельным прогоном под
+  tracemalloc - пик памяти Python;
+- для сравнения - чтение той же таблицы одним fetchall;
+- выгрузку оценок одного врача и итоги за 7/30 дней по индексам ratings.
+
+Запуск из корня репозитория:
+    python benchmarks/ratings_export_benchmark.py --ratings 1000000 --doctors 1000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+async def loopLag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Наибольшая задержка срабатывания таймера event loop, секунды"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - started - interval)
+    return worst
+
+
+async def measureExport(path: str, fmt: str, date_from: date, date_to: date, doctor_id: int = None) -> dict:
+    from ratings_export import exportRatingsToFile
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(loopLag(stop))
+    started = time.perf_counter()
+    count = await exportRatingsToFile(path, fmt, date_from, date_to, doctor_id)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    # tracemalloc замедляет выгрузку в разы, поэтому память меряется отдельным прогоном
+    tracemalloc.start()
+    await exportRatingsToFile(path, fmt, date_from, date_to, doctor_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rows': count, 'seconds': elapsed, 'peak_mb': peak / 2 ** 20, 'lag_ms': await lag * 1000,
+            'size_mb': os.path.getsize(path) / 2 ** 20}
+
+
+def measureFetchAll() -> dict:
+    from database import pool
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with pool.connection() as conn:
+        rows = conn.execute('SELECT * FROM ratings').fetchall()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rows': len(rows), 'seconds': elapsed, 'peak_mb': peak / 2 ** 20}
+
+
+async def run(args, directory: str):
+    from database import closeDatabase, dbRead
+    from ratings_export import ratingSummary, ratingRolling
+    from synthetic import seedDoctors, seedRatings
+
+    doctors = seedDoctors(args.doctors)['inserted']
+    started = time.perf_counter()
+    seedRatings(args.ratings, [(doctor_id, f"Врач {doctor_id}") for doctor_id in doctors], days=args.days)
+    print(f"Оценок: {args.ratings} за {args.days} дней, врачей: {args.doctors}, "
+          f"заполнение {time.perf_counter() - started:.1f} с")
+
+    today = date.today()
+    date_from = today - timedelta(days=args.days)
+    for fmt in ('csv', 'jsonl'):
+        result = await measureExport(os.path.join(directory, f'ratings.{fmt}'), fmt, date_from, today)
+        print(f"выгрузка {fmt:>5}: {result['rows']} строк за {result['seconds']:.2f} с "
+              f"({result['rows'] / result['seconds']:.0f} в с), файл {result['size_mb']:.1f} МБ, "
+              f"память {result['peak_mb']:.1f} МБ, задержка event loop до {result['lag_ms']:.1f} мс")
+    result = measureFetchAll()
+    print(f"fetchall    : {result['rows']} строк за {result['seconds']:.2f} с, память {result['peak_mb']:.1f} МБ")
+
+    result = await measureExport(os.path.join(directory, 'doctor.csv'), 'csv', date_from, today, doctors[0])
+    print(f"выгрузка врача: {result['rows']} строк за {result['seconds'] * 1000:.1f} мс")
+    started = time.perf_counter()
+    summary = await dbRead(ratingSummary, today)
+    print(f"итоги 7/30 дней по всем врачам: {len(summary)} строк за {(time.perf_counter() - started) * 1000:.1f} мс")
+    started = time.perf_counter()
+    await dbRead(ratingSummary, today, doctors[0])
+    print(f"итоги 7/30 дней по врачу: {(time.perf_counter() - started) * 1000:.2f} мс")
+    started = time.perf_counter()
+    series = await dbRead(ratingRolling, today - timedelta(days=args.days - 1), today, doctors[0])
+    print(f"скользящие средние врача по дням: {len(series)} дней за {(time.perf_counter() - started) * 1000:.2f} мс")
+    closeDatabase()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ratings', type=int, default=1000000)
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=90)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BOT_DATABASE'] = os.path.join(tmp, 'bench.db')
+        asyncio.run(run(args, tmp))
+
+
+if __name__ == '__main__':
+    main()
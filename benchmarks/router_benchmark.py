@@ -0,0 +1,237 @@
+"""
+Бенчмарк задержек обработчиков бота по сценариям.
+
+Заполняет временную базу синтетическими врачами и оценками, подменяет
+сессию бота заглушкой без сети (FakeSession) и прогоняет через
+dp.feed_update сценарии пользователей: /start, расписание, листание,
+поиск по фамилии, сегодняшнее расписание, выбор врача и оценку.
+Обновления разных пользователей обрабатываются одновременно, обновления
+одного пользователя - по очереди. Печатает пропускную способность и
+p50/p95/p99 по каждому сценарию и сохраняет результат в JSON, чтобы
+сравнивать коммиты между собой.
+
+Запуск из корня репозитория:
+    python benchmarks/router_benchmark.py --doctors 5000 --ratings 1000000 --output before.json
+    python benchmarks/router_benchmark.py --doctors 5000 --ratings 1000000 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def userScenario(chat_id: int, doctors: list, rnd: random.Random, message_ids) -> list:
+    """Последовательность (сценарий, сырое обновление) одного пользователя"""
+    from callback_codec import doctorsPageRoute
+    from database import getDataVersion
+    from synthetic import callbackUpdate, messageUpdate
+
+    version = getDataVersion()
+    doctor_id, name, _ = rnd.choice(doctors)
+    surname = name.split()[0]
+    query = surname[:rnd.randint(3, len(surname))]
+    if rnd.random() < 0.2 and len(query) > 3:
+        # Опечатка: пропущена буква
+        position = rnd.randrange(1, len(query))
+        query = query[:position] + query[position + 1:]
+
+    def callback(data: str) -> dict:
+        return callbackUpdate(chat_id, data, next(message_ids))
+
+    def page(direction: str) -> str:
+        return doctorsPageRoute.pack(direction=direction, cursor=rnd.choice(doctors)[0], version=version)
+
+    return [
+        ('start', messageUpdate(chat_id, '/start')),
+        ('schedule', messageUpdate(chat_id, 'Расписание врачей')),
+        ('page_next', callback(page('n'))),
+        ('page_prev', callback(page('p'))),
+        ('today', messageUpdate(chat_id, 'Сегодняшнее расписание')),
+        ('search_open', callback('search_by_surname')),
+        ('search', messageUpdate(chat_id, query)),
+        ('doctor', callback(f'doctor_{doctor_id}')),
+        ('visit_answer', messageUpdate(chat_id, 'Да')),
+        ('rating', messageUpdate(chat_id, str(rnd.randint(1, 5)))),
+    ]
+
+
+def percentile(sorted_values: list, share: float) -> float:
+    index = min(len(sorted_values) - 1, int(round(share * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies: list) -> dict:
+    values = sorted(latencies)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 3),
+        'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(values, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3),
+    }
+
+
+def gitCommit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+async def runUsers(main, scenarios: list) -> tuple:
+    """Прогоняет сценарии всех пользователей одновременно; :return: (задержки по сценариям, секунды)"""
+    latencies = defaultdict(list)
+
+    async def user(steps):
+        for route, update in steps:
+            started = time.perf_counter()
+            await main.dp.feed_update(main.bot, update)
+            latencies[route].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(steps) for steps in scenarios))
+    return latencies, time.perf_counter() - started
+
+
+async def run(args) -> dict:
+    from aiogram.types import Update
+    from fake_bot_api import FakeSession
+    from synthetic import seedDoctors, seedRatings
+
+    seeding_started = time.perf_counter()
+    seedDoctors(args.doctors)
+    from database import getAllDoctorsForTimetable
+    doctors = getAllDoctorsForTimetable()
+    if args.ratings:
+        seedRatings(args.ratings, [(doctor_id, name) for doctor_id, name, _ in doctors])
+    seeding = time.perf_counter() - seeding_started
+
+    import main
+    main.bot.session = FakeSession(latency=args.api_latency)
+    await main.loadLocalSnapshot()
+    main.ratingQueue.start()
+
+    rnd = random.Random(args.seed)
+    message_ids = iter(range(10, 10 ** 9))
+
+    def buildRound(first_chat: int) -> list:
+        scenarios = []
+        for chat_id in range(first_chat, first_chat + args.users):
+            steps = userScenario(chat_id, doctors, rnd, message_ids)
+            scenarios.append([(route, Update.model_validate(raw, context={'bot': main.bot})) for route, raw in steps])
+        return scenarios
+
+    try:
+        # Прогрев: импорты, кэши клавиатур, соединения с базой
+        await runUsers(main, buildRound(1))
+
+        latencies = defaultdict(list)
+        seconds = 0.0
+        calls_before = main.bot.session.total
+        for round_number in range(args.rounds):
+            round_latencies, round_seconds = await runUsers(main, buildRound(100000 + round_number * args.users))
+            seconds += round_seconds
+            for route, values in round_latencies.items():
+                latencies[route].extend(values)
+        api_calls = main.bot.session.total - calls_before
+    finally:
+        await main.ratingQueue.stop()
+        await main.dp.storage.close()
+        main.closeDatabase()
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        'meta': {
+            'commit': gitCommit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'doctors': args.doctors,
+            'ratings': args.ratings,
+            'users': args.users,
+            'rounds': args.rounds,
+            'api_latency': args.api_latency,
+            'seeding_seconds': round(seeding, 2),
+        },
+        'updates': total,
+        'seconds': round(seconds, 3),
+        'updates_per_second': round(total / seconds, 1),
+        'api_calls': api_calls,
+        'routes': {route: summarize(values) for route, values in sorted(latencies.items())},
+    }
+
+
+def printResult(result: dict, baseline: dict = None, threshold: float = 0.2) -> bool:
+    """Печатает таблицу; :return: True, если есть регрессия p95 сверх threshold относительно baseline"""
+    print(f"{result['updates']} обновлений за {result['seconds']} с: {result['updates_per_second']} в с, "
+          f"вызовов API {result['api_calls']} (коммит {result['meta']['commit']})")
+    header = f"{'сценарий':<14}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}"
+    if baseline:
+        header += f"{'p95 было':>10}{'изм.':>8}"
+    print(header)
+
+    regression = False
+    for route, stats in result['routes'].items():
+        line = f"{route:<14}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}"
+        before = (baseline or {}).get('routes', {}).get(route)
+        if before:
+            change = stats['p95_ms'] / before['p95_ms'] - 1 if before['p95_ms'] else 0.0
+            line += f"{before['p95_ms']:>10.2f}{change:>+8.0%}"
+            if change > threshold:
+                line += '  ← регрессия'
+                regression = True
+        print(line)
+    if baseline:
+        print(f"пропускная способность: было {baseline['updates_per_second']} в с, стало {result['updates_per_second']} в с")
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctors', type=int, default=1000, help='врачей в базе (100 - 50000)')
+    parser.add_argument('--ratings', type=int, default=100000, help='оценок в базе')
+    parser.add_argument('--users', type=int, default=50, help='одновременных пользователей')
+    parser.add_argument('--rounds', type=int, default=5, help='сколько раз каждый пользователь проходит сценарий')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа заглушки Bot API, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='сохранить результат в JSON')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимый рост p95 при сравнении')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BOT_DATABASE'] = os.path.join(tmp, 'bench.db')
+        # Сессия-заглушка не ограничивает частоту запросов, измеряем сами обработчики
+        os.environ['OUTGOING_RATE_LIMIT'] = '0'
+        result = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+    regression = printResult(result, baseline, args.threshold)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+        print(f"Результат сохранён в {args.output}")
+    if regression:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
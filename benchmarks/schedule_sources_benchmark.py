@@ -0,0 +1,98 @@
+"""
+Бенчмарк чтения расписания из нескольких источников.
+
+Записывает синтетическое расписание филиалов в CSV-файлы (по файлу на
+филиал) и синхронизирует временную базу через ScheduleSync. Каждый
+источник перед чтением ждёт latency секунд, как при запросе к Google
+Sheets. Сравнивается чтение по одному источнику (max_workers=1) и
+параллельное: во втором случае время чтения должно быть близко к
+времени самого медленного источника, а не к их сумме.
+
+Запуск из корня репозитория:
+    python benchmarks/schedule_sources_benchmark.py --branches 6 --doctors 3000 --latency 0.5
+"""
+import argparse
+import asyncio
+import csv
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DAY_TITLES = (('mon', 'пн'), ('tue', 'вт'), ('wed', 'ср'), ('thu', 'чт'), ('fri', 'пт'), ('sat', 'сб'), ('sun', 'вс'))
+
+
+def writeBranchFiles(directory: str, doctors: int, branches: int) -> list:
+    """CSV-файл на каждый филиал в формате листа расписания; :return: пути к файлам"""
+    from synthetic import doctorRecords
+
+    names = [f"ПО №{10 + number}" for number in range(branches)]
+    paths = {name: os.path.join(directory, f"{name}.csv") for name in names}
+    files = {name: open(path, 'w', encoding='utf-8', newline='') for name, path in paths.items()}
+    try:
+        writers = {name: csv.writer(file, delimiter=';') for name, file in files.items()}
+        for writer in writers.values():
+            writer.writerow(['ФИО врача', 'Специализация'] + [title for _, title in DAY_TITLES])
+        for record in doctorRecords(doctors, branches=tuple(names)):
+            writers[record['branch']].writerow(
+                [record['doctor_name'], record['speciality']] + [record[day] for day, _ in DAY_TITLES]
+            )
+    finally:
+        for file in files.values():
+            file.close()
+    return list(paths.values())
+
+
+def delayedSource(source, latency: float):
+    """Источник, который перед чтением ждёт latency секунд (сетевой запрос)"""
+    fetch = source.fetch
+
+    def delayed():
+        time.sleep(latency)
+        return fetch()
+
+    source.fetch = delayed
+    return source
+
+
+async def run(args, directory: str):
+    from database import initDatabase, getDataVersion, pool
+    from schedule_sync import CsvScheduleSource, DoctorSchedule, ScheduleSync
+
+    initDatabase()
+    paths = writeBranchFiles(directory, args.doctors, args.branches)
+    print(f"Филиалов: {args.branches}, врачей: {args.doctors}, задержка источника: {args.latency} с")
+    for max_workers in args.workers:
+        sources = [delayedSource(CsvScheduleSource(path), args.latency) for path in paths]
+        sync = ScheduleSync(DoctorSchedule(sources, max_workers=max_workers))
+        started = time.perf_counter()
+        result = await sync.syncOnce()
+        elapsed = time.perf_counter() - started
+        slowest = max(sync.schedule.lastFetchTimings.values())
+        with pool.connection() as conn:
+            branches = conn.execute('SELECT COUNT(DISTINCT branch) FROM doctors').fetchone()[0]
+        print(
+            f"потоков {max_workers:>2}: синхронизация {elapsed:.3f} с, чтение {sync.lastTimings['fetch']:.3f} с "
+            f"(самый медленный источник {slowest:.3f} с), строк {sync.lastRows}, "
+            f"добавлено {len(result['inserted'])}, филиалов в базе {branches}, версия {getDataVersion()}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--branches', type=int, default=6)
+    parser.add_argument('--doctors', type=int, default=3000)
+    parser.add_argument('--latency', type=float, default=0.5, help='задержка ответа источника, с')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BOT_DATABASE'] = os.path.join(tmp, 'bench.db')
+        asyncio.run(run(args, tmp))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Микробенчмарк поиска врача по фамилии.
+
+Сравнивает прежний запрос LIKE из getDoctorsWithSurname с индексом
+SurnameIndex на синтетическом справочнике.
+
+Запуск из корня репозитория:
+    python benchmarks/search_benchmark.py --doctors 50000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SurnameIndex
+
+SURNAME_ROOTS = ['Иван', 'Петр', 'Сидор', 'Смирн', 'Кузнец', 'Поп', 'Сокол', 'Лебед', 'Козл',
+                 'Новик', 'Мороз', 'Волк', 'Алексе', 'Семён', 'Егор', 'Павл', 'Фёдор', 'Бел',
+                 'Никол', 'Орл', 'Андре', 'Макар', 'Захар', 'Зайц', 'Соловь', 'Борис', 'Яковл']
+SURNAME_MIDDLES = ['', 'ан', 'ин', 'ен', 'ок', 'уш', 'ищ', 'ар', 'ев', 'ял', 'ос', 'ук', 'им']
+SURNAME_ENDINGS = ['ов', 'ев', 'ин', 'ский', 'енко', 'ович', 'ых', 'ук']
+FIRST_NAMES = ['Иван', 'Анна', 'Мария', 'Олег', 'Пётр', 'Елена', 'Ольга', 'Сергей', 'Наталья']
+PATRONYMICS = ['Иванович', 'Петровна', 'Сергеевич', 'Андреевна', 'Олегович']
+SPECIALITIES = ['терапевт', 'стоматолог', 'кардиолог', 'хирург', 'невролог', 'офтальмолог']
+
+LIKE_QUERY = """
+    SELECT id, doctor_name, speciality
+    FROM doctors
+    WHERE doctor_name LIKE ? || '%'
+    ORDER BY doctor_name
+    LIMIT 20
+"""
+
+
+def generateDoctors(count: int, seed: int = 17):
+    rnd = random.Random(seed)
+    doctors = []
+    for doctor_id in range(1, count + 1):
+        surname = rnd.choice(SURNAME_ROOTS) + rnd.choice(SURNAME_MIDDLES) + rnd.choice(SURNAME_ENDINGS)
+        name = f"{surname} {rnd.choice(FIRST_NAMES)} {rnd.choice(PATRONYMICS)}"
+        doctors.append((doctor_id, name, rnd.choice(SPECIALITIES)))
+    return doctors
+
+
+def measure(func, queries, repeat: int) -> float:
+    """Среднее время одного запроса в микросекундах"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for query in queries:
+            func(query)
+    return (time.perf_counter() - started) / (repeat * len(queries)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--doctors', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    doctors = generateDoctors(args.doctors)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.db'))
+        conn.execute('CREATE TABLE doctors (id INTEGER PRIMARY KEY, doctor_name TEXT NOT NULL, speciality TEXT NOT NULL)')
+        conn.executemany('INSERT INTO doctors VALUES (?, ?, ?)', doctors)
+        conn.commit()
+
+        started = time.perf_counter()
+        index = SurnameIndex()
+        index.build(doctors)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        cases = {
+            'префикс': ['Кузнецов', 'Лебедок', 'Захарович', 'Соколин'],
+            'нижний регистр': ['кузнецов', 'лебедок', 'захарович', 'соколин'],
+            'ё и е': ['Федоров', 'Семенов', 'Семёнуш', 'Фёдорар'],
+            'опечатка': ['Кузнетсов', 'Саколов', 'Павлав', 'Белинскей'],
+        }
+
+        print(f"Врачей: {args.doctors}, построение индекса: {build_ms:.1f} мс")
+        print(f"{'запросы':<16}{'LIKE, мкс':>12}{'индекс, мкс':>14}{'найдено LIKE':>15}{'найдено индекс':>17}")
+        for title, queries in cases.items():
+            like_us = measure(lambda q: conn.execute(LIKE_QUERY, (q,)).fetchall(), queries, args.repeat)
+            index_us = measure(lambda q: index.search(q, limit=20), queries, args.repeat)
+            like_found = sum(len(conn.execute(LIKE_QUERY, (q,)).fetchall()) for q in queries)
+            index_found = sum(len(index.search(q, limit=20)[0]) for q in queries)
+            print(f"{title:<16}{like_us:>12.1f}{index_us:>14.1f}{like_found:>15}{index_found:>17}")
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Синтетические данные для бенчмарков: врачи в базе и обновления Telegram."""
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+SURNAME_ROOTS = ['Иван', 'Петр', 'Сидор', 'Смирн', 'Кузнец', 'Поп', 'Сокол', 'Лебед', 'Козл',
+                 'Новик', 'Мороз', 'Волк', 'Алексе', 'Семён', 'Егор', 'Павл', 'Фёдор', 'Бел',
+                 'Никол', 'Орл', 'Андре', 'Макар', 'Захар', 'Зайц', 'Соловь', 'Борис', 'Яковл']
+SURNAME_MIDDLES = ['', 'ан', 'ин', 'ен', 'ок', 'уш', 'ищ', 'ар', 'ев', 'ял', 'ос', 'ук', 'им']
+SURNAME_ENDINGS = ['ов', 'ев', 'ин', 'ский', 'енко', 'ович', 'ых', 'ук']
+FIRST_NAMES = ['Иван', 'Анна', 'Мария', 'Олег', 'Пётр', 'Елена', 'Ольга', 'Сергей', 'Наталья']
+PATRONYMICS = ['Иванович', 'Петровна', 'Сергеевич', 'Андреевна', 'Олегович']
+SPECIALITIES = ['терапевт', 'стоматолог', 'кардиолог', 'хирург', 'невролог', 'офтальмолог']
+HOURS = ['8:00-14:00', '14:00-20:00', '9-18', '10-17', 'выходной']
+
+
+def doctorRecords(count: int, seed: int = 17, branches: tuple = ('',)):
+    """Записи врачей в формате DoctorSchedule.fetch_source, врачи поровну распределены по филиалам"""
+    rnd = random.Random(seed)
+    records = []
+    for number in range(count):
+        surname = rnd.choice(SURNAME_ROOTS) + rnd.choice(SURNAME_MIDDLES) + rnd.choice(SURNAME_ENDINGS)
+        record = {
+            'branch': branches[number % len(branches)],
+            'doctor_name': f"{surname} {rnd.choice(FIRST_NAMES)} {rnd.choice(PATRONYMICS)} {number}",
+            'speciality': rnd.choice(SPECIALITIES),
+        }
+        for day in ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'):
+            record[day] = rnd.choice(HOURS)
+        records.append(record)
+    return records
+
+
+def seedDoctors(count: int, seed: int = 17):
+    """Заполняет таблицу doctors текущей базы (BOT_DATABASE) синтетическими врачами"""
+    from database import applyDoctorSnapshot, initDatabase
+    from schedule_sync import doctorRowsWithFingerprints
+
+    initDatabase()
+    return applyDoctorSnapshot(doctorRowsWithFingerprints(doctorRecords(count, seed)))
+
+
+def seedRatings(count: int, doctors: list, days: int = 90, seed: int = 17, batch_size: int = 100000):
+    """
+    Заполняет таблицу ratings синтетическими оценками за последние days дней
+    и пересчитывает итоги по врачам.
+
+    :param doctors: Пары (id, doctor_name)
+    """
+    from database import pool, rebuildRatingStats
+
+    rnd = random.Random(seed)
+    now = datetime.now()
+    span = days * 24 * 3600
+
+    def rows(size: int):
+        for _ in range(size):
+            doctor_id, name = doctors[rnd.randrange(len(doctors))]
+            visited = rnd.random() < 0.8
+            timestamp = (now - timedelta(seconds=rnd.randrange(span))).strftime('%Y-%m-%d %H:%M:%S')
+            yield (100000 + rnd.randrange(50000), doctor_id, name, visited,
+                   rnd.choice((1, 2, 3, 4, 4, 5, 5, 5)) if visited else None, timestamp)
+
+    for start in range(0, count, batch_size):
+        with pool.connection() as conn:
+            conn.executemany('''
+                INSERT INTO ratings (user_id, doctor_id, doctor_name, visited, rating, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows(min(batch_size, count - start)))
+    rebuildRatingStats()
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(chat_id: int) -> dict:
+    return {'id': chat_id, 'is_bot': False, 'first_name': 'Пациент', 'language_code': 'ru'}
+
+
+def messageUpdate(chat_id: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': _user(chat_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callbackUpdate(chat_id: int, data: str, message_id: int = 1) -> dict:
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(chat_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': 1000001, 'is_bot': True, 'first_name': 'Поликлиника'},
+                'text': 'Выберите врача из списка:',
+            },
+        },
+    }
@@ -0,0 +1,151 @@
+"""
+Сквозной бенчмарк режима webhook без Telegram.
+
+Поднимает заглушку Bot API, временную базу с синтетическими врачами и
+webhook-приложение бота, затем отправляет ему поток обновлений от многих
+чатов и измеряет, за сколько они обработаны при разных ограничениях
+параллельности.
+
+Запуск из корня репозитория:
+    python benchmarks/webhook_benchmark.py --updates 2000 --chats 200 --api-latency 0.02
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def freePort() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def buildUpdates(count: int, chats: int, doctor_ids: list, seed: int = 1) -> list:
+    """Смесь сценариев: /start, список врачей, листание, карточка врача, поиск"""
+    from callback_codec import doctorsPageRoute
+    from database import getDataVersion
+    from synthetic import callbackUpdate, messageUpdate
+
+    rnd = random.Random(seed)
+    version = getDataVersion()
+    updates = []
+    for _ in range(count):
+        chat_id = 100000 + rnd.randrange(chats)
+        kind = rnd.random()
+        if kind < 0.15:
+            updates.append(messageUpdate(chat_id, '/start'))
+        elif kind < 0.35:
+            updates.append(messageUpdate(chat_id, 'Расписание врачей'))
+        elif kind < 0.65:
+            updates.append(callbackUpdate(chat_id, doctorsPageRoute.pack(
+                direction='n', cursor=rnd.choice(doctor_ids), version=version
+            )))
+        elif kind < 0.9:
+            updates.append(callbackUpdate(chat_id, f'doctor_{rnd.choice(doctor_ids)}'))
+        else:
+            updates.append(messageUpdate(chat_id, 'Сегодняшнее расписание'))
+    return updates
+
+
+async def runOnce(main, api, updates: list, max_concurrent: int, senders: int) -> dict:
+    from aiohttp import ClientSession, web
+    from webhook import createWebhookApp
+
+    app = createWebhookApp(main.dp, main.bot, max_concurrent=max_concurrent)
+    scheduler = app['scheduler']
+    runner = web.AppRunner(app)
+    await runner.setup()
+    port = freePort()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    url = f'http://127.0.0.1:{port}/webhook'
+
+    calls_before = api.total
+    queue = list(reversed(updates))
+    started = time.perf_counter()
+
+    async def sender(session):
+        while queue:
+            update = queue.pop()
+            async with session.post(url, json=update) as response:
+                if response.status != 200:
+                    queue.insert(0, update)
+                    await asyncio.sleep(0.01)
+
+    async with ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(senders)))
+    while scheduler.pending:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+
+    await runner.cleanup()
+    return {
+        'max_concurrent': max_concurrent,
+        'updates': len(updates),
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(len(updates) / elapsed, 1),
+        'api_calls': api.total - calls_before,
+        'failed': scheduler.failed,
+    }
+
+
+async def run(args):
+    from fake_bot_api import FakeBotApi
+
+    api = FakeBotApi(latency=args.api_latency)
+    api_port = freePort()
+    os.environ['BOT_API_URL'] = f'http://127.0.0.1:{api_port}'
+    # Заглушка не ограничивает частоту запросов, измеряем саму обработку
+    os.environ['OUTGOING_RATE_LIMIT'] = '0'
+    await api.start(port=api_port)
+
+    from synthetic import seedDoctors
+    seeded = seedDoctors(args.doctors)
+    doctor_ids = seeded['inserted']
+
+    import main
+    await main.loadLocalSnapshot()
+    main.ratingQueue.start()
+
+    try:
+        for max_concurrent in args.concurrency:
+            updates = buildUpdates(args.updates, args.chats, doctor_ids)
+            result = await runOnce(main, api, updates, max_concurrent, args.senders)
+            print(
+                f"параллельно {result['max_concurrent']:>4}: {result['updates']} обновлений за "
+                f"{result['seconds']} с ({result['updates_per_second']} в с), "
+                f"вызовов API {result['api_calls']}, ошибок {result['failed']}"
+            )
+    finally:
+        await main.ratingQueue.stop()
+        await main.dp.storage.close()
+        await main.bot.session.close()
+        await api.stop()
+        main.closeDatabase()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--senders', type=int, default=32, help='одновременных HTTP-запросов к webhook')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка ответа заглушки Bot API, с')
+    parser.add_argument('--concurrency', type=lambda value: [int(v) for v in value.split(',')], default=[1, 16, 64])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BOT_DATABASE'] = os.path.join(tmp, 'bench.db')
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Бенчмарк многопроцессного режима: пропускная способность при разном числе воркеров.
+
+Поднимает заглушку Bot API и временную базу с синтетическими врачами,
+запускает WorkerPool с точкой входа main.runBotWorker и раздаёт воркерам
+тот же поток обновлений, что и webhook_benchmark. Время считается от
+первой отправки до момента, когда все воркеры отчитались об обработке.
+Рост числа обновлений в секунду ограничен числом ядер машины.
+
+Запуск из корня репозитория:
+    python benchmarks/workers_benchmark.py --updates 5000 --chats 500 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from webhook_benchmark import buildUpdates, freePort
+
+
+async def waitFor(condition, timeout: float, interval: float = 0.01) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+
+async def runOnce(count: int, updates: list, api) -> dict:
+    import main
+    from workers import WorkerPool
+
+    pool = WorkerPool(count, main.runBotWorker)
+    pool.start()
+    try:
+        if not await waitFor(lambda: all(worker['ready'] for worker in pool.health()), timeout=120):
+            raise RuntimeError('воркеры не запустились')
+        calls_before = api.total
+        started = time.perf_counter()
+        for update in updates:
+            while not pool.submit(update):
+                await asyncio.sleep(0.001)
+        await waitFor(lambda: pool.pending == 0, timeout=600)
+        elapsed = time.perf_counter() - started
+        return {
+            'workers': count,
+            'seconds': round(elapsed, 3),
+            'updates_per_second': round(len(updates) / elapsed, 1),
+            'api_calls': api.total - calls_before,
+            'failed': sum(worker['failed'] for worker in pool.health()),
+        }
+    finally:
+        await pool.stop()
+
+
+async def run(args):
+    from fake_bot_api import FakeBotApi
+
+    api = FakeBotApi(latency=args.api_latency)
+    api_port = freePort()
+    await api.start(port=api_port)
+    # Воркеры наследуют окружение: свой сервер Bot API и без ограничения частоты
+    os.environ['BOT_API_URL'] = f'http://127.0.0.1:{api_port}'
+    os.environ['OUTGOING_RATE_LIMIT'] = '0'
+
+    from synthetic import seedDoctors
+    doctor_ids = seedDoctors(args.doctors)['inserted']
+    updates = buildUpdates(args.updates, args.chats, doctor_ids)
+    print(f"Ядер: {os.cpu_count()}, обновлений: {len(updates)}, чатов: {args.chats}")
+    try:
+        for count in args.workers:
+            result = await runOnce(count, updates, api)
+            print(
+                f"воркеров {result['workers']:>2}: {result['seconds']} с "
+                f"({result['updates_per_second']} в с), вызовов API {result['api_calls']}, ошибок {result['failed']}"
+            )
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--doctors', type=int, default=1000)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка ответа заглушки Bot API, с')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BOT_DATABASE'] = os.path.join(tmp, 'bench.db')
+        asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
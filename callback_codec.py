@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from aiogram import F
+from database import dbRead, dbWrite, getCallbackQuery, saveCallbackQueries
+from keyboard_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину callback_data, байты UTF-8
+MAX_CALLBACK_BYTES = 64
+SEPARATOR = ':'
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+# Префиксы ссылки на запрос: текст прямо в callback_data или номер сохранённого запроса
+INLINE_QUERY, QUERY_HANDLE = '~', '#'
+# Сколько секунд хранится сохранённый запрос; у более старых кнопок поиск нужно повторить
+QUERY_HANDLE_TTL = 180 * 24 * 3600
+
+
+def toBase36(value: int) -> str:
+    if value < 0:
+        return '-' + toBase36(-value)
+    digits = []
+    while True:
+        value, digit = divmod(value, 36)
+        digits.append(_DIGITS[digit])
+        if not value:
+            return ''.join(reversed(digits))
+
+
+class CallbackRoute:
+    """
+    Компактный формат callback_data одного вида кнопок: «префикс:поле:поле».
+
+    Целые числа записываются в системе счисления по основанию 36, строки -
+    как есть; последнее поле может содержать разделитель. Длина проверяется
+    при упаковке, поэтому кнопка с callback_data длиннее 64 байт не
+    создаётся.
+    """
+
+    def __init__(self, prefix: str, *fields: Tuple[str, type]):
+        """
+        :param prefix: Короткий уникальный префикс вида кнопок
+        :param fields: Пары (имя поля, int или str) в порядке записи
+        """
+        self.prefix = prefix
+        self.fields = fields
+        # Фильтр aiogram для обработчика этого вида кнопок
+        self.filter = F.data.startswith(prefix + SEPARATOR)
+
+    def pack(self, **values) -> str:
+        parts = [self.prefix]
+        for name, kind in self.fields:
+            value = values[name]
+            parts.append(toBase36(value) if kind is int else str(value))
+        data = SEPARATOR.join(parts)
+        if len(data.encode('utf-8')) > MAX_CALLBACK_BYTES:
+            raise ValueError(f"callback_data длиннее {MAX_CALLBACK_BYTES} байт: {data}")
+        return data
+
+    def unpack(self, data: str) -> Optional[Dict]:
+        """:return: Поля кнопки или None, если callback_data другого вида или повреждена"""
+        parts = data.split(SEPARATOR, len(self.fields))
+        if parts[0] != self.prefix or len(parts) != len(self.fields) + 1:
+            return None
+        values = {}
+        try:
+            for (name, kind), part in zip(self.fields, parts[1:]):
+                values[name] = int(part, 36) if kind is int else part
+        except ValueError:
+            return None
+        return values
+
+    def budget(self, **values) -> int:
+        """Сколько байт остаётся последнему полю при остальных полях values"""
+        probe = self.pack(**values, **{self.fields[-1][0]: ''})
+        return MAX_CALLBACK_BYTES - len(probe.encode('utf-8'))
+
+
+class QueryHandles:
+    """
+    Ссылки на поисковые запросы для callback_data.
+
+    Короткий запрос записывается в кнопку целиком («~иванов»). Длинный
+    заменяется номером («#1x3k9z»), производным от текста запроса, а текст
+    сохраняется в базе, поэтому кнопки продолжают работать после перезапуска
+    и в любом воркере. Ссылка не зависит от пользователя: состояние чата для
+    листания не хранится.
+    """
+
+    def __init__(self, max_cached: int = 4096):
+        self._queries = LRUCache(max_cached)
+        self._unsaved: Dict[str, str] = {}
+
+    def token(self, query: str, budget: int) -> str:
+        """Ссылка на запрос, занимающая не больше budget байт"""
+        inline = INLINE_QUERY + query
+        if len(inline.encode('utf-8')) <= budget:
+            return inline
+        handle = toBase36(int.from_bytes(hashlib.blake2b(query.encode('utf-8'), digest_size=5).digest(), 'big'))
+        if self._queries.get(handle) is None:
+            self._queries.put(handle, query)
+            self._unsaved[handle] = query
+        return QUERY_HANDLE + handle
+
+    async def resolve(self, token: str) -> Optional[str]:
+        """:return: Текст запроса или None, если ссылка неизвестна"""
+        if token.startswith(INLINE_QUERY):
+            return token[len(INLINE_QUERY):]
+        if not token.startswith(QUERY_HANDLE):
+            return None
+        handle = token[len(QUERY_HANDLE):]
+        query = self._queries.get(handle)
+        if query is None:
+            query = await dbRead(getCallbackQuery, handle)
+            if query is not None:
+                self._queries.put(handle, query)
+        return query
+
+    async def flush(self):
+        """Сохраняет в базе запросы, получившие номер с прошлого вызова"""
+        if not self._unsaved:
+            return
+        rows = [(handle, query, time.time()) for handle, query in self._unsaved.items()]
+        self._unsaved = {}
+        try:
+            await dbWrite(saveCallbackQueries, rows, time.time() - QUERY_HANDLE_TTL)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить поисковые запросы: {e}")
+            for handle, query, _ in rows:
+                self._unsaved.setdefault(handle, query)
+
+
+# Страница общего списка врачей: направление (n - после, p - перед), id врача, версия справочника
+doctorsPageRoute = CallbackRoute('L', ('direction', str), ('cursor', int), ('version', int))
+# Страница результатов поиска: то же плюс ссылка на запрос
+searchPageRoute = CallbackRoute('S', ('direction', str), ('cursor', int), ('version', int), ('query', str))
+
+queryHandles = QueryHandles()
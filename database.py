@@ -1,97 +1,1007 @@
+import asyncio
+import os
+import queue
 import sqlite3
-from google.oauth2.service_account import Credentials
-import gspread
-from typing import Dict, List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Set
+from migrations import LATEST_VERSION, applyPragmas, migrate
 
-databaseFilename = 'database.db'
+databaseFilename = os.getenv('BOT_DATABASE', 'database.db')
+# Профиль PRAGMA соединений из migrations.PRAGMA_PROFILES
+databaseProfile = os.getenv('BOT_DATABASE_PROFILE', 'default')
 
 
+class ConnectionPool:
+    """
+    Ограниченный пул соединений SQLite в режиме WAL.
 
+    Чтения выполняются в отдельном пуле потоков, а все записи - в одном
+    выделенном потоке, поэтому запросы не блокируют event loop, а
+    медленная запись не мешает чтениям других пользователей.
+    """
 
+    def __init__(self, filename: str, readers: int = 4, timeout: float = 30.0, profile: str = 'default'):
+        """
+        :param filename: Путь к файлу базы данных
+        :param readers: Число потоков для чтения (плюс один поток записи)
+        :param timeout: Сколько секунд ждать блокировку или свободное соединение
+        :param profile: Профиль PRAGMA соединений (migrations.PRAGMA_PROFILES)
+        """
+        self.filename = filename
+        self.profile = profile
+        self.size = readers + 1
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=self.size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-read')
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        # observer(mode, имя функции, ожидание потока, длительность, результат, ошибка) -
+        # вызывается в потоке базы после каждого read/write, например для метрик
+        self.observer = None
+
+    @property
+    def created(self) -> int:
+        """Сколько соединений сейчас открыто (занятых и свободных)"""
+        return self._created
+
+    @property
+    def inUse(self) -> int:
+        """Сколько соединений сейчас занято запросами"""
+        return self._created - self._idle.qsize()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.filename, timeout=self.timeout, check_same_thread=False)
+        applyPragmas(conn, self.profile)
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        if self._closed:
+            raise RuntimeError('Пул соединений закрыт')
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=self.timeout)
+
+    def _release(self, conn: sqlite3.Connection):
+        if self._closed:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+        else:
+            self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение из пула; транзакция фиксируется при выходе без ошибок"""
+        conn = self._acquire()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._release(conn)
+
+    async def read(self, func, *args, **kwargs):
+        """Выполняет функцию чтения в пуле потоков, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._call, 'read', func, time.perf_counter(), args, kwargs)
+
+    async def write(self, func, *args, **kwargs):
+        """Выполняет функцию записи в единственном потоке записи"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._call, 'write', func, time.perf_counter(), args, kwargs)
+
+    def _call(self, mode: str, func, submitted: float, args: tuple, kwargs: dict):
+        observer = self.observer
+        if observer is None:
+            return func(*args, **kwargs)
+        started = time.perf_counter()
+        result = error = None
+        try:
+            result = func(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            observer(mode, func.__name__, started - submitted, time.perf_counter() - started, result, error)
+
+    def close(self):
+        """Дожидается выполнения запросов и закрывает все соединения"""
+        self._closed = True
+        self._readers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                # Обновляет статистику планировщика по таблицам, которые сильно изменились
+                conn.execute('PRAGMA optimize')
+            except sqlite3.Error:
+                pass
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+pool = ConnectionPool(databaseFilename, profile=databaseProfile)
+
+
+async def dbRead(func, *args, **kwargs):
+    return await pool.read(func, *args, **kwargs)
+
+
+async def dbWrite(func, *args, **kwargs):
+    return await pool.write(func, *args, **kwargs)
+
+
+def closeDatabase():
+    pool.close()
 
-def createConnection():
-    conn = sqlite3.connect(databaseFilename)
-    cursor = conn.cursor()
-    return conn, cursor 
 
 def createDoctorsTable():
-    conn, cursor = createConnection()
-    cursor.execute('''
-        CREATE TABLE  IF NOT EXISTS doctors(
-        id INTEGER PRIMARY KEY AUTOINCREMENT, 
-        doctor_name TEXT  NOT NULL, 
-        speciality TEXT NOT NULL, 
-        mon TEXT NOT NULL,
-        tue TEXT NOT NULL, 
-        wed TEXT NOT NULL, 
-        thu TEXT NOT NULL,
-        fri TEXT NOT NULL, 
-        sat TEXT NOT NULL, 
-        sun TEXT NOT NULL)
-    ''')
-    conn.commit()
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE  IF NOT EXISTS doctors(
+            id INTEGER PRIMARY KEY AUTOINCREMENT, 
+            doctor_name TEXT  NOT NULL, 
+            speciality TEXT NOT NULL, 
+            mon TEXT NOT NULL,
+            tue TEXT NOT NULL, 
+            wed TEXT NOT NULL, 
+            thu TEXT NOT NULL,
+            fri TEXT NOT NULL, 
+            sat TEXT NOT NULL, 
+            sun TEXT NOT NULL)
+        ''')
 
 
 def createRatingsTable():
-    conn, cursor = createConnection()
-    cursor.execute('''
-        CREATE TABLE  IF NOT EXISTS ratings (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        doctor_id INTEGER NOT NULL,
-        doctor_name TEXT NOT NULL,
-        visited BOOLEAN NOT NULL,
-        rating INTEGER,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, 
-        text_report TEXT
-    )
-    ''')
-    conn.commit()
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE  IF NOT EXISTS ratings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            doctor_id INTEGER NOT NULL,
+            doctor_name TEXT NOT NULL,
+            visited BOOLEAN NOT NULL,
+            rating INTEGER,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, 
+            text_report TEXT
+        )
+        ''')
+
+def createRatingStatsTable():
+    # Накопленные итоги оценок по врачу, обновляются при каждом сохранении оценки
+    with pool.connection() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'doctor_rating_stats'"
+        ).fetchone()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS doctor_rating_stats (
+            doctor_id INTEGER PRIMARY KEY,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            rating_count INTEGER NOT NULL DEFAULT 0,
+            rating_1 INTEGER NOT NULL DEFAULT 0,
+            rating_2 INTEGER NOT NULL DEFAULT 0,
+            rating_3 INTEGER NOT NULL DEFAULT 0,
+            rating_4 INTEGER NOT NULL DEFAULT 0,
+            rating_5 INTEGER NOT NULL DEFAULT 0,
+            visited_count INTEGER NOT NULL DEFAULT 0,
+            not_visited_count INTEGER NOT NULL DEFAULT 0)
+        ''')
+    if not exists:
+        rebuildRatingStats()
+
+
+def createFsmStatesTable():
+    # Состояния диалогов (FSM) пользователей, переживающие перезапуск бота
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL)
+        ''')
+
+
+def createMetaTable():
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL)
+        ''')
+
+
+def createOutboxTables():
+    # Получатели рассылок, рассылки и очередь исходящих сообщений
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS bot_users (
+            chat_id INTEGER PRIMARY KEY,
+            first_seen REAL NOT NULL,
+            blocked INTEGER NOT NULL DEFAULT 0)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            created_at REAL NOT NULL)
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            reply_markup TEXT,
+            priority INTEGER NOT NULL,
+            broadcast_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            sent_at REAL,
+            error TEXT)
+        ''')
+        # Выборка очередной пачки: ожидающие по приоритету, в порядке постановки
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_queue ON outbox (status, priority, id)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_broadcast ON outbox (broadcast_id, status)')
 
-def initDatabase(): 
+
+def createSubscriptionsTable():
+    # Подписки пользователей на изменения расписания врачей
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS doctor_subscriptions (
+            doctor_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (doctor_id, chat_id)) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_doctor_subscriptions_chat ON doctor_subscriptions (chat_id)')
+
+
+def createShiftTables():
+    # Интервалы приёма, разобранные из столбцов mon..sun, и ячейки, которые разобрать не удалось
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS doctor_shifts (
+            doctor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            PRIMARY KEY (doctor_id, weekday, start_minute)) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_doctor_shifts_time ON doctor_shifts (weekday, start_minute, end_minute)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS shift_parse_errors (
+            doctor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            error TEXT NOT NULL,
+            PRIMARY KEY (doctor_id, weekday)) WITHOUT ROWID
+        ''')
+
+
+def createCallbackQueriesTable():
+    # Длинные поисковые запросы, на которые кнопки листания ссылаются по номеру
+    with pool.connection() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS callback_queries (
+            handle TEXT PRIMARY KEY,
+            query TEXT NOT NULL,
+            saved_at REAL NOT NULL) WITHOUT ROWID
+        ''')
+
+
+def initDatabase(target: int = LATEST_VERSION) -> List[Dict]:
+    """
+    Создаёт недостающие таблицы и применяет миграции схемы (migrations.py).
+
+    :param target: Номер миграции, до которой обновить схему
+    :return: Применённые миграции
+    """
     createDoctorsTable()
     createRatingsTable()
+    createRatingStatsTable()
+    createMetaTable()
+    createFsmStatesTable()
+    createOutboxTables()
+    createSubscriptionsTable()
+    createShiftTables()
+    createCallbackQueriesTable()
+    with pool.connection() as conn:
+        return migrate(conn, target)
 
 
-def setOrUpdateDoctorRecord(name: str, spec: str ,mon: str, tue: str, wed: str , thu: str , fri:str , sat: str, sun: str):
-    conn, cursor = createConnection()
-    cursor.execute("SELECT id FROM doctors WHERE doctor_name = ?", (name,))
-    existing = cursor.fetchone()
+def getDoctorCountsByBranch() -> Dict[str, int]:
+    """:return: {филиал: число врачей} по таблице doctors"""
+    with pool.connection() as conn:
+        return dict(conn.execute('SELECT branch, COUNT(*) FROM doctors GROUP BY branch').fetchall())
 
-    if existing:
-        cursor.execute('''
-            UPDATE doctors SET
-                speciality = ?,
-                mon = ?, tue = ?, wed = ?, thu = ?,
-                fri = ?, sat = ?, sun = ?
-            WHERE doctor_name = ?
-        ''', (spec, mon, tue, wed, thu, fri, sat, sun, name))
-    else:
-        cursor.execute('''
+
+def getDataVersion() -> int:
+    """Версия данных врачей, увеличивается при каждой синхронизации с изменениями"""
+    with pool.connection() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def applyDoctorSnapshot(doctors: List[tuple], branches: Set[str] = None, removable: Set[int] = None) -> Dict:
+    """
+    Приводит таблицу doctors к переданному снимку одной транзакцией.
+
+    Изменённые строки находятся сравнением отпечатков, поэтому записываются
+    только новые и изменённые врачи, а отсутствующие в снимке удаляются.
+    Врач определяется парой (филиал, ФИО); строка без филиала, оставшаяся
+    от загрузки до разделения по филиалам, переходит к первому филиалу с
+    тем же ФИО и сохраняет id (а с ним оценки и подписки). Оценки и подписки
+    дубликатов переходят к оставляемой строке (mergeDoctorDuplicates), а
+    оценки удалённых из расписания врачей остаются в ratings с ФИО врача
+    и попадают в выгрузки; id врачей не переиспользуются (AUTOINCREMENT).
+
+    :param doctors: Кортежи (branch, doctor_name, speciality, mon, ..., sun, row_hash)
+    :param branches: Филиалы, за которые снимок отвечает; врачи других филиалов (например,
+                     из непрочитанного источника) не удаляются. По умолчанию - все филиалы
+    :param removable: Врачи, которых можно удалить, если их нет в снимке (например, не
+                      найденные и в прошлом снимке); остальные отсутствующие только
+                      возвращаются в missing. По умолчанию удаляются все отсутствующие
+    :return: Словарь с версией данных и id добавленных, изменённых и удалённых врачей;
+             schedule_changes - {id: {'name', 'days': [(номер дня, было, стало)]}} для врачей
+             с изменившимися днями приёма, removed - {id: ФИО} удалённых из расписания врачей,
+             missing - id отсутствующих в снимке, но оставленных врачей
+    """
+    with pool.connection() as conn:
+        existing = {}
+        duplicates = []
+        for doctor_id, branch, name, row_hash in conn.execute(
+            'SELECT id, branch, doctor_name, row_hash FROM doctors ORDER BY id'
+        ):
+            if (branch, name) in existing:
+                # Дубликаты имён от старой построчной загрузки
+                duplicates.append((doctor_id, existing[(branch, name)][0]))
+            else:
+                existing[(branch, name)] = (doctor_id, row_hash)
+
+        inserted, updates = [], []
+        updated_names = {}
+        seen = {doctor[:2] for doctor in doctors}
+        for doctor in doctors:
+            key, row_hash = doctor[:2], doctor[-1]
+            legacy = ('', key[1])
+            if key not in existing and legacy in existing and legacy not in seen:
+                existing[key] = existing.pop(legacy)
+            if key not in existing:
+                cursor = conn.execute('''
+                    INSERT INTO doctors (
+                        branch, doctor_name, speciality,
+                        mon, tue, wed, thu, fri, sat, sun, row_hash
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', doctor)
+                existing[key] = (cursor.lastrowid, row_hash)
+                inserted.append(cursor.lastrowid)
+            elif existing[key][1] != row_hash:
+                doctor_id = existing[key][0]
+                updates.append(doctor + (doctor_id,))
+                updated_names[doctor_id] = key[1]
+                existing[key] = (doctor_id, row_hash)
+
+        absent = {
+            doctor_id: key[1] for key, (doctor_id, _) in existing.items()
+            if key not in seen and (branches is None or key[0] in branches)
+        }
+        removed = {
+            doctor_id: name for doctor_id, name in absent.items() if removable is None or doctor_id in removable
+        }
+        deleted = [doctor_id for doctor_id, _ in duplicates] + list(removed)
+
+        # Старые дни приёма читаются только у изменённых врачей, до их перезаписи
+        old_days = {}
+        updated_ids = list(updated_names)
+        for start in range(0, len(updated_ids), 500):
+            chunk = updated_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            for row in conn.execute(
+                f'SELECT id, mon, tue, wed, thu, fri, sat, sun FROM doctors WHERE id IN ({placeholders})', chunk
+            ):
+                old_days[row[0]] = row[1:]
+
+        schedule_changes = {}
+        for update in updates:
+            doctor_id, new_days = update[-1], update[3:10]
+            days = [
+                (day, old, new)
+                for day, (old, new) in enumerate(zip(old_days.get(doctor_id, new_days), new_days))
+                if old != new
+            ]
+            if days:
+                schedule_changes[doctor_id] = {'name': updated_names[doctor_id], 'days': days}
+
+        if updates:
+            conn.executemany('''
+                UPDATE doctors SET
+                    branch = ?, doctor_name = ?, speciality = ?,
+                    mon = ?, tue = ?, wed = ?, thu = ?,
+                    fri = ?, sat = ?, sun = ?, row_hash = ?
+                WHERE id = ?
+            ''', updates)
+        if duplicates:
+            mergeDoctorDuplicates(conn, duplicates)
+        if removed:
+            conn.executemany('DELETE FROM doctors WHERE id = ?', [(doctor_id,) for doctor_id in removed])
+
+        row = conn.execute("SELECT value FROM meta WHERE key = 'data_version'").fetchone()
+        version = int(row[0]) if row else 0
+        if inserted or updates or deleted:
+            version += 1
+            conn.execute('''
+                INSERT INTO meta (key, value) VALUES ('data_version', ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (str(version),))
+
+    return {
+        'version': version,
+        'inserted': inserted,
+        'updated': [update[-1] for update in updates],
+        'deleted': deleted,
+        'schedule_changes': schedule_changes,
+        'removed': removed,
+        'missing': [doctor_id for doctor_id in absent if doctor_id not in removed],
+    }
+
+
+def setOrUpdateDoctorRecord(name: str, spec: str ,mon: str, tue: str, wed: str , thu: str , fri:str , sat: str, sun: str, branch: str = ''):
+    # ФИО уникально в филиале (idx_doctors_branch_name), поэтому запись - один запрос без предварительного SELECT
+    with pool.connection() as conn:
+        conn.execute('''
             INSERT INTO doctors (
-                doctor_name, speciality,
+                branch, doctor_name, speciality,
                 mon, tue, wed, thu, fri, sat, sun
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (name, spec, mon, tue, wed, thu, fri, sat, sun))
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(branch, doctor_name) DO UPDATE SET
+                speciality = excluded.speciality,
+                mon = excluded.mon, tue = excluded.tue, wed = excluded.wed, thu = excluded.thu,
+                fri = excluded.fri, sat = excluded.sat, sun = excluded.sun
+        ''', (branch, name, spec, mon, tue, wed, thu, fri, sat, sun))
 
-    conn.commit()
 
 def getAllDoctorsForTimetable():
-    conn, cursor = createConnection()
-    cursor.execute('''
-    SELECT id, doctor_name , speciality FROM doctors;   
-    ''')
-    result = cursor.fetchall()
-    return result
+    with pool.connection() as conn:
+        return conn.execute('''
+        SELECT id, doctor_name , speciality FROM doctors ORDER BY id;   
+        ''').fetchall()
+
+
+def getDoctorSchedules(doctor_ids: List[int] = None) -> List[tuple]:
+    """
+    Расписания врачей: (id, doctor_name, speciality, mon, ..., sun, branch).
+
+    :param doctor_ids: Выбрать только этих врачей; по умолчанию - всех
+    """
+    query = 'SELECT id, doctor_name, speciality, mon, tue, wed, thu, fri, sat, sun, branch FROM doctors'
+    with pool.connection() as conn:
+        if doctor_ids is None:
+            return conn.execute(query + ' ORDER BY id').fetchall()
+        rows = []
+        # Ограничение SQLite на число параметров в запросе
+        for start in range(0, len(doctor_ids), 500):
+            chunk = doctor_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            rows.extend(conn.execute(f'{query} WHERE id IN ({placeholders})', chunk).fetchall())
+        return rows
 
 
 def getDoctorsWithSurname(surname: str): 
-    conn, cursor = createConnection()
-    cursor.execute("""
-                SELECT id, doctor_name, speciality 
-                FROM doctors 
-                WHERE doctor_name LIKE ? || '%'
-                ORDER BY doctor_name
-                LIMIT 20
-            """, (surname,))
-    return cursor.fetchall()
+    with pool.connection() as conn:
+        return conn.execute("""
+                    SELECT id, doctor_name, speciality 
+                    FROM doctors 
+                    WHERE doctor_name LIKE ? || '%'
+                    ORDER BY doctor_name
+                    LIMIT 20
+                """, (surname,)).fetchall()
+
+
+# Функции для хранилища состояний FSM
+def loadFsmState(key: str):
+    """:return: (state, data в JSON, updated_at) или None"""
+    with pool.connection() as conn:
+        return conn.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,)).fetchone()
+
+
+def saveFsmStates(rows: List[tuple], deleted_keys: List[str]):
+    """
+    Записывает накопленные изменения состояний одной транзакцией.
+
+    :param rows: Кортежи (key, state, data в JSON, updated_at)
+    :param deleted_keys: Ключи очищенных состояний
+    """
+    with pool.connection() as conn:
+        if rows:
+            conn.executemany('''
+                INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+            ''', rows)
+        if deleted_keys:
+            conn.executemany('DELETE FROM fsm_states WHERE key = ?', [(key,) for key in deleted_keys])
+
+
+def deleteExpiredFsmStates(updated_before: float) -> int:
+    with pool.connection() as conn:
+        return conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (updated_before,)).rowcount
+
+
+# Функции для работы с рейтингами
+_RATING_STATS_UPSERT = '''
+    INSERT INTO doctor_rating_stats (
+        doctor_id, rating_sum, rating_count,
+        rating_1, rating_2, rating_3, rating_4, rating_5,
+        visited_count, not_visited_count
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(doctor_id) DO UPDATE SET
+        rating_sum = rating_sum + excluded.rating_sum,
+        rating_count = rating_count + excluded.rating_count,
+        rating_1 = rating_1 + excluded.rating_1,
+        rating_2 = rating_2 + excluded.rating_2,
+        rating_3 = rating_3 + excluded.rating_3,
+        rating_4 = rating_4 + excluded.rating_4,
+        rating_5 = rating_5 + excluded.rating_5,
+        visited_count = visited_count + excluded.visited_count,
+        not_visited_count = not_visited_count + excluded.not_visited_count
+'''
+
+
+def _ratingStatsDelta(doctor_id: int, visited: bool, rating: int = None) -> tuple:
+    """Приращение итогов врача для одной оценки"""
+    rated = bool(visited and rating)
+    histogram = tuple(int(rated and rating == value) for value in range(1, 6))
+    return (doctor_id, rating if rated else 0, int(rated), *histogram, int(bool(visited)), int(not visited))
+
+
+def saveRating(user_id: int, doctor_id: int, doctor_name: str, visited: bool, rating: int = None):
+    saveRatingsBatch([(user_id, doctor_id, doctor_name, visited, rating)])
+
+
+def saveRatingsBatch(ratings: List[tuple]):
+    """
+    Сохраняет пачку оценок одной транзакцией.
+
+    :param ratings: Кортежи (user_id, doctor_id, doctor_name, visited, rating)
+    """
+    deltas = {}
+    for _, doctor_id, _, visited, rating in ratings:
+        delta = _ratingStatsDelta(doctor_id, visited, rating)
+        if doctor_id in deltas:
+            delta = (doctor_id, *(a + b for a, b in zip(deltas[doctor_id][1:], delta[1:])))
+        deltas[doctor_id] = delta
+
+    with pool.connection() as conn:
+        conn.executemany('''
+        INSERT INTO ratings (user_id, doctor_id, doctor_name, visited, rating)
+        VALUES (?, ?, ?, ?, ?)
+        ''', ratings)
+        conn.executemany(_RATING_STATS_UPSERT, deltas.values())
+
+
+_RATING_STATS_REBUILD = '''
+    INSERT INTO doctor_rating_stats (
+        doctor_id, rating_sum, rating_count,
+        rating_1, rating_2, rating_3, rating_4, rating_5,
+        visited_count, not_visited_count
+    )
+    SELECT doctor_id,
+           COALESCE(SUM(CASE WHEN visited = 1 AND rating IS NOT NULL THEN rating END), 0),
+           SUM(visited = 1 AND rating IS NOT NULL),
+           SUM(visited = 1 AND rating = 1),
+           SUM(visited = 1 AND rating = 2),
+           SUM(visited = 1 AND rating = 3),
+           SUM(visited = 1 AND rating = 4),
+           SUM(visited = 1 AND rating = 5),
+           SUM(visited = 1),
+           SUM(visited = 0)
+    FROM ratings
+'''
+
+
+def rebuildRatingStats():
+    """Пересчитывает итоги оценок по всем врачам из таблицы ratings"""
+    with pool.connection() as conn:
+        conn.execute('DELETE FROM doctor_rating_stats')
+        conn.execute(_RATING_STATS_REBUILD + ' GROUP BY doctor_id')
+
+
+def mergeDoctorDuplicates(conn: sqlite3.Connection, duplicates: List[tuple]):
+    """
+    Удаляет строки-дубликаты врачей, перенося их данные на оставляемые строки.
+
+    Оценки и подписки переходят к оставляемому id, итоги оценок этого id
+    пересчитываются по таблице ratings; интервалы приёма и ошибки разбора
+    дубликата удаляются - они строятся заново из расписания. Выполняется
+    в транзакции вызывающего.
+
+    :param duplicates: Пары (id дубликата, id оставляемой строки)
+    """
+    moves = [(kept, doctor_id) for doctor_id, kept in duplicates]
+    conn.executemany('UPDATE OR IGNORE doctor_subscriptions SET doctor_id = ? WHERE doctor_id = ?', moves)
+    conn.executemany('UPDATE ratings SET doctor_id = ? WHERE doctor_id = ?', moves)
+    removed = [(doctor_id,) for doctor_id, _ in duplicates]
+    conn.executemany('DELETE FROM doctor_subscriptions WHERE doctor_id = ?', removed)
+    conn.executemany('DELETE FROM doctor_shifts WHERE doctor_id = ?', removed)
+    conn.executemany('DELETE FROM shift_parse_errors WHERE doctor_id = ?', removed)
+    conn.executemany('DELETE FROM doctors WHERE id = ?', removed)
+    kept = [(doctor_id,) for doctor_id in sorted({kept for _, kept in duplicates})]
+    conn.executemany('DELETE FROM doctor_rating_stats WHERE doctor_id = ?', removed + kept)
+    conn.executemany(_RATING_STATS_REBUILD + ' WHERE doctor_id = ? GROUP BY doctor_id', kept)
+
+
+def getDoctorStats(doctor_id: int) -> Dict:
+    with pool.connection() as conn:
+        row = conn.execute('''
+        SELECT rating_sum, rating_count, rating_1, rating_2, rating_3, rating_4, rating_5
+        FROM doctor_rating_stats
+        WHERE doctor_id = ?
+        ''', (doctor_id,)).fetchone()
+
+    rating_sum, count, *histogram = row or (0, 0, 0, 0, 0, 0, 0)
+    return {
+        'avg_rating': round(rating_sum / count, 1) if count else None,
+        'rating_count': count,
+        'histogram': dict(zip(range(1, 6), histogram)),
+    }
+
+
+
+def getRatingsPage(after: tuple, date_from: str, date_to: str, doctor_id: int = None, limit: int = 5000) -> List[tuple]:
+    """
+    Страница оценок за полуинтервал [date_from, date_to) в порядке (timestamp, id).
+
+    Страницы выбираются по ключу, поэтому каждая стоит O(log n + limit)
+    по индексу времени и не держит транзакцию между страницами.
+
+    :param after: (timestamp, id) последней строки предыдущей страницы или None для первой
+    :param date_from: Начало периода, 'YYYY-MM-DD' или 'YYYY-MM-DD HH:MM:SS' (UTC, как в базе)
+    :param date_to: Конец периода, не включается
+    :return: Кортежи (id, timestamp, doctor_id, doctor_name, visited, rating, user_id)
+    """
+    conditions, params = [], []
+    if doctor_id is not None:
+        conditions.append('doctor_id = ?')
+        params.append(doctor_id)
+    if after is None:
+        conditions.append('timestamp >= ?')
+        params.append(date_from)
+    else:
+        conditions.append('timestamp >= ? AND (timestamp > ? OR id > ?)')
+        params.extend((after[0], after[0], after[1]))
+    conditions.append('timestamp < ?')
+    params.append(date_to)
+    with pool.connection() as conn:
+        return conn.execute(f'''
+            SELECT id, timestamp, doctor_id, doctor_name, visited, rating, user_id
+            FROM ratings
+            WHERE {' AND '.join(conditions)}
+            ORDER BY timestamp, id
+            LIMIT ?
+        ''', (*params, limit)).fetchall()
+
+
+def getRatingWindows(since_long: str, since_short: str, until: str, doctor_id: int = None) -> List[tuple]:
+    """
+    Итоги оценок врачей за два окна, заканчивающихся в until.
+
+    :return: Кортежи (doctor_id, doctor_name, rating_sum_short, rating_count_short,
+             rating_sum_long, rating_count_long, visited_long, not_visited_long)
+    """
+    condition = 'doctor_id = ? AND ' if doctor_id is not None else ''
+    params = (since_short, since_short) + ((doctor_id,) if doctor_id is not None else ()) + (since_long, until)
+    with pool.connection() as conn:
+        return conn.execute(f'''
+            SELECT doctor_id, MAX(doctor_name),
+                   COALESCE(SUM(CASE WHEN timestamp >= ? AND visited = 1 THEN rating END), 0),
+                   SUM(timestamp >= ? AND visited = 1 AND rating IS NOT NULL),
+                   COALESCE(SUM(CASE WHEN visited = 1 THEN rating END), 0),
+                   SUM(visited = 1 AND rating IS NOT NULL),
+                   SUM(visited = 1),
+                   SUM(visited = 0)
+            FROM ratings
+            WHERE {condition}timestamp >= ? AND timestamp < ?
+            GROUP BY doctor_id
+            ORDER BY doctor_id
+        ''', params).fetchall()
+
+
+def getDailyRatings(date_from: str, date_to: str, doctor_id: int = None, offset_minutes: int = 0) -> List[tuple]:
+    """
+    Итоги оценок по дням за [date_from, date_to).
+
+    :param date_from: Начало периода в UTC, как в столбце timestamp
+    :param date_to: Конец периода в UTC, не включается
+    :param offset_minutes: Смещение часового пояса дней от UTC (для поликлиники - ratings_export.clinicOffsetMinutes)
+    :return: Кортежи (день 'YYYY-MM-DD', rating_sum, rating_count, visited, not_visited) по возрастанию дня
+    """
+    condition = 'doctor_id = ? AND ' if doctor_id is not None else ''
+    params = (f'{offset_minutes:+d} minutes',) + ((doctor_id,) if doctor_id is not None else ()) + (date_from, date_to)
+    with pool.connection() as conn:
+        return conn.execute(f'''
+            SELECT date(timestamp, ?) AS day,
+                   COALESCE(SUM(CASE WHEN visited = 1 THEN rating END), 0),
+                   SUM(visited = 1 AND rating IS NOT NULL),
+                   SUM(visited = 1),
+                   SUM(visited = 0)
+            FROM ratings
+            WHERE {condition}timestamp >= ? AND timestamp < ?
+            GROUP BY day
+            ORDER BY day
+        ''', params).fetchall()
+
+# Функции для работы с очередью исходящих сообщений
+def rememberChats(rows: List[tuple]):
+    """
+    Добавляет чаты в список получателей рассылок.
+
+    :param rows: Кортежи (chat_id, first_seen); заблокировавшие бота снова становятся получателями
+    """
+    with pool.connection() as conn:
+        conn.executemany('''
+            INSERT INTO bot_users (chat_id, first_seen) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET blocked = 0
+        ''', rows)
+
+
+def getActiveChatIds() -> List[int]:
+    with pool.connection() as conn:
+        return [row[0] for row in conn.execute('SELECT chat_id FROM bot_users WHERE blocked = 0')]
+
+
+def markChatsBlocked(chat_ids: List[int]):
+    with pool.connection() as conn:
+        conn.executemany('UPDATE bot_users SET blocked = 1 WHERE chat_id = ?', [(chat_id,) for chat_id in chat_ids])
+
+
+def enqueueOutbox(messages: List[tuple], now: float) -> List[int]:
+    """
+    Ставит сообщения в очередь отправки.
+
+    :param messages: Кортежи (chat_id, text, reply_markup в JSON или None, priority)
+    :return: id сообщений в очереди
+    """
+    with pool.connection() as conn:
+        return [
+            conn.execute('''
+                INSERT INTO outbox (chat_id, text, reply_markup, priority, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (chat_id, text, reply_markup, priority, now, now)).lastrowid
+            for chat_id, text, reply_markup, priority in messages
+        ]
+
+
+def createBroadcast(title: str, text: str, reply_markup: str, priority: int, now: float) -> Dict:
+    """Ставит в очередь сообщение всем активным получателям одной транзакцией"""
+    with pool.connection() as conn:
+        total = conn.execute('SELECT COUNT(*) FROM bot_users WHERE blocked = 0').fetchone()[0]
+        broadcast_id = conn.execute(
+            'INSERT INTO broadcasts (title, total, created_at) VALUES (?, ?, ?)', (title, total, now)
+        ).lastrowid
+        conn.execute('''
+            INSERT INTO outbox (chat_id, text, reply_markup, priority, broadcast_id, next_attempt_at, created_at)
+            SELECT chat_id, ?, ?, ?, ?, ?, ? FROM bot_users WHERE blocked = 0 ORDER BY chat_id
+        ''', (text, reply_markup, priority, broadcast_id, now, now))
+    return {'id': broadcast_id, 'total': total}
+
+
+def claimOutbox(now: float, limit: int) -> List[tuple]:
+    """
+    Забирает пачку сообщений, готовых к отправке, помечая их как отправляемые.
+
+    :return: Кортежи (id, chat_id, text, reply_markup, priority, broadcast_id, attempts)
+    """
+    with pool.connection() as conn:
+        rows = conn.execute('''
+            SELECT id, chat_id, text, reply_markup, priority, broadcast_id, attempts
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY priority, id
+            LIMIT ?
+        ''', (now, limit)).fetchall()
+        conn.executemany("UPDATE outbox SET status = 'sending' WHERE id = ?", [(row[0],) for row in rows])
+    return rows
+
+
+def completeOutbox(sent: List[tuple], retry: List[tuple], failed: List[tuple]):
+    """
+    Записывает результаты отправки пачки.
+
+    :param sent: Кортежи (sent_at, id)
+    :param retry: Кортежи (next_attempt_at, error, id)
+    :param failed: Кортежи (error, id)
+    """
+    with pool.connection() as conn:
+        conn.executemany("UPDATE outbox SET status = 'sent', attempts = attempts + 1, sent_at = ? WHERE id = ?", sent)
+        conn.executemany('''
+            UPDATE outbox SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?, error = ? WHERE id = ?
+        ''', retry)
+        conn.executemany("UPDATE outbox SET status = 'failed', attempts = attempts + 1, error = ? WHERE id = ?", failed)
+
+
+def resetOutboxClaims() -> int:
+    """Возвращает в очередь сообщения, отправка которых прервалась остановкой бота"""
+    with pool.connection() as conn:
+        return conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'").rowcount
+
+
+def purgeOutbox(finished_before: float) -> int:
+    """Удаляет давно обработанные сообщения рассылок и уведомлений"""
+    with pool.connection() as conn:
+        return conn.execute(
+            "DELETE FROM outbox WHERE status IN ('sent', 'failed') AND created_at < ?", (finished_before,)
+        ).rowcount
+
+
+def getBroadcastProgress(broadcast_id: int) -> Dict:
+    with pool.connection() as conn:
+        broadcast = conn.execute('SELECT title, total FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+        counts = dict(conn.execute(
+            'SELECT status, COUNT(*) FROM outbox WHERE broadcast_id = ? GROUP BY status', (broadcast_id,)
+        ).fetchall())
+    if broadcast is None:
+        return None
+    return {
+        'id': broadcast_id,
+        'title': broadcast[0],
+        'total': broadcast[1],
+        'sent': counts.get('sent', 0),
+        'failed': counts.get('failed', 0),
+        'pending': counts.get('pending', 0) + counts.get('sending', 0),
+    }
+
+
+# Функции для работы с подписками на изменения расписания
+def subscribeToDoctor(chat_id: int, doctor_id: int, now: float):
+    with pool.connection() as conn:
+        conn.execute(
+            'INSERT OR IGNORE INTO doctor_subscriptions (doctor_id, chat_id, created_at) VALUES (?, ?, ?)',
+            (doctor_id, chat_id, now)
+        )
+
+
+def unsubscribeFromDoctor(chat_id: int, doctor_id: int):
+    with pool.connection() as conn:
+        conn.execute('DELETE FROM doctor_subscriptions WHERE doctor_id = ? AND chat_id = ?', (doctor_id, chat_id))
+
+
+def isSubscribedToDoctor(chat_id: int, doctor_id: int) -> bool:
+    with pool.connection() as conn:
+        return conn.execute(
+            'SELECT 1 FROM doctor_subscriptions WHERE doctor_id = ? AND chat_id = ?', (doctor_id, chat_id)
+        ).fetchone() is not None
+
+
+def getDoctorSubscribers(doctor_ids: List[int]) -> List[tuple]:
+    """
+    Подписчики указанных врачей; читаются только их строки по первичному ключу.
+
+    :return: Кортежи (chat_id, doctor_id)
+    """
+    rows = []
+    with pool.connection() as conn:
+        for start in range(0, len(doctor_ids), 500):
+            chunk = doctor_ids[start:start + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            rows.extend(conn.execute(
+                f'SELECT chat_id, doctor_id FROM doctor_subscriptions WHERE doctor_id IN ({placeholders})', chunk
+            ).fetchall())
+    return rows
+
+
+def deleteDoctorSubscriptions(doctor_ids: List[int]):
+    with pool.connection() as conn:
+        conn.executemany('DELETE FROM doctor_subscriptions WHERE doctor_id = ?', [(doctor_id,) for doctor_id in doctor_ids])
+
+
+# Функции для работы с интервалами приёма
+def getShiftsVersion() -> int:
+    """Версия данных врачей, по которой построена таблица doctor_shifts"""
+    with pool.connection() as conn:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'shifts_version'").fetchone()
+    return int(row[0]) if row else -1
+
+
+def getDoctorShifts() -> List[tuple]:
+    """:return: Кортежи (doctor_id, weekday, start_minute, end_minute)"""
+    with pool.connection() as conn:
+        return conn.execute('SELECT doctor_id, weekday, start_minute, end_minute FROM doctor_shifts').fetchall()
+
+
+def replaceDoctorShifts(doctor_ids: List[int], shifts: List[tuple], errors: List[tuple], version: int) -> Dict:
+    """
+    Заменяет интервалы и ошибки разбора врачей одной транзакцией.
+
+    :param doctor_ids: Врачи, чьи строки заменяются; None - заменить таблицы целиком
+    :param shifts: Кортежи (doctor_id, weekday, start_minute, end_minute)
+    :param errors: Кортежи (doctor_id, weekday, value, error)
+    :param version: Версия данных врачей, по которой построены интервалы
+    :return: {'shifts': все интервалы после замены, как getDoctorShifts, 'errors': число ошибок разбора}
+    """
+    with pool.connection() as conn:
+        if doctor_ids is None:
+            conn.execute('DELETE FROM doctor_shifts')
+            conn.execute('DELETE FROM shift_parse_errors')
+        else:
+            ids = [(doctor_id,) for doctor_id in doctor_ids]
+            conn.executemany('DELETE FROM doctor_shifts WHERE doctor_id = ?', ids)
+            conn.executemany('DELETE FROM shift_parse_errors WHERE doctor_id = ?', ids)
+        conn.executemany(
+            'INSERT OR REPLACE INTO doctor_shifts (doctor_id, weekday, start_minute, end_minute) VALUES (?, ?, ?, ?)',
+            shifts
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO shift_parse_errors (doctor_id, weekday, value, error) VALUES (?, ?, ?, ?)', errors
+        )
+        conn.execute('''
+            INSERT INTO meta (key, value) VALUES ('shifts_version', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        ''', (str(version),))
+        return {
+            'shifts': conn.execute('SELECT doctor_id, weekday, start_minute, end_minute FROM doctor_shifts').fetchall(),
+            'errors': conn.execute('SELECT COUNT(*) FROM shift_parse_errors').fetchone()[0],
+        }
+
+
+def getShiftParseErrorCount() -> int:
+    with pool.connection() as conn:
+        return conn.execute('SELECT COUNT(*) FROM shift_parse_errors').fetchone()[0]
+
+
+def getShiftParseErrors() -> List[tuple]:
+    """:return: Кортежи (doctor_name, weekday, value, error) по ФИО и дню недели"""
+    with pool.connection() as conn:
+        return conn.execute('''
+            SELECT d.doctor_name, e.weekday, e.value, e.error
+            FROM shift_parse_errors e JOIN doctors d ON d.id = e.doctor_id
+            ORDER BY d.doctor_name, e.weekday
+        ''').fetchall()
+
+
+def saveCallbackQueries(rows: List[tuple], expire_before: float = None):
+    """
+    Сохраняет запросы кнопок листания и удаляет давно сохранённые.
+
+    :param rows: Кортежи (handle, query, saved_at)
+    :param expire_before: Удалить запросы, сохранённые раньше этого времени
+    """
+    with pool.connection() as conn:
+        conn.executemany('''
+            INSERT INTO callback_queries (handle, query, saved_at) VALUES (?, ?, ?)
+            ON CONFLICT(handle) DO UPDATE SET saved_at = excluded.saved_at
+        ''', rows)
+        if expire_before is not None:
+            conn.execute('DELETE FROM callback_queries WHERE saved_at < ?', (expire_before,))
+
+
+def getCallbackQuery(handle: str):
+    with pool.connection() as conn:
+        row = conn.execute('SELECT query FROM callback_queries WHERE handle = ?', (handle,)).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,62 @@
+from typing import Dict, List, Optional
+from database import dbRead, getDoctorSchedules
+
+WEEKDAY_LABELS = ('Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс')
+
+
+def renderSchedule(days: tuple) -> str:
+    """Строки расписания "Пн: ..." - "Вс: ..." для карточки врача"""
+    return "\n".join(f"{label}: {value}" for label, value in zip(WEEKDAY_LABELS, days))
+
+
+class DoctorCards:
+    """
+    Карточки врачей с заранее подготовленным текстом расписания.
+
+    Карточка ищется по doctors.id за O(1) без обращения к базе и Google Sheets.
+    После синхронизации перестраиваются только карточки изменившихся врачей.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._cards: Dict[int, Dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    def get(self, doctor_id: int) -> Optional[Dict]:
+        """
+        :return: {'name', 'speciality', 'branch', 'days', 'schedule'} или None, если врача нет
+        """
+        return self._cards.get(doctor_id)
+
+    def all(self) -> Dict[int, Dict]:
+        return self._cards
+
+    async def load(self, version: int = 0):
+        """Строит карточки всех врачей из локальной базы"""
+        self._cards = {row[0]: self._render(row) for row in await dbRead(getDoctorSchedules)}
+        self.version = version
+
+    async def apply(self, result: Dict):
+        """Обновляет карточки по результату синхронизации расписания"""
+        changed: List[int] = result['inserted'] + result['updated']
+        rows = await dbRead(getDoctorSchedules, changed) if changed else []
+        for doctor_id in result['deleted']:
+            self._cards.pop(doctor_id, None)
+        for row in rows:
+            self._cards[row[0]] = self._render(row)
+        self.version = result['version']
+
+    @staticmethod
+    def _render(row: tuple) -> Dict:
+        return {
+            'name': row[1],
+            'speciality': row[2],
+            'branch': row[10],
+            'days': row[3:10],
+            'schedule': renderSchedule(row[3:10]),
+        }
+
+
+doctorCards = DoctorCards()
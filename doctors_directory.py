@@ -0,0 +1,95 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+from database import getAllDoctorsForTimetable, dbRead
+
+
+DOCTORS_PER_PAGE = 7
+
+DoctorRow = Tuple[int, str, str]
+
+
+class DoctorDirectory:
+    """
+    Справочник врачей (id, ФИО, специализация) в памяти процесса.
+
+    Данные загружаются из таблицы doctors один раз и перечитываются только
+    после синхронизации расписания. Номер версии увеличивается при каждом
+    фактическом изменении данных, по нему можно сбрасывать зависимые кэши.
+
+    Страницы выбираются по ключу (keyset): курсором служит id врача,
+    поэтому перелистывание стоит O(log n) независимо от номера страницы.
+    """
+
+    def __init__(self):
+        self.version = 0
+        # Снимок подменяется одним присваиванием, чтобы обработчики
+        # никогда не видели наполовину обновлённые данные
+        self._snapshot: Tuple[List[int], List[DoctorRow], Dict[int, DoctorRow]] = ([], [], {})
+
+    def __len__(self) -> int:
+        return len(self._snapshot[1])
+
+    def load(self, doctors: List[DoctorRow], version: int = None) -> bool:
+        """
+        Загружает новый список врачей.
+
+        :param doctors: Строки (id, doctor_name, speciality)
+        :param version: Версия данных в базе; если не указана, версия увеличивается на 1
+        :return: True, если данные изменились
+        """
+        rows = sorted(tuple(doctor) for doctor in doctors)
+        if rows == self._snapshot[1]:
+            if version is not None:
+                self.version = version
+            return False
+
+        ids = [row[0] for row in rows]
+        self._snapshot = (ids, rows, {row[0]: row for row in rows})
+        self.version = self.version + 1 if version is None else version
+        return True
+
+    async def refresh(self, version: int = None) -> bool:
+        """
+        Перечитывает справочник из базы данных.
+
+        :param version: Версия данных после синхронизации; если она совпадает
+                        с загруженной, база данных не читается
+        """
+        if version is not None and version == self.version and len(self):
+            return False
+        return self.load(await dbRead(getAllDoctorsForTimetable), version)
+
+    def all(self) -> List[DoctorRow]:
+        """Все врачи, упорядоченные по id"""
+        return self._snapshot[1]
+
+    def get(self, doctor_id: int) -> Optional[DoctorRow]:
+        return self._snapshot[2].get(doctor_id)
+
+    def pageAfter(self, after_id: int = 0, limit: int = DOCTORS_PER_PAGE):
+        """
+        Страница врачей с id больше after_id.
+
+        :return: (врачи страницы, есть ли предыдущая, есть ли следующая)
+        """
+        ids, rows, _ = self._snapshot
+        start = bisect_right(ids, after_id)
+        return self._page(rows, start, limit)
+
+    def pageBefore(self, before_id: int, limit: int = DOCTORS_PER_PAGE):
+        """
+        Страница врачей, непосредственно предшествующих before_id.
+
+        :return: (врачи страницы, есть ли предыдущая, есть ли следующая)
+        """
+        ids, rows, _ = self._snapshot
+        end = bisect_left(ids, before_id)
+        return self._page(rows, max(0, end - limit), limit)
+
+    @staticmethod
+    def _page(rows: List[DoctorRow], start: int, limit: int):
+        end = start + limit
+        return rows[start:end], start > 0, end < len(rows)
+
+
+doctorDirectory = DoctorDirectory()
@@ -0,0 +1,136 @@
+import logging
+import re
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+from faq import stemRussian
+from texts import Messages
+
+logger = logging.getLogger(__name__)
+
+_WORDS = re.compile(r'[0-9a-zа-я]+')
+
+# Фразы, после которых бот сразу отправляет номера экстренных служб.
+# Сравниваются основы слов, поэтому "не могу дышать" и "не может дышать" -
+# одна фраза. Отдельные слова сюда не входят: основа "сердц" или "плох"
+# совпала бы с фамилиями (Сердцев, Плохов) и словами вроде "скоро"
+EMERGENCY_PHRASES = (
+    'не могу дышать', 'трудно дышать', 'не дышит', 'потерял сознание', 'потеряла сознание', 'без сознания',
+    'анафилактический шок', 'отек квинке', 'онемела рука', 'перекосило лицо', 'покончить с собой',
+)
+
+# Отдельные слова-триггеры сравниваются целиком, только в перечисленных формах
+EMERGENCY_WORDS = frozenset((
+    'плохо', 'скорая', 'скорую', 'скорой', 'сердце', 'сердцем', 'сердца', 'давление', 'давления',
+    'боль', 'боли', 'болью', 'больно', 'болит', 'умираю', 'умирает', 'задыхаюсь', 'задыхается',
+    'обморок', 'инсульт', 'инфаркт', 'судороги', 'кровотечение', 'травма', 'травму', 'перелом',
+    'ожог', 'отравление', 'парализовало',
+))
+
+
+def findEmergencyWord(text: str) -> Optional[str]:
+    """:return: Первое слово текста из EMERGENCY_WORDS или None"""
+    return next((word for word in _WORDS.findall(text.casefold().replace('ё', 'е')) if word in EMERGENCY_WORDS), None)
+
+
+def normalizeWords(text: str) -> str:
+    """Основы слов текста через пробел и с пробелами по краям, например « мне плох »"""
+    words = _WORDS.findall(text.casefold().replace('ё', 'е'))
+    return f" {' '.join(stemRussian(word) for word in words)} "
+
+
+class PhraseAutomaton:
+    """
+    Автомат Ахо-Корасик для поиска многих фраз за один проход.
+
+    Фразы и текст приводятся к основам слов; фраза ищется с пробелами по
+    краям, то есть только целыми словами. Проход по тексту стоит амортизированно
+    O(1) на символ и не зависит от числа фраз.
+    """
+
+    def __init__(self, phrases: Tuple[str, ...]):
+        self.phrases = tuple(phrases)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Номер найденной фразы для состояния (с учётом суффиксных ссылок) или -1
+        self._output: List[int] = [-1]
+        for number, phrase in enumerate(self.phrases):
+            self._add(normalizeWords(phrase), number)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def _add(self, pattern: str, number: int):
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(-1)
+                self._goto[state][char] = next_state
+            state = next_state
+        if self._output[state] == -1:
+            self._output[state] = number
+
+    def _link(self):
+        # Суффиксные ссылки строятся обходом в ширину
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                if self._output[next_state] == -1:
+                    self._output[next_state] = self._output[self._fail[next_state]]
+
+    def find(self, text: str) -> Optional[str]:
+        """:return: Первая найденная в тексте фраза или None"""
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in normalizeWords(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state] != -1:
+                return self.phrases[output[state]]
+        return None
+
+
+class EmergencyMiddleware(BaseMiddleware):
+    """
+    Внешний middleware сообщений: проверяет каждое сообщение до FSM и роутеров.
+
+    Если в тексте есть признак опасного состояния, пользователь сразу
+    получает номера экстренных служб, а обработчик не вызывается.
+    В состояниях name_states (ввод фамилии врача) проверяются только
+    фразы: одно слово там - фамилия, а не жалоба.
+    """
+
+    def __init__(self, phrases: Tuple[str, ...] = EMERGENCY_PHRASES, name_states: Tuple[str, ...] = ()):
+        self.automaton = PhraseAutomaton(phrases)
+        self.name_states = frozenset(name_states)
+        self.detected = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: Dict[str, Any],
+    ) -> Any:
+        text = event.text or event.caption
+        if text:
+            phrase = self.automaton.find(text)
+            if phrase is None and data.get('raw_state') not in self.name_states:
+                phrase = findEmergencyWord(text)
+            if phrase is not None:
+                self.detected += 1
+                logger.warning(f"Экстренное сообщение в чате {event.chat.id}: «{phrase}»")
+                await event.answer(Messages.EMERGENCY_MESSAGE, parse_mode="HTML")
+                return None
+        return await handler(event, data)
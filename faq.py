@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+FAQ_FILE = os.getenv('FAQ_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'faq.json'))
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Вес слова в вопросе и ключевых словах относительно слова в ответе
+FIELD_WEIGHTS = {'question': 3.0, 'keywords': 2.0, 'answer': 1.0}
+# Минимальная оценка, с которой сообщение считается вопросом из FAQ
+MIN_SCORE = 2.0
+# Слова, встречающиеся в большей доле записей, не используются для отбора кандидатов
+MAX_POSTING_SHARE = 0.05
+# В небольшом FAQ все слова дают кандидатов
+MIN_POSTINGS = 256
+# Во сколько раз лучший ответ должен опережать второй, чтобы отвечать сразу, а не предлагать варианты
+CONFIDENT_RATIO = 1.5
+
+_WORDS = re.compile(r'[0-9a-zа-я]+')
+
+STOP_WORDS = frozenset('''
+    а без бы в вам вас во вот вы где да для до если есть же за и из или им их к как ко когда кто ли
+    либо мне мной мы на над не нет ни но ну о об от по под при про с со так то тоже только у уже
+    хочу хотел хотела чем что чтобы это этот я можно нужно надо подскажите пожалуйста скажите
+    здравствуйте добрый день вечер утро спасибо мой моя мое мои свой
+'''.split())
+
+# Стеммер Портера для русского языка (алгоритм Snowball)
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+
+
+@lru_cache(maxsize=50000)
+def stemRussian(word: str) -> str:
+    """Основа слова, например у «анализов» и «анализы» - «анализ»"""
+    match = _RV.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    stripped = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if stripped == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        stripped = _ADJECTIVE.sub('', rv, 1)
+        if stripped != rv:
+            rv = _PARTICIPLE.sub('', stripped, 1)
+        else:
+            stripped = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    if _DERIVATIONAL.match(rv):
+        rv = re.sub(r'ость?$', '', rv)
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """Основы значимых слов текста"""
+    words = _WORDS.findall(text.casefold().replace('ё', 'е'))
+    return [stemRussian(word) for word in words if word not in STOP_WORDS]
+
+
+def loadFaqEntries(path: str = FAQ_FILE) -> List[Dict]:
+    """
+    :return: Записи {'question', 'answer', 'keywords'} из JSON-файла
+    """
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+class FaqIndex:
+    """
+    Инвертированный индекс FAQ с ранжированием BM25.
+
+    Вопрос, ключевые слова и ответ каждой записи разбиваются на основы слов;
+    слова вопроса весят больше слов ответа. Для каждой основы заранее
+    посчитан вклад BM25 в оценку каждой записи, поэтому поиск - это сумма
+    по спискам вхождений слов сообщения, без перебора записей. Кандидатов
+    дают только редкие слова; частые лишь добавляют свой вклад к уже
+    найденным записям, поэтому время поиска не растёт вместе с корпусом.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.entries: List[Dict] = []
+        self._postings: Dict[str, List[Tuple[int, float]]] = {}
+        # Вклад частых слов по номеру записи
+        self._common: Dict[str, Dict[int, float]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def build(self, entries: List[Dict]):
+        """
+        :param entries: Записи {'question', 'answer', 'keywords'}
+        """
+        frequencies = []
+        for entry in entries:
+            weighted = Counter()
+            fields = {
+                'question': entry['question'],
+                'keywords': ' '.join(entry.get('keywords', ())),
+                'answer': re.sub(r'<[^>]+>', ' ', entry['answer']),
+            }
+            for field, text in fields.items():
+                for term in tokenize(text):
+                    weighted[term] += FIELD_WEIGHTS[field]
+            frequencies.append(weighted)
+
+        lengths = [sum(weighted.values()) for weighted in frequencies]
+        average = sum(lengths) / len(lengths) if lengths else 1.0
+        documents = defaultdict(list)
+        for doc_idx, weighted in enumerate(frequencies):
+            for term, frequency in weighted.items():
+                documents[term].append((doc_idx, frequency))
+
+        postings = {}
+        for term, docs in documents.items():
+            idf = math.log(1 + (len(entries) - len(docs) + 0.5) / (len(docs) + 0.5))
+            postings[term] = [
+                (doc_idx, idf * frequency * (BM25_K1 + 1) / (
+                    frequency + BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc_idx] / average)
+                ))
+                for doc_idx, frequency in docs
+            ]
+
+        max_postings = max(MIN_POSTINGS, int(len(entries) * MAX_POSTING_SHARE))
+        self.entries = entries
+        self._postings = postings
+        self._common = {term: dict(docs) for term, docs in postings.items() if len(docs) > max_postings}
+        self.version += 1
+
+    def search(self, text: str, limit: int = 3) -> List[Tuple[int, float]]:
+        """
+        :return: До limit пар (номер записи, оценка) с оценкой не ниже MIN_SCORE, лучшие первыми
+        """
+        terms = [term for term in set(tokenize(text)) if term in self._postings]
+        if not terms:
+            return []
+        rare = [term for term in terms if term not in self._common]
+        if not rare:
+            # Все слова частые: кандидатов даёт самое редкое из них
+            rare = [min(terms, key=lambda term: len(self._postings[term]))]
+
+        scores = defaultdict(float)
+        for term in rare:
+            for doc_idx, weight in self._postings[term]:
+                scores[doc_idx] += weight
+        for term in terms:
+            if term in rare:
+                continue
+            weights = self._common[term]
+            for doc_idx in scores:
+                scores[doc_idx] += weights.get(doc_idx, 0.0)
+        ranked = sorted(scores.items(), key=lambda item: -item[1])
+        return [(doc_idx, score) for doc_idx, score in ranked[:limit] if score >= MIN_SCORE]
+
+    def match(self, text: str) -> Tuple[Optional[int], List[int]]:
+        """
+        Разбирает свободный вопрос пользователя.
+
+        :return: (номер записи, если ответ однозначен, иначе None; номера подходящих записей)
+        """
+        found = self.search(text)
+        if not found:
+            return None, []
+        if len(found) == 1 or found[0][1] >= found[1][1] * CONFIDENT_RATIO:
+            return found[0][0], [found[0][0]]
+        return None, [doc_idx for doc_idx, _ in found]
+
+
+faqIndex = FaqIndex()
@@ -0,0 +1,161 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from database import dbRead, dbWrite, deleteExpiredFsmStates, loadFsmState, saveFsmStates
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в таблице fsm_states базы database.db.
+
+    Состояния активных пользователей держатся в памяти (горячий уровень
+    ограниченного размера), а изменения копятся и записываются в базу одной
+    транзакцией раз в flush_interval секунд, поэтому несколько подряд
+    set_state/update_data превращаются в одну запись. Состояния, не менявшиеся
+    дольше ttl секунд, удаляются и из памяти, и из базы.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 24 * 60 * 60,
+        max_hot: int = 10000,
+        flush_interval: float = 0.5,
+        sweep_interval: float = 10 * 60,
+    ):
+        self.ttl = ttl
+        self.max_hot = max_hot
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        # key -> [state, data, updated_at]
+        self._hot: "OrderedDict[str, list]" = OrderedDict()
+        self._dirty = set()
+        self._tasks = []
+        self._closed = False
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) if part is not None else "" for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    def _ensureStarted(self):
+        if not self._tasks and not self._closed:
+            self._tasks = [
+                asyncio.create_task(self._flushLoop()),
+                asyncio.create_task(self._sweepLoop()),
+            ]
+
+    async def _entry(self, key: str) -> list:
+        entry = self._hot.get(key)
+        if entry is not None:
+            self._hot.move_to_end(key)
+            return entry
+
+        row = await dbRead(loadFsmState, key)
+        # Пока шло чтение, состояние могли изменить - тогда оно новее базы
+        entry = self._hot.get(key)
+        if entry is None:
+            if row and row[2] >= time.time() - self.ttl:
+                entry = [row[0], json.loads(row[1]), row[2]]
+            else:
+                entry = [None, {}, time.time()]
+            self._hot[key] = entry
+            self._evict()
+        return entry
+
+    def _touch(self, key: str, entry: list):
+        entry[2] = time.time()
+        self._dirty.add(key)
+        self._ensureStarted()
+
+    def _evict(self):
+        """Вытесняет давно не использованные состояния, уже записанные в базу"""
+        excess = len(self._hot) - self.max_hot
+        if excess <= 0:
+            return
+        for key in list(self._hot):
+            if key not in self._dirty:
+                del self._hot[key]
+                excess -= 1
+                if excess <= 0:
+                    break
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key(key)
+        entry = await self._entry(storage_key)
+        entry[0] = state.state if isinstance(state, State) else state
+        self._touch(storage_key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(self._key(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self._key(key)
+        entry = await self._entry(storage_key)
+        entry[1] = copy.deepcopy(dict(data))
+        self._touch(storage_key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy((await self._entry(self._key(key)))[1])
+
+    async def flush(self):
+        """Записывает все накопленные изменения одной транзакцией"""
+        if not self._dirty:
+            return
+        keys, self._dirty = self._dirty, set()
+        rows, deleted = [], []
+        for key in keys:
+            entry = self._hot.get(key)
+            if entry is None or (entry[0] is None and not entry[1]):
+                deleted.append(key)
+            else:
+                rows.append((key, entry[0], json.dumps(entry[1], ensure_ascii=False), entry[2]))
+        try:
+            await dbWrite(saveFsmStates, rows, deleted)
+        except Exception:
+            # Повторим при следующей записи
+            self._dirty |= keys
+            raise
+        self._evict()
+
+    async def sweep(self):
+        """Удаляет состояния, не менявшиеся дольше ttl"""
+        expired_before = time.time() - self.ttl
+        for key in [key for key, entry in self._hot.items() if entry[2] < expired_before]:
+            if key not in self._dirty:
+                del self._hot[key]
+        removed = await dbWrite(deleteExpiredFsmStates, expired_before)
+        if removed:
+            logger.info(f"Удалено устаревших состояний диалогов: {removed}")
+
+    async def _flushLoop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи состояний диалогов: {e}")
+
+    async def _sweepLoop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Ошибка очистки состояний диалогов: {e}")
+
+    async def close(self) -> None:
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
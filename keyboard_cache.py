@@ -0,0 +1,72 @@
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+
+class LRUCache:
+    """Словарь ограниченного размера, вытесняющий давно не использованные записи"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+class KeyboardCache:
+    """
+    Кэш готовых InlineKeyboardMarkup.
+
+    Ключ - (вид клавиатуры, страница или запрос, версия данных), поэтому после
+    синхронизации устаревшие клавиатуры не выдаются, а invalidate освобождает
+    занятую ими память. Результаты поиска хранятся в отдельном LRU, чтобы
+    поток уникальных запросов не вытеснял страницы общего списка.
+    """
+
+    def __init__(self, max_pages: int = 4096, max_searches: int = 1024):
+        self.version = 0
+        self._pages = LRUCache(max_pages)
+        self._searches = LRUCache(max_searches)
+        self.hits = 0
+        self.misses = 0
+
+    def page(self, kind: str, key: Hashable, version: int, build: Callable):
+        return self._get(self._pages, (kind, key, version), build)
+
+    def search(self, kind: str, query: str, version: int, build: Callable):
+        return self._get(self._searches, (kind, query, version), build)
+
+    def invalidate(self, version: int):
+        """Сбрасывает клавиатуры, построенные по предыдущим версиям данных"""
+        if version != self.version:
+            self.version = version
+            self._pages.clear()
+            self._searches.clear()
+
+    def _get(self, cache: LRUCache, key: tuple, build: Callable):
+        markup = cache.get(key)
+        if markup is None:
+            self.misses += 1
+            markup = build()
+            cache.put(key, markup)
+        else:
+            self.hits += 1
+        return markup
+
+
+keyboardCache = KeyboardCache()
@@ -1,8 +1,14 @@
-from aiogram import Bot, Dispatcher, types
+from aiogram import types
 from texts import Buttons
-from database import getAllDoctorsForTimetable, getDoctorsWithSurname
-from aiogram.utils.keyboard import InlineKeyboardBuilder
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from doctors_directory import doctorDirectory
+from search_index import surnameIndex, normalizeName
+from keyboard_cache import keyboardCache
+from today_index import todayIndex
+from shifts import formatMinutes
+from faq import faqIndex
+from callback_codec import doctorsPageRoute, searchPageRoute, queryHandles
+from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from aiogram.types import InlineKeyboardButton
 
 
 beginningKeyboard = types.ReplyKeyboardMarkup(
@@ -14,17 +20,87 @@ beginningKeyboard = types.ReplyKeyboardMarkup(
 )
 
 
+# Статичные клавиатуры строятся один раз при запуске
+def buildMainKeyboard():
+    builder = ReplyKeyboardBuilder()
+    builder.row(
+        types.KeyboardButton(text="Расписание врачей"),
+        types.KeyboardButton(text="Сегодняшнее расписание")
+    )
+    builder.row(
+        types.KeyboardButton(text="Контакты поликлиники"),
+        types.KeyboardButton(text="FAQ")
+    )
+    builder.row(types.KeyboardButton(text="Кто принимает сейчас"))
+    return builder.as_markup(resize_keyboard=True)
+
+def buildVisitKeyboard():
+    """Клавиатура для вопроса о посещении врача"""
+    builder = ReplyKeyboardBuilder()
+    builder.add(types.KeyboardButton(text="Да"))
+    builder.add(types.KeyboardButton(text="Нет"))
+    builder.adjust(2)  # Располагаем кнопки в 2 колонки
+    return builder.as_markup(resize_keyboard=True)
 
-def generateDoctorsInlineKeyboard(page: int = 0):
-    doctors = getAllDoctorsForTimetable()
+def buildRatingKeyboard():
+    """Клавиатура для оценки врача"""
+    builder = ReplyKeyboardBuilder()
+    for rating in range(1, 6):
+        builder.add(types.KeyboardButton(text=str(rating)))
+    builder.adjust(5)  # Все 5 кнопок в один ряд
+    return builder.as_markup(resize_keyboard=True)
+
+
+def buildGorzdravKeyboard():
+    # Inline-кнопка с ссылкой на Горздрав под карточкой врача
     builder = InlineKeyboardBuilder()
-    
-    # Разбиваем список на страницы по 7 врачей
-    doctors_per_page = 7
-    total_pages = (len(doctors) + doctors_per_page - 1) // doctors_per_page
-    start_idx = page * doctors_per_page
-    end_idx = start_idx + doctors_per_page
-    page_doctors = doctors[start_idx:end_idx]
+    builder.add(types.InlineKeyboardButton(
+        text="Записаться на прием через Горздрав",
+        url="https://gorzdrav.spb.ru/"
+    ))
+    return builder.as_markup()
+
+
+mainKeyboard = buildMainKeyboard()
+visitKeyboard = buildVisitKeyboard()
+ratingKeyboard = buildRatingKeyboard()
+gorzdravKeyboard = buildGorzdravKeyboard()
+
+
+def generateDoctorCardKeyboard(doctor_id: int, subscribed: bool):
+    return keyboardCache.page(
+        'card', (doctor_id, subscribed), doctorDirectory.version,
+        lambda: buildDoctorCardKeyboard(doctor_id, subscribed)
+    )
+
+
+def buildDoctorCardKeyboard(doctor_id: int, subscribed: bool):
+    # Запись через Горздрав и подписка на изменения расписания врача
+    builder = InlineKeyboardBuilder()
+    builder.row(*gorzdravKeyboard.inline_keyboard[0])
+    if subscribed:
+        builder.row(InlineKeyboardButton(text="🔕 Отписаться от изменений расписания", callback_data=f"unsub_{doctor_id}"))
+    else:
+        builder.row(InlineKeyboardButton(text="🔔 Сообщать об изменениях расписания", callback_data=f"sub_{doctor_id}"))
+    return builder.as_markup()
+
+
+def generateDoctorsInlineKeyboard(after_id: int = 0, before_id: int = None):
+    # Страница зависит только от курсора и версии справочника
+    return keyboardCache.page(
+        'doctors', (after_id, before_id), doctorDirectory.version,
+        lambda: buildDoctorsInlineKeyboard(after_id, before_id)
+    )
+
+
+def buildDoctorsInlineKeyboard(after_id: int = 0, before_id: int = None):
+    builder = InlineKeyboardBuilder()
+
+    # Выбираем страницу по ключу: по 7 врачей после after_id или перед before_id
+    if before_id is not None:
+        page_doctors, has_prev, has_next = doctorDirectory.pageBefore(before_id)
+    else:
+        page_doctors, has_prev, has_next = doctorDirectory.pageAfter(after_id)
     
     # Добавляем кнопки врачей
     for doctor_id, name, speciality in page_doctors:
@@ -34,15 +110,16 @@ def generateDoctorsInlineKeyboard(page: int = 0):
         )
     
     # Добавляем кнопки пагинации
+    # В кнопках - курсор и версия справочника, по которой построена страница
     pagination_buttons = []
-    if page > 0:
-        pagination_buttons.append(
-            InlineKeyboardButton(text="◀ Назад", callback_data=f"page_{page-1}")
-        )
-    if page < total_pages - 1:
-        pagination_buttons.append(
-            InlineKeyboardButton(text="Вперед ▶", callback_data=f"page_{page+1}")
-        )
+    if has_prev and page_doctors:
+        pagination_buttons.append(InlineKeyboardButton(text="◀ Назад", callback_data=doctorsPageRoute.pack(
+            direction='p', cursor=page_doctors[0][0], version=doctorDirectory.version
+        )))
+    if has_next and page_doctors:
+        pagination_buttons.append(InlineKeyboardButton(text="Вперед ▶", callback_data=doctorsPageRoute.pack(
+            direction='n', cursor=page_doctors[-1][0], version=doctorDirectory.version
+        )))
     
     if pagination_buttons:
         builder.row(*pagination_buttons)
@@ -55,12 +132,131 @@ def generateDoctorsInlineKeyboard(page: int = 0):
     return builder.as_markup()
 
 
-def generateDoctorsInlineKeyboardWithSearch(name: str):
-    doctors = getDoctorsWithSurname(name)
+def generateTodayInlineKeyboard(weekday: int, after_id: int = None, before_id: int = None):
+    return keyboardCache.page(
+        'today', (weekday, after_id, before_id), todayIndex.version,
+        lambda: buildTodayInlineKeyboard(weekday, after_id, before_id)
+    )
+
+
+def buildTodayInlineKeyboard(weekday: int, after_id: int = None, before_id: int = None):
+    entries, has_prev, has_next = todayIndex.page(weekday, after_id, before_id)
+    builder = InlineKeyboardBuilder()
+
+    # Врачи идут по специализациям, у каждого - часы приёма в этот день
+    for speciality, name, doctor_id, hours in entries:
+        builder.row(InlineKeyboardButton(
+            text=f"{speciality.capitalize()}: {name} ({hours})",
+            callback_data=f"doctor_{doctor_id}"
+        ))
+
+    pagination_buttons = []
+    if has_prev and entries:
+        pagination_buttons.append(
+            InlineKeyboardButton(text="◀ Назад", callback_data=f"today_{weekday}_p_{entries[0][2]}")
+        )
+    if has_next and entries:
+        pagination_buttons.append(
+            InlineKeyboardButton(text="Вперед ▶", callback_data=f"today_{weekday}_n_{entries[-1][2]}")
+        )
+    if pagination_buttons:
+        builder.row(*pagination_buttons)
+    return builder.as_markup()
+
+
+def buildWorkingSpecialitiesKeyboard(counts: dict, specialities: tuple, version: int):
+    # Специализации, по которым кто-то принимает; в callback - номер специализации в индексе
+    builder = InlineKeyboardBuilder()
+    builder.button(text=f"Все врачи ({sum(counts.values())})", callback_data=f"now_{version}_a")
+    for index, speciality in enumerate(specialities):
+        if counts.get(speciality):
+            builder.button(
+                text=f"{speciality.capitalize()} ({counts[speciality]})",
+                callback_data=f"now_{version}_{index}"
+            )
+    builder.adjust(1, 2)
+    return builder.as_markup()
+
+
+def buildWorkingDoctorsKeyboard(entries: list, limit: int = 30):
+    builder = InlineKeyboardBuilder()
+    for speciality, name, doctor_id, start, end in entries[:limit]:
+        builder.row(InlineKeyboardButton(
+            text=f"{speciality.capitalize()}: {name} ({formatMinutes(start)}–{formatMinutes(end)})",
+            callback_data=f"doctor_{doctor_id}"
+        ))
+    return builder.as_markup()
+
+
+def generateFaqKeyboard():
+    return keyboardCache.page('faq', (), faqIndex.version, buildFaqKeyboard)
+
+
+def buildFaqKeyboard():
+    # Вопросы FAQ по два в ряд; в callback - номер вопроса
+    builder = InlineKeyboardBuilder()
+    for index, entry in enumerate(faqIndex.entries):
+        builder.button(text=entry['question'], callback_data=f"faq_{index}")
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+def buildFaqSuggestionsKeyboard(indices: list):
+    # Несколько подходящих вопросов, если ответ на сообщение неоднозначен
+    builder = InlineKeyboardBuilder()
+    for index in indices:
+        builder.row(InlineKeyboardButton(text=faqIndex.entries[index]['question'], callback_data=f"faq_{index}"))
+    builder.row(*faqBackKeyboard.inline_keyboard[0])
+    return builder.as_markup()
+
+
+def buildFaqBackKeyboard():
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="◀ Все вопросы", callback_data="open_faq"))
+    return builder.as_markup()
+
+
+faqBackKeyboard = buildFaqBackKeyboard()
+
+
+SEARCH_PAGE_SIZE = 10
+
+
+def generateDoctorsInlineKeyboardWithSearch(name: str, after_id: int = 0, before_id: int = None):
+    """
+    Страница результатов поиска с кнопками листания.
+
+    :return: (клавиатура, всего найдено) или None, если врача-курсора больше нет в выдаче
+    """
+    query = normalizeName(name)
+    return keyboardCache.search(
+        'search', (query, after_id, before_id), surnameIndex.version,
+        lambda: buildDoctorsInlineKeyboardWithSearch(query, after_id, before_id)
+    )
+
+
+def buildDoctorsInlineKeyboardWithSearch(query: str, after_id: int = 0, before_id: int = None):
+    page = surnameIndex.searchPage(query, after_id, before_id, limit=SEARCH_PAGE_SIZE)
+    if page is None:
+        return None
+    doctors, has_prev, has_next, total = page
     builder = InlineKeyboardBuilder()
     for doctor_id, name, speciality  in doctors: 
         builder.button(text=f"{name} ({speciality})", 
             callback_data=f"doctor_{doctor_id}")
-    builder.adjust(2,2,2)
+    builder.adjust(2)
 
-    return builder.as_markup()
\ No newline at end of file
+    # Запрос передаётся в кнопке текстом или номером, если не помещается в 64 байта
+    pagination_buttons = []
+    for direction, text, visible, cursor in (
+        ('p', "◀ Назад", has_prev, doctors[0][0] if doctors else 0),
+        ('n', "Вперед ▶", has_next, doctors[-1][0] if doctors else 0),
+    ):
+        if not visible or not doctors:
+            continue
+        fields = {'direction': direction, 'cursor': cursor, 'version': surnameIndex.version}
+        token = queryHandles.token(query, searchPageRoute.budget(**fields))
+        pagination_buttons.append(InlineKeyboardButton(text=text, callback_data=searchPageRoute.pack(**fields, query=token)))
+    if pagination_buttons:
+        builder.row(*pagination_buttons)
+    return builder.as_markup(), total
@@ -1,22 +1,47 @@
+import time
+STARTUP_STARTED = time.perf_counter()
+
 import logging
-from typing import Dict, List
-import gspread
-import sqlite3
+from contextlib import contextmanager
+from typing import Dict
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import Command, CommandStart, StateFilter
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from aiogram import Router
-from google.oauth2.service_account import Credentials
-from datetime import datetime
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 import asyncio
+import os
 import platform
+import signal
 import sys
+import tempfile
 from texts import Messages
-from keyboards import beginningKeyboard, generateDoctorsInlineKeyboard , generateDoctorsInlineKeyboardWithSearch
-from database import initDatabase , setOrUpdateDoctorRecord
+from keyboards import beginningKeyboard, mainKeyboard, visitKeyboard, ratingKeyboard, generateDoctorCardKeyboard, generateDoctorsInlineKeyboard , generateDoctorsInlineKeyboardWithSearch, generateTodayInlineKeyboard, buildWorkingSpecialitiesKeyboard, buildWorkingDoctorsKeyboard, generateFaqKeyboard, buildFaqSuggestionsKeyboard, faqBackKeyboard
+from keyboard_cache import keyboardCache
+from database import initDatabase, getDataVersion, getDoctorStats, getShiftParseErrors, isSubscribedToDoctor, subscribeToDoctor, unsubscribeFromDoctor, dbRead, dbWrite, closeDatabase, pool
+from rating_queue import ratingQueue
+from outbox import outbox, ChatRegistryMiddleware
+from subscriptions import scheduleNotifier
+from fsm_storage import SQLiteStorage
+from webhook import runWebhook
+from workers import WorkerPool, WORKER_INDEX_VARIABLE, WORKERS_VARIABLE, runFront, serveUpdates
+from throttling import CallbackDebounceMiddleware, RateLimitMiddleware, callbackSupersedes, editReplyMarkup
+from metrics import (
+    registry, SlowUpdateProfiler, UpdateMetricsMiddleware, HandlerMetricsMiddleware, ApiMetricsMiddleware,
+    instrumentDatabase, instrumentScheduleSync, startMetricsServer,
+)
+from schedule_sync import DoctorSchedule, GoogleSheetSource, ScheduleSync, fileScheduleSource
+from doctors_directory import doctorDirectory
+from search_index import surnameIndex
+from doctor_cards import doctorCards
+from today_index import todayIndex, clinicNow, currentWeekday, WEEKDAY_NAMES
+from shifts import shiftIndex, parseMoment, formatMinutes
+from faq import faqIndex, loadFaqEntries
+from emergency import EmergencyMiddleware
+from callback_codec import doctorsPageRoute, searchPageRoute, queryHandles
+from ratings_export import parseExportArgs, exportRatingsToFile, ratingSummary, SHORT_WINDOW_DAYS, LONG_WINDOW_DAYS
 
 # Настройка event loop для Windows
 if platform.system() == "Windows":
@@ -31,20 +56,74 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 search_router = Router()
 # Конфигурация
-TOKEN = "7764187384:AAHNjQIu7soAzDzgbRI6qfLM0czGekjhN-k"
+TOKEN = os.getenv("BOT_TOKEN", "7764187384:AAHNjQIu7soAzDzgbRI6qfLM0czGekjhN-k")
 GOOGLE_SHEETS_CREDENTIALS = "credentials.json"  # Файл с ключами (см. инструкцию ниже)
 GOOGLE_SHEET_KEY = "1USOCOY37WTye411sMGmCDWUfx0IXRt7tCYfDVwxtRL0"     # ID вашей Google таблицы
-
-
-initDatabase()
+SCHEDULE_SYNC_INTERVAL = 5 * 60  # Период фоновой синхронизации расписания, секунды
+# Листы филиалов в таблице через запятую, например "ПО №10,ПО №17,ПО №18"; по умолчанию - первый лист
+SCHEDULE_WORKSHEETS = [title.strip() for title in os.getenv("SCHEDULE_WORKSHEETS", "").split(",") if title.strip()]
+# Локальные файлы расписания (.csv или .xlsx) через запятую вместо Google Sheets
+SCHEDULE_FILES = [path.strip() for path in os.getenv("SCHEDULE_FILES", "").split(",") if path.strip()]
+SCHEDULE_FETCH_WORKERS = int(os.getenv("SCHEDULE_FETCH_WORKERS", "4"))  # Источников, читаемых одновременно
+# Доля врачей (в целом и в филиале), после удаления которой синхронизация считает снимок оборванным
+SCHEDULE_MAX_SHRINK = float(os.getenv("SCHEDULE_MAX_SHRINK", "0.5"))
+
+# Режим работы: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+BOT_API_URL = os.getenv("BOT_API_URL")  # Свой сервер Bot API, например локальная заглушка для тестов
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Внешний адрес бота, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONCURRENT_UPDATES = int(os.getenv("WEBHOOK_MAX_CONCURRENT_UPDATES", "64"))
+# Лимиты исходящих запросов к Bot API, запросов в секунду; 0 отключает ограничение
+OUTGOING_RATE_LIMIT = float(os.getenv("OUTGOING_RATE_LIMIT", "30"))
+OUTGOING_CHAT_RATE_LIMIT = float(os.getenv("OUTGOING_CHAT_RATE_LIMIT", "1"))
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics; без METRICS_PORT не публикуются
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Обновления дольше стольких секунд профилируются; без переменной профилировщик выключен
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "0"))
+SLOW_UPDATE_PROFILE_DIR = os.getenv("SLOW_UPDATE_PROFILE_DIR")
+# Число процессов-воркеров; больше одного - фронт раздаёт обновления воркерам по chat id
+BOT_WORKERS = int(os.getenv(WORKERS_VARIABLE, "1"))
+# Номер воркера задаёт фронт при запуске процесса; основной воркер (0) синхронизирует
+# расписание и отправляет очередь outbox, остальные только перечитывают данные из базы
+BOT_WORKER_INDEX = int(os.getenv(WORKER_INDEX_VARIABLE, "-1"))
+IS_PRIMARY_WORKER = BOT_WORKER_INDEX <= 0
+WORKER_REFRESH_INTERVAL = 5
+if BOT_WORKER_INDEX >= 0:
+    # Общий лимит Telegram делится между воркерами, у каждого - свой порт метрик
+    OUTGOING_RATE_LIMIT /= BOT_WORKERS
+    if METRICS_PORT:
+        METRICS_PORT += 1 + BOT_WORKER_INDEX
+# Telegram id администраторов через запятую: им доступны рассылки
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()}
 
 
 
 # Инициализация бота и диспетчера
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+if BOT_API_URL:
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)))
+else:
+    bot = Bot(token=TOKEN)
+# Исходящие запросы укладываются в лимиты Telegram, а retry_after выдерживается
+if OUTGOING_RATE_LIMIT > 0 and OUTGOING_CHAT_RATE_LIMIT > 0:
+    bot.session.middleware(RateLimitMiddleware(OUTGOING_RATE_LIMIT, OUTGOING_CHAT_RATE_LIMIT))
+# Регистрируется после ограничителя и измеряет только сам запрос к Telegram
+bot.session.middleware(ApiMetricsMiddleware())
+storage = SQLiteStorage()
 dp = Dispatcher(storage=storage)
+slowUpdateProfiler = SlowUpdateProfiler(SLOW_UPDATE_SECONDS, output_dir=SLOW_UPDATE_PROFILE_DIR) if SLOW_UPDATE_SECONDS > 0 else None
+dp.update.outer_middleware(UpdateMetricsMiddleware(slowUpdateProfiler))
+# Все, кто писал боту, становятся получателями рассылок
+dp.update.outer_middleware(ChatRegistryMiddleware(outbox.registry))
 router = Router()
+# Из серии быстрых нажатий под одним сообщением выполняется только последнее
+router.callback_query.middleware(CallbackDebounceMiddleware())
+router.message.middleware(HandlerMetricsMiddleware())
+router.callback_query.middleware(HandlerMetricsMiddleware())
 dp.include_router(router)
 
 # Состояния для FSM
@@ -57,178 +136,112 @@ class Form(StatesGroup):
 
 class DoctorSearch(StatesGroup):
     waiting_for_surname = State()
-# Подключение к Google Sheets и обработка расписания
-class DoctorSchedule:
-    def __init__(self, credentials_file: str, sheet_key: str):
-        """
-        Инициализация подключения к Google Sheets
-        
-        :param credentials_file: Путь к файлу с учетными данными Google API
-        :param sheet_key: Ключ Google Sheets документа
-        """
-        self.credentials_file = credentials_file
-        self.sheet_key = sheet_key
-        self.sheet = self._connect_to_google_sheets()
-    
-    def _connect_to_google_sheets(self):
-        """Устанавливает соединение с Google Sheets"""
-        try:
-            scope = [
-                "https://spreadsheets.google.com/feeds",
-                "https://www.googleapis.com/auth/drive"
-            ]
-            creds = Credentials.from_service_account_file(
-                self.credentials_file, 
-                scopes=scope
-            )
-            client = gspread.authorize(creds)
-            return client.open_by_key(self.sheet_key).sheet1
-        except Exception as e:
-            logger.error(f"Ошибка подключения к Google Sheets: {e}")
-            raise
-    
-    async def get_all_doctors_data(self) -> List[Dict]:
-        try:
-            records = self.sheet.get_all_records()
-            return [self._format_doctor_record(record) for record in records]
-        except Exception as e:
-            logger.error(f"Ошибка получения данных врачей: {e}")
-            raise
-    
-    def _format_doctor_record(self, record: Dict) -> Dict:
-
-        return {
-            'doctor_name': record['фио врача'],
-            'speciality' : record['специализация'], 
-            'mon': record.get('пн', 'выходной'),
-            'tue': record.get('вт', 'выходной'),
-            'wed': record.get('ср', 'выходной'),
-            'thu': record.get('чт', 'выходной'),
-            'fri': record.get('пт', 'выходной'),
-            'sat': record.get('сб', 'выходной'),
-            'sun': record.get('вс', 'выходной')
-        }
-# Инициализация модуля расписания
-
-
-
 
+# Признаки опасного состояния проверяются в каждом сообщении раньше FSM и роутеров;
+# при вводе фамилии врача отдельные слова-триггеры не проверяются
+emergencyMiddleware = EmergencyMiddleware(name_states=(DoctorSearch.waiting_for_surname.state,))
+dp.message.outer_middleware(emergencyMiddleware)
+
+# Синхронизация расписания с Google Sheets (или локальными файлами)
+if SCHEDULE_FILES:
+    schedule_sources = [fileScheduleSource(path) for path in SCHEDULE_FILES]
+else:
+    # Название листа служит названием филиала
+    schedule_sources = [GoogleSheetSource(
+        GOOGLE_SHEETS_CREDENTIALS, GOOGLE_SHEET_KEY, {title: title for title in SCHEDULE_WORKSHEETS} or None,
+    )]
+doctor_schedule = DoctorSchedule(schedule_sources, max_workers=SCHEDULE_FETCH_WORKERS)
+scheduleSync = ScheduleSync(doctor_schedule, max_shrink=SCHEDULE_MAX_SHRINK)
+
+
+async def refreshDoctorDirectory(result: Dict):
+    # Справочник перечитывается только после синхронизации с изменениями
+    if await doctorDirectory.refresh(result['version']):
+        logger.info(f"Справочник врачей обновлён, версия {doctorDirectory.version}")
+        surnameIndex.build(doctorDirectory.all(), doctorDirectory.version)
+        keyboardCache.invalidate(doctorDirectory.version)
+
+scheduleSync.addListener(refreshDoctorDirectory)
+# Карточки перестраиваются только для изменившихся врачей
+scheduleSync.addListener(doctorCards.apply)
+
+
+async def rebuildTodayIndex(result: Dict):
+    todayIndex.build(doctorCards.all(), result['version'])
+
+scheduleSync.addListener(rebuildTodayIndex)
+
+
+async def rebuildShiftIndex(result: Dict):
+    # Интервалы приёма заново разбираются только у изменившихся врачей
+    await shiftIndex.apply(result, doctorCards.all())
+
+scheduleSync.addListener(rebuildShiftIndex)
+# Подписчики получают одно сообщение обо всех изменениях своих врачей
+scheduleSync.addListener(scheduleNotifier.notify)
+
+# Время запросов к базе, синхронизации и состояние очередей для метрик
+instrumentDatabase(pool)
+instrumentScheduleSync(scheduleSync)
+registry.gauge('bot_rating_queue_size', 'Оценки, ожидающие записи', function=lambda: len(ratingQueue))
+registry.counter('bot_rating_spilled_total', 'Оценки, отложенные в файл при остановке без доступа к базе', function=lambda: ratingQueue.spilled)
+registry.counter(
+    'bot_outbox_messages_total', 'Сообщения очереди outbox по итогу отправки',
+    ('result',), function=lambda: {'sent': outbox.sent, 'failed': outbox.failed, 'retried': outbox.retried},
+)
+registry.counter(
+    'bot_keyboard_cache_requests_total', 'Обращения к кэшу клавиатур',
+    ('result',), function=lambda: {'hit': keyboardCache.hits, 'miss': keyboardCache.misses},
+)
+registry.counter('bot_emergency_messages_total', 'Сообщения с признаками опасного состояния', function=lambda: emergencyMiddleware.detected)
+registry.gauge('bot_shift_parse_errors', 'Ячейки расписания, которые не удалось разобрать', function=lambda: shiftIndex.errors)
 
 
+class StartupTimer:
+    """Замеряет длительность фаз запуска бота"""
 
-async def fillDoctorTable():
-    doctor_schedule = DoctorSchedule(GOOGLE_SHEETS_CREDENTIALS, GOOGLE_SHEET_KEY)
-    doctors = await doctor_schedule.get_all_doctors_data()
-    for doctor in doctors:
-        setOrUpdateDoctorRecord(
-            doctor['doctor_name'], 
-            doctor['speciality'], 
-            doctor['mon'], 
-            doctor['tue'], 
-            doctor['wed'], 
-            doctor['thu'], 
-            doctor['fri'], 
-            doctor['sat'],
-            doctor['sun'],  )
-        
-
-
-asyncio.run(fillDoctorTable())
-
-# Функции для работы с рейтингами
-def save_rating(user_id: int, doctor_id: int, doctor_name: str, visited: bool, rating: int = None):
-    conn = sqlite3.connect('doctors_ratings.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    INSERT INTO ratings (user_id, doctor_id, doctor_name, visited, rating)
-    VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, doctor_id, doctor_name, visited, rating))
-    
-    conn.commit()
-    conn.close()
-
-def get_doctor_stats(doctor_id: int):
-    conn = sqlite3.connect('doctors_ratings.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    SELECT AVG(rating), COUNT(rating) 
-    FROM ratings 
-    WHERE doctor_id = ? AND visited = 1 AND rating IS NOT NULL
-    ''', (doctor_id,))
-    
-    avg_rating, count = cursor.fetchone()
-    conn.close()
-    
-    return {
-        'avg_rating': round(avg_rating, 1) if avg_rating else None,
-        'rating_count': count or 0
-    }
-
-# Клавиатуры
-def get_main_keyboard():
-    builder = ReplyKeyboardBuilder()
-    builder.row(
-        types.KeyboardButton(text="Расписание врачей"),
-        types.KeyboardButton(text="Сегодняшнее расписание")
-    )
-    builder.row(
-        types.KeyboardButton(text="Контакты поликлиники"),
-        types.KeyboardButton(text="FAQ")
-    )
-    return builder.as_markup(resize_keyboard=True)
-
-def get_visit_keyboard():
-    """Клавиатура для вопроса о посещении врача"""
-    builder = ReplyKeyboardBuilder()
-    builder.add(types.KeyboardButton(text="Да"))
-    builder.add(types.KeyboardButton(text="Нет"))
-    builder.adjust(2)  # Располагаем кнопки в 2 колонки
-    return builder.as_markup(resize_keyboard=True)
-
-def get_rating_keyboard():
-    """Клавиатура для оценки врача"""
-    builder = ReplyKeyboardBuilder()
-    builder.add(types.KeyboardButton(text="1"))
-    builder.add(types.KeyboardButton(text="2"))
-    builder.add(types.KeyboardButton(text="3"))
-    builder.add(types.KeyboardButton(text="4"))
-    builder.add(types.KeyboardButton(text="5"))
-    builder.adjust(5)  # Все 5 кнопок в один ряд
-    return builder.as_markup(resize_keyboard=True)
-
-async def get_doctors_keyboard():
-    """Создает инлайн-клавиатуру со списком врачей"""
-    doctors = await doctor_schedule.get_all_doctors()
-    builder = InlineKeyboardBuilder()
-    
-    for doctor in doctors:
-        builder.button(
-            text=f"{doctor['name']} ({doctor['specialization']})", 
-            callback_data=f"doctor_{doctor['id']}"
-        )
-    
-    builder.adjust(1)
-    return builder.as_markup()
-
-async def getFaq():
-    """Создает инлайн-клавиатуру со списком врачей"""
-    doctors = await doctor_schedule.get_all_doctors()
-
-     
-
-    builder = InlineKeyboardBuilder()
-    
-    for doctor in doctors:
-        builder.button(
-            text=f"{doctor['name']} ({doctor['specialization']})", 
-            callback_data=f"doctor_{doctor['id']}"
-        )
-    
-    builder.adjust(1)
-    return builder.as_markup()
+    def __init__(self, started: float):
+        self.started = started
+        self.phases = [('импорт модулей', time.perf_counter() - started)]
 
+    @contextmanager
+    def phase(self, name: str):
+        phase_started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - phase_started))
+
+    def report(self):
+        breakdown = ", ".join(f"{name}: {duration * 1000:.1f} мс" for name, duration in self.phases)
+        total = (time.perf_counter() - self.started) * 1000
+        logger.info(f"Бот запущен за {total:.1f} мс ({breakdown})")
+
+
+startupTimer = StartupTimer(STARTUP_STARTED)
+
+
+async def loadLocalSnapshot():
+    """Поднимает данные из последнего сохранённого снимка в database.db"""
+    with startupTimer.phase('инициализация БД'):
+        await dbWrite(initDatabase)
+    with startupTimer.phase('загрузка снимка врачей'):
+        version = await dbRead(getDataVersion)
+        await doctorDirectory.refresh(version)
+        # Фоновая синхронизация оповестит кэши только при новых изменениях
+        scheduleSync.version = version
+    with startupTimer.phase('построение поискового индекса'):
+        surnameIndex.build(doctorDirectory.all(), doctorDirectory.version)
+    with startupTimer.phase('подготовка карточек врачей'):
+        await doctorCards.load(version)
+        todayIndex.build(doctorCards.all(), version)
+    with startupTimer.phase('загрузка интервалов приёма'):
+        await shiftIndex.load(doctorCards.all(), version, rebuild=IS_PRIMARY_WORKER)
+    with startupTimer.phase('построение индекса FAQ'):
+        faqIndex.build(loadFaqEntries())
+    with startupTimer.phase('загрузка получателей рассылок'):
+        await outbox.registry.load()
+    logger.info(f"Загружен локальный снимок: {len(doctorDirectory)} врачей, версия {version}")
 
 @router.message(CommandStart())
 async def sendWelcomeMessage(message: types.Message):
@@ -251,15 +264,36 @@ async def sendWelcomeMessage(message: types.Message):
 @router.message(F.text == "Расписание врачей")
 async def schedule_handler(message: types.Message):
     keyboard = generateDoctorsInlineKeyboard()
-    print(keyboard)
     await message.answer("Выберите врача из списка:", reply_markup=keyboard)
 
+@router.callback_query(doctorsPageRoute.filter)
+async def doctors_page_handler(callback: types.CallbackQuery):
+    """Листание общего списка врачей"""
+    page = doctorsPageRoute.unpack(callback.data)
+    if page is None:
+        keyboard = generateDoctorsInlineKeyboard()
+    elif page['direction'] == "p":
+        keyboard = generateDoctorsInlineKeyboard(before_id=page['cursor'])
+    else:
+        keyboard = generateDoctorsInlineKeyboard(after_id=page['cursor'])
+    await editReplyMarkup(callback, keyboard)
+    # Курсор - id врача, поэтому страница верна и после синхронизации, но состав мог измениться
+    stale = page is not None and page['version'] != doctorDirectory.version
+    await callback.answer("Список врачей обновился" if stale else None)
+
+
 @router.callback_query(F.data.startswith("page_"))
 async def pagination_handler(callback: types.CallbackQuery):
-    """Обработчик переключения страниц"""
-    page = int(callback.data.split("_")[-1])
-    keyboard = generateDoctorsInlineKeyboard(page=page)
-    await callback.message.edit_reply_markup(reply_markup=keyboard)
+    """Кнопки листания в сообщениях, отправленных до перехода на doctorsPageRoute"""
+    parts = callback.data.split("_")
+    if len(parts) != 3:
+        # Кнопки старого формата page_{n} открывают первую страницу
+        keyboard = generateDoctorsInlineKeyboard()
+    elif parts[1] == "p":
+        keyboard = generateDoctorsInlineKeyboard(before_id=int(parts[2]))
+    else:
+        keyboard = generateDoctorsInlineKeyboard(after_id=int(parts[2]))
+    await editReplyMarkup(callback, keyboard)
     await callback.answer()
 
 
@@ -272,73 +306,181 @@ async def start_surname_search(callback: types.CallbackQuery, state: FSMContext)
 @router.message(StateFilter(DoctorSearch.waiting_for_surname), F.text)
 async def process_surname_search(message: types.Message, state: FSMContext):
     surname = message.text.strip()
-    keyboard = generateDoctorsInlineKeyboardWithSearch(surname)
-    await message.answer(text=f'Найденные врачи с фамилией {surname}:' , reply_markup=keyboard)
+    keyboard, total = generateDoctorsInlineKeyboardWithSearch(surname)
+    await queryHandles.flush()
+    if not total:
+        await message.answer(f"Врачи с фамилией {surname} не найдены. Попробуйте ещё раз:")
+        return
+    await message.answer(text=f'Найденные врачи с фамилией {surname} ({total}):' , reply_markup=keyboard)
+
+
+@router.callback_query(searchPageRoute.filter)
+async def search_page_handler(callback: types.CallbackQuery):
+    """Листание результатов поиска; запрос и курсор приходят в самой кнопке"""
+    page = searchPageRoute.unpack(callback.data)
+    query = await queryHandles.resolve(page['query']) if page else None
+    if query is None:
+        await callback.answer("Поиск устарел, введите фамилию заново", show_alert=True)
+        return
+    if page['direction'] == "p":
+        result = generateDoctorsInlineKeyboardWithSearch(query, before_id=page['cursor'])
+    else:
+        result = generateDoctorsInlineKeyboardWithSearch(query, after_id=page['cursor'])
+    notice = None
+    if result is None:
+        # Врача-курсора больше нет в выдаче после синхронизации - начинаем сначала
+        result = generateDoctorsInlineKeyboardWithSearch(query)
+        notice = "Список врачей обновился, показана первая страница"
+    await queryHandles.flush()
+    await editReplyMarkup(callback, result[0])
+    await callback.answer(notice)
 
 
 @router.message(F.text == "Сегодняшнее расписание")
 async def today_schedule_handler(message: types.Message):
-    keyboard = await get_doctors_keyboard()
-    await message.answer("Выберите врача для просмотра расписания на сегодня:", reply_markup=keyboard)
+    weekday = currentWeekday()
+    if not todayIndex.count(weekday):
+        await message.answer(f"Сегодня ({WEEKDAY_NAMES[weekday]}) нет приёма врачей.")
+        return
+    keyboard = generateTodayInlineKeyboard(weekday)
+    await message.answer(
+        f"Сегодня, {WEEKDAY_NAMES[weekday]}, принимают врачей: {todayIndex.count(weekday)}.\n"
+        "Выберите врача для просмотра расписания:",
+        reply_markup=keyboard
+    )
+
+
+@router.callback_query(F.data.startswith("today_"))
+async def today_pagination_handler(callback: types.CallbackQuery):
+    """Обработчик переключения страниц сегодняшнего расписания"""
+    _, weekday, direction, cursor = callback.data.split("_")
+    if direction == "p":
+        keyboard = generateTodayInlineKeyboard(int(weekday), before_id=int(cursor))
+    else:
+        keyboard = generateTodayInlineKeyboard(int(weekday), after_id=int(cursor))
+    await editReplyMarkup(callback, keyboard)
+    await callback.answer()
 
 
 
 
+# Врачи, которые принимают сейчас или начнут в ближайший час
+WORKING_WINDOW = 60
+
+
+@router.message(F.text == "Кто принимает сейчас")
+async def working_now_handler(message: types.Message):
+    entries = shiftIndex.working(clinicNow(), WORKING_WINDOW)
+    if not entries:
+        await message.answer("Сейчас и в ближайший час приёма нет.")
+        return
+    counts = {}
+    for entry in entries:
+        counts[entry[0]] = counts.get(entry[0], 0) + 1
+    await message.answer(
+        f"Сейчас и в ближайший час принимают врачей: {len(entries)}.\nВыберите специализацию:",
+        reply_markup=buildWorkingSpecialitiesKeyboard(counts, shiftIndex.specialities, shiftIndex.version)
+    )
+
+
+@router.callback_query(F.data.startswith("now_"))
+async def working_speciality_handler(callback: types.CallbackQuery):
+    _, version, index = callback.data.split("_")
+    if int(version) != shiftIndex.version:
+        # Номера специализаций относятся к прошлой версии расписания
+        await callback.answer("Расписание обновилось, нажмите «Кто принимает сейчас» ещё раз", show_alert=True)
+        return
+    speciality = None if index == "a" else shiftIndex.specialities[int(index)]
+    entries = shiftIndex.working(clinicNow(), WORKING_WINDOW, speciality)
+    if not entries:
+        await callback.answer("Сейчас никто не принимает")
+        return
+    await callback.message.edit_text(
+        f"Принимают сейчас и в ближайший час ({len(entries)}):",
+        reply_markup=buildWorkingDoctorsKeyboard(entries)
+    )
+    await callback.answer()
+
+
+@router.message(Command("working"))
+async def working_at_handler(message: types.Message, command: CommandObject):
+    """Кто принимает в указанный момент: /working [день] [ЧЧ:ММ] [специализация]"""
+    at, speciality_text = parseMoment(command.args, clinicNow())
+    speciality = shiftIndex.findSpeciality(speciality_text)
+    if speciality_text and speciality is None:
+        await message.reply(f"Специализация «{speciality_text}» не найдена")
+        return
+    entries = shiftIndex.working(at, speciality=speciality)
+    moment = f"{WEEKDAY_NAMES[at.weekday()]}, {formatMinutes(at.hour * 60 + at.minute)}"
+    if not entries:
+        await message.reply(f"{moment.capitalize()}: никто не принимает" + (f" ({speciality})" if speciality else ""))
+        return
+    await message.reply(
+        f"{moment.capitalize()}: принимают врачей {len(entries)}",
+        reply_markup=buildWorkingDoctorsKeyboard(entries)
+    )
+
+
 @router.callback_query(F.data.startswith("doctor_"))
 async def process_doctor_selection(callback: types.CallbackQuery, state: FSMContext):
     doctor_id = int(callback.data.split("_")[1])
-    doctors = await doctor_schedule.get_all_doctors()
-    doctor = next((doc for doc in doctors if int(doc["id"]) == doctor_id), None)
+    card = doctorCards.get(doctor_id)
     
-    if doctor:
-        await state.update_data(doctor_id=doctor_id, doctor_name=doctor['name'])
+    if card:
+        await state.update_data(doctor_id=doctor_id, doctor_name=card['name'])
         
-        # Показываем расписание
-        schedule = await doctor_schedule.get_schedule(doctor['name'])
-        if schedule:
-            # Добавляем статистику по оценкам
-            stats = get_doctor_stats(doctor_id)
-            stats_text = ""
-            if stats['avg_rating']:
-                stats_text = f"\n\n⭐ Средняя оценка: {stats['avg_rating']} (на основе {stats['rating_count']} оценок)"
-            
-            # Создаем inline-кнопку с ссылкой на Горздрав
-            builder = InlineKeyboardBuilder()
-            builder.add(types.InlineKeyboardButton(
-                text="Записаться на прием через Горздрав",
-                url="https://gorzdrav.spb.ru/"
-            ))
-            
-            response = (
-                f"👨‍⚕️ Врач: {schedule['name']}\n"
-                f"📌 Специализация: {schedule['specialization']}\n\n"
-                "📅 Расписание:\n"
-                f"Пн: {schedule['schedule']['пн']}\n"
-                f"Вт: {schedule['schedule']['вт']}\n"
-                f"Ср: {schedule['schedule']['ср']}\n"
-                f"Чт: {schedule['schedule']['чт']}\n"
-                f"Пт: {schedule['schedule']['пт']}\n"
-                f"Сб: {schedule['schedule']['сб']}\n"
-                f"Вс: {schedule['schedule']['вс']}"
-                f"{stats_text}\n\n"
-                "Вы можете записаться на прием через Портал Горздрав:"
-            )
-            
-            await callback.message.edit_text(response, reply_markup=builder.as_markup())
-            
-            # Предлагаем оценить врача
-            await callback.message.answer(
-                "Вы посещали этого врача? Оцените качество приема:",
-                reply_markup=get_visit_keyboard()
-            )
-            await state.set_state(Form.waiting_for_visit_answer)
-        else:
-            await callback.message.edit_text(f"Не удалось получить расписание для врача {doctor['name']}")
+        # Добавляем статистику по оценкам
+        stats = await dbRead(getDoctorStats, doctor_id)
+        subscribed = await dbRead(isSubscribedToDoctor, callback.message.chat.id, doctor_id)
+        stats_text = ""
+        if stats['avg_rating']:
+            stats_text = f"\n\n⭐ Средняя оценка: {stats['avg_rating']} (на основе {stats['rating_count']} оценок)"
+        
+        branch_text = f"🏥 Филиал: {card['branch']}\n" if card['branch'] else ""
+
+        # Показываем заранее подготовленное расписание
+        response = (
+            f"👨‍⚕️ Врач: {card['name']}\n"
+            f"📌 Специализация: {card['speciality']}\n"
+            f"{branch_text}\n"
+            "📅 Расписание:\n"
+            f"{card['schedule']}"
+            f"{stats_text}\n\n"
+            "Вы можете записаться на прием через Портал Горздрав:"
+        )
+        
+        await callback.message.edit_text(response, reply_markup=generateDoctorCardKeyboard(doctor_id, subscribed))
+        
+        # Предлагаем оценить врача
+        await callback.message.answer(
+            "Вы посещали этого врача? Оцените качество приема:",
+            reply_markup=visitKeyboard
+        )
+        await state.set_state(Form.waiting_for_visit_answer)
     else:
         await callback.message.edit_text("Врач не найден")
     
     await callback.answer()
 
+@router.callback_query(F.data.startswith("sub_") | F.data.startswith("unsub_"))
+async def subscription_handler(callback: types.CallbackQuery):
+    """Подписка на изменения расписания врача из его карточки"""
+    action, doctor_id = callback.data.split("_")
+    doctor_id = int(doctor_id)
+    if doctorCards.get(doctor_id) is None:
+        await callback.answer("Врач не найден")
+        return
+
+    chat_id = callback.message.chat.id
+    if action == "sub":
+        await dbWrite(subscribeToDoctor, chat_id, doctor_id, time.time())
+        text = "Вы будете получать сообщения об изменениях расписания врача"
+    else:
+        await dbWrite(unsubscribeFromDoctor, chat_id, doctor_id)
+        text = "Подписка на изменения расписания отменена"
+    await editReplyMarkup(callback, generateDoctorCardKeyboard(doctor_id, action == "sub"))
+    await callback.answer(text)
+
 @router.message(Form.waiting_for_visit_answer)
 async def process_visit_answer(message: types.Message, state: FSMContext):
     data = await state.get_data()
@@ -346,11 +488,11 @@ async def process_visit_answer(message: types.Message, state: FSMContext):
     if message.text.lower() == 'да':
         await message.answer(
             "Пожалуйста, оцените качество приема (от 1 до 5):",
-            reply_markup=get_rating_keyboard()
+            reply_markup=ratingKeyboard
         )
         await state.set_state(Form.waiting_for_rating)
     elif message.text.lower() == 'нет':
-        save_rating(
+        await ratingQueue.put(
             user_id=message.from_user.id,
             doctor_id=data['doctor_id'],
             doctor_name=data['doctor_name'],
@@ -358,7 +500,7 @@ async def process_visit_answer(message: types.Message, state: FSMContext):
         )
         await message.answer(
             "Спасибо за ответ! Если посетите врача, оцените качество приема.",
-            reply_markup=get_main_keyboard()
+            reply_markup=mainKeyboard
         )
         await state.clear()
     else:
@@ -369,7 +511,7 @@ async def process_rating(message: types.Message, state: FSMContext):
     if message.text.isdigit() and 1 <= int(message.text) <= 5:
         data = await state.get_data()
         
-        save_rating(
+        await ratingQueue.put(
             user_id=message.from_user.id,
             doctor_id=data['doctor_id'],
             doctor_name=data['doctor_name'],
@@ -379,7 +521,7 @@ async def process_rating(message: types.Message, state: FSMContext):
         
         await message.answer(
             "Спасибо за вашу оценку! Она поможет улучшить качество обслуживания.",
-            reply_markup=get_main_keyboard()
+            reply_markup=mainKeyboard
         )
         await state.clear()
     else:
@@ -398,152 +540,283 @@ async def contacts_handler(message: types.Message):
 
 
 @router.message(F.text == "FAQ")
-async def today_schedule_handler(message: types.Message):
-    keyboard = await get_doctors_keyboard()
-    await message.answer("Выберите врача для просмотра расписания на сегодня:", reply_markup=keyboard)
-
-@router.message()
-async def unknown_message(message: types.Message):
-    await message.reply(
-        "Извините, я не понял ваш запрос. Пожалуйста, используйте кнопки меню.",
-        reply_markup=get_main_keyboard()
-    )
-
-async def main():
-    await dp.start_polling(bot)
-
-if __name__ == '__main__':
-    asyncio.run(main())
-
-
-
-
-
-
-
-
-
-
-
+async def faq_handler(message: types.Message):
+    await message.answer("Выберите интересующий вас вопрос из списка:", reply_markup=generateFaqKeyboard())
 
 
+@router.callback_query(F.data == "open_faq")
+async def open_faq_handler(callback: types.CallbackQuery):
+    await callback.message.edit_text("Выберите интересующий вас вопрос из списка:", reply_markup=generateFaqKeyboard())
+    await callback.answer()
 
 
+@router.callback_query(F.data.startswith("faq_"))
+async def faq_answer_handler(callback: types.CallbackQuery):
+    """Ответ на выбранный вопрос FAQ"""
+    index = int(callback.data.split("_")[1])
+    if index >= len(faqIndex):
+        await callback.answer("Вопрос не найден")
+        return
+    entry = faqIndex.entries[index]
+    await callback.message.edit_text(
+        f"<b>{entry['question']}</b>\n\n{entry['answer']}", reply_markup=faqBackKeyboard, parse_mode="HTML"
+    )
+    await callback.answer()
 
+@router.message(Command("broadcast"), F.from_user.id.in_(ADMIN_IDS))
+async def broadcast_handler(message: types.Message, command: CommandObject):
+    """Рассылка всем пользователям: /broadcast текст"""
+    if not command.args:
+        await message.reply("Укажите текст рассылки: /broadcast текст")
+        return
+    result = await outbox.broadcast(command.args)
+    await message.reply(
+        f"Рассылка №{result['id']} поставлена в очередь, получателей: {result['total']}.\n"
+        f"Ход рассылки: /broadcast_status {result['id']}"
+    )
 
 
+@router.message(Command("broadcast_status"), F.from_user.id.in_(ADMIN_IDS))
+async def broadcast_status_handler(message: types.Message, command: CommandObject):
+    if not command.args or not command.args.strip().isdigit():
+        await message.reply("Укажите номер рассылки: /broadcast_status номер")
+        return
+    progress = await outbox.progress(int(command.args))
+    if progress is None:
+        await message.reply("Рассылка не найдена")
+        return
+    await message.reply(
+        f"Рассылка №{progress['id']} «{progress['title']}»: "
+        f"доставлено {progress['sent']} из {progress['total']}, "
+        f"не доставлено {progress['failed']}, в очереди {progress['pending']}"
+    )
 
+@router.message(Command("shift_errors"), F.from_user.id.in_(ADMIN_IDS))
+async def shift_errors_handler(message: types.Message):
+    """Ячейки расписания, из которых не удалось получить часы приёма"""
+    errors = await dbRead(getShiftParseErrors)
+    if not errors:
+        await message.reply("Все ячейки расписания разобраны")
+        return
+    lines = [f"{name}, {WEEKDAY_NAMES[weekday]}: «{value}» - {error}" for name, weekday, value, error in errors[:30]]
+    if len(errors) > len(lines):
+        lines.append(f"...и ещё {len(errors) - len(lines)}")
+    await message.reply(f"Не удалось разобрать ячеек: {len(errors)}\n" + "\n".join(lines))
+
+# Ограничение Bot API на размер отправляемого файла
+EXPORT_FILE_LIMIT = 50 * 1024 * 1024
+
+
+@router.message(Command("ratings_export"), F.from_user.id.in_(ADMIN_IDS))
+async def ratings_export_handler(message: types.Message, command: CommandObject):
+    """
+    Выгрузка оценок файлом: /ratings_export [csv|jsonl] [с] [по] [id врача]
+
+    Даты - дни поликлиники (clinicNow); оценки хранятся в UTC, и границы
+    периода переводятся в UTC (ratings_export.utcBound), поэтому в файле
+    время остаётся в UTC.
+    """
+    try:
+        fmt, date_from, date_to, doctor_id = parseExportArgs(command.args, clinicNow().date())
+    except ValueError as e:
+        await message.reply(f"{e}. Формат: /ratings_export [csv|jsonl] [ГГГГ-ММ-ДД] [ГГГГ-ММ-ДД] [id врача]")
+        return
+    handle, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(handle)
+    try:
+        count = await exportRatingsToFile(path, fmt, date_from, date_to, doctor_id)
+        if os.path.getsize(path) > EXPORT_FILE_LIMIT:
+            await message.reply(
+                f"Оценок: {count}, файл больше 50 МБ. Сократите период или выгрузите "
+                "из командной строки: python ratings_export.py export"
+            )
+            return
+        await message.answer_document(
+            types.FSInputFile(path, filename=f"ratings_{date_from}_{date_to}.{fmt}"),
+            caption=f"Оценки с {date_from:%d.%m.%Y} по {date_to:%d.%m.%Y}: {count}",
+        )
+    finally:
+        os.remove(path)
+
+
+@router.message(Command("ratings_stats"), F.from_user.id.in_(ADMIN_IDS))
+async def ratings_stats_handler(message: types.Message, command: CommandObject):
+    """
+    Средние оценки за 7 и 30 дней и доля посещений: /ratings_stats [id врача]
+
+    Окна заканчиваются сегодняшним днём поликлиники (clinicNow), их границы
+    переводятся в UTC (ratings_export.utcBound) - в этом поясе хранится время оценок.
+    """
+    args = (command.args or "").strip()
+    doctor_id = int(args) if args.isdigit() else None
+    summary = await dbRead(ratingSummary, clinicNow().date(), doctor_id)
+    if not summary:
+        await message.reply(f"За последние {LONG_WINDOW_DAYS} дней оценок нет")
+        return
+    summary.sort(key=lambda row: row[f'count_{LONG_WINDOW_DAYS}d'], reverse=True)
+    short, long = f'avg_{SHORT_WINDOW_DAYS}d', f'avg_{LONG_WINDOW_DAYS}d'
+    lines = [
+        f"{row['doctor_name']}: {SHORT_WINDOW_DAYS} дн. {row[short] or '-'} ({row[f'count_{SHORT_WINDOW_DAYS}d']}), "
+        f"{LONG_WINDOW_DAYS} дн. {row[long] or '-'} ({row[f'count_{LONG_WINDOW_DAYS}d']}), "
+        f"посетили {row['visit_ratio']:.0%}"
+        for row in summary[:30]
+    ]
+    if len(summary) > len(lines):
+        lines.append(f"...и ещё {len(summary) - len(lines)}, полностью: python ratings_export.py summary")
+    await message.reply(f"Оценки за {LONG_WINDOW_DAYS} дней, врачей: {len(summary)}\n" + "\n".join(lines))
 
 
+@router.message()
+async def unknown_message(message: types.Message):
+    # Свободный вопрос ищется среди FAQ
+    index, suggestions = faqIndex.match(message.text or "")
+    if index is not None:
+        entry = faqIndex.entries[index]
+        await message.reply(
+            f"<b>{entry['question']}</b>\n\n{entry['answer']}", reply_markup=faqBackKeyboard, parse_mode="HTML"
+        )
+        return
+    if suggestions:
+        await message.reply("Возможно, вас интересует:", reply_markup=buildFaqSuggestionsKeyboard(suggestions))
+        return
+    await message.reply(
+        "Извините, я не понял ваш запрос. Пожалуйста, используйте кнопки меню.",
+        reply_markup=mainKeyboard
+    )
 
+@dp.startup()
+async def on_startup():
+    startupTimer.report()
 
 
+async def reloadLocalData(version: int):
+    """Перечитывает справочник, карточки и индексы после синхронизации в другом процессе"""
+    if await doctorDirectory.refresh(version):
+        surnameIndex.build(doctorDirectory.all(), doctorDirectory.version)
+        keyboardCache.invalidate(doctorDirectory.version)
+    await doctorCards.load(version)
+    todayIndex.build(doctorCards.all(), version)
+    logger.info(f"Данные врачей перечитаны из базы, версия {version}")
 
-# # Настройка логирования
-# logging.basicConfig(
-#     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-#     level=logging.INFO
-# )
-# logger = logging.getLogger(__name__)
 
-# # Словарь с вопросами и ответами из скриптов
-# FAQ_SCRIPTS = {
-#     "Запись на прием к врачу": "Записаться на прием можно несколькими способами:\n\n*Онлайн:* Через Портал Горздрав (https://gorzdrav.spb.ru/). Вам понадобится подтвержденная учетная запись.\n\n*По телефону:* Позвоните в колл-центр нашей поликлиники: +7 (812) 246-55-55.\n\n*Лично:* В регистратуре поликлиники или через инфомат в холле.\n\n*Важно:* При первичном обращении в этом году сначала нужен прием терапевта/врача общей практики (ВОП). К узким специалистам чаще всего направляет терапевт/ВОП.",
-#     "Узнать расписание врача": "Актуальное расписание врачей доступно:\n\n*Онлайн:* Через Портал Горздрав (https://gorzdrav.spb.ru/).\n\n*На сайте поликлиники:* Раздел 'Расписание врачей' на нашем официальном сайте (https://p17-spb.ru/raspisanie/).\n\n*По телефону:* Позвоните в колл-центр нашей поликлиники: +7 (812) 246-55-55.\n\n*В холле поликлиники:* На информационных стендах или терминалах (инфоматах). Расписание может меняться, онлайн-источники наиболее актуальны.",
-#     "Вызов врача на дом": "Вызвать участкового терапевта на дом можно:\n\n*По телефону:* по номеру 122.\n\n*ВАЖНО:* Если у вас или у близкого человека **сильная боль, затрудненное дыхание, признаки острого состояния (боль в груди, внезапная слабость, потеря сознания и т.п.) -- НЕМЕДЛЕННО звоните по номеру экстренных служб 103 или 112!** Чат-бот не предназначен для вызова скорой помощи.",
-#     "Прикрепиться к поликлинике": "Вы можете прикрепиться к нашей поликлинике:\n\nВ соответствии с Законом «Об основах охраны здоровья граждан в Российской Федерации» каждый житель Санкт-Петербурга имеет право на выбор медицинской организации. Прикрепиться к поликлинике можно не чаще одного раза в год (за исключением случаев изменения места жительства или места пребывания). Для прикрепления необходимо обратиться к страховому представителю в наших подразделениях.\n\nПодробные адреса и время работы страховых представителей можно уточнить в регистратуре или на сайте поликлиники.",
-#     "Получить справку / Выписку": "Порядок получения справок и выписок:\n\n*Многие справки* (например, для бассейна, санатория) оформляются у вашего участкового терапевта/ВОП или профильного врача после осмотра. Запишитесь на прием.\n\n*Выписка из амбулаторной карты (форма 027/у):* Заказывается у лечащего врача или через регистратуру. Уточните порядок и сроки подготовки по телефону +7 (812) 246-55-55.\n\n*Справки по форме 086/у* (для поступления) требуют прохождения врачебной комиссии (ВК) в поликлинике.",
-#     "Получить результаты анализов": "Доступ к результатам анализов и исследований:\n\n*Электронная Медицинская Карта (ЭМК):* Основной способ. Просматривайте в личном кабинете на Портале Госуслуг (www.gosuslugi.ru) или в приложении 'Госуслуги.Здоровье'. Результаты появляются там после обработки врачом лаборатории/кабинета.\n\n*На приеме у врача:* Ваш лечащий врач прокомментирует результаты на очередном приеме.\n\n*В поликлинике:* Некоторые результаты (например, флюорографии) могут быть доступны на информационном стенде или у врача-рентгенолога/фтизиатра.",
-#     "График работы поликлиники": "График работы нашей поликлиники:\n\nПо будням: с 08.00 до 20.00. Суббота: 09.00-15.00. Воскресенье: Уточняйте по т.246-55-55.",
-#     "Получить больничный лист": "Листок нетрудоспособности (больничный):\n\n*Открывается врачом:* Терапевтом/ВОП, врачом-специалистом или врачом скорой помощи (на короткий срок) при наличии медицинских показаний.\n\n*При амбулаторном лечении:* Открывается в день обращения/осмотра, подтверждающего нетрудоспособность. Продлевается на последующих приемах.\n\n*Электронный больничный (ЭЛН):* С 2025 года подавляющее большинство больничных оформляется электронно. Данные автоматически передаются в ФСС.",
-#     "Потерял полис ОМС": "Если вы потеряли полис ОМС:\n\n1. *Вы все равно имеете право на помощь!* Предоставьте паспорт и СНИЛС в регистратуру. Ваши данные проверят по единому реестру застрахованных.\n\n2. *Восстановление:* Обратитесь в свою страховую медицинскую организацию (СМО), которая выдала полис. Контакты СМО можно узнать в регистратуре поликлиники или на сайте Территориального фонда ОМС вашего региона.\n\n3. *Электронный полис:* Если у вас есть подтвержденная учетная запись на Госуслугах, ваш электронный полис ОМС доступен в приложении 'Госуслуги.Здоровье'.",
-#     "Запись на диспансеризацию": "Диспансеризация очень важна для контроля вашего здоровья! Записаться можно:\n\n*Через участкового терапевта/ВОП:* Запишитесь на прием, врач определит объем обследований по вашему возрасту и анамнезу.\n\n*Самостоятельно:* Через Портал Госуслуг (www.gosuslugi.ru) или приложение 'Госуслуги.Здоровье' выберите услугу \"Прохождение диспансеризации\".\n\n*График:* Диспансеризация проводится 1 раз в 3 года для лиц 18-39 лет, ежегодно - для лиц 40 лет и старше.",
-#     "Контакты поликлиники": "Контактная информация нашей поликлиники:\n\n*Официальное название:* СПБ ГБУЗ ГП №17\n\n*Адреса отделений:*\n- Отделение №17: пр. Металлистов, д. 56\n- Отделение №10: пр. Шаумяна, д. 51\n- Отделение №18: ул. Бестужевская, д. 79\n\n*Телефон Контакт-центра:* (812) 246-55-55\n\n*Официальный сайт:* https://p17-spb.ru/",
-#     "Флюорография": "Для прохождения исследования ФЛГ предварительная запись не нужна. Вам нужно подойти в часы работы кабинета ФЛГ в ПО №10 (пр. Шаумяна,д.51), либо в ПО №18 (ул. Бестужевская, д. 79) -- понедельник, среда, пятница с 08.00 до 13.00, вторник, четверг с 14.00 до 19.00. Принимают с направлением от врача, если нет направления, то обратиться в регистратуру для получения талона. При себе иметь паспорт.\n\nВНИМАНИЕ! В ПО №17 (пр. Металлистов, д.56) кабинет ФЛГ ЗАКРЫТ на плановую замену оборудования.",
-#     "Экстренная помощь": "❗ **ВНИМАНИЕ! ЭТО ОПАСНОЕ СОСТОЯНИЕ!** ❌ ЧАТ-БОТ НЕ МОЖЕТ ВЫЗВАТЬ СКОРУЮ ПОМОЩЬ. ❌\n\n*НЕМЕДЛЕННО ПОЗВОНИТЕ ПО ТЕЛЕФОНУ:*\n*103 или 112* (с мобильного)\n*03* (со стационарного телефона)\n\nЧетко сообщите диспетчеру: **1. ЧТО СЛУЧИЛОСЬ? 2. ГДЕ ВЫ НАХОДИТЕСЬ? (Адрес!) 3. КТО ПОСТРАДАВШИЙ? (ФИО, возраст, состояние).**\n\n*НЕ ТЕРЯЙТЕ ВРЕМЯ НА ЧАТ С БОТОМ! ЗВОНИТЕ 103/112 СЕЙЧАС ЖЕ!*"
-# }
+async def watchDataVersion(interval: float = WORKER_REFRESH_INTERVAL):
+    """Фоновая задача неосновного воркера: следит за версией данных и сохраняет новые чаты"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            version = await dbRead(getDataVersion)
+            if version != doctorCards.version:
+                await reloadLocalData(version)
+            if shiftIndex.version != version:
+                # Интервалы пишет основной воркер после синхронизации, до этого остаются прежние
+                await shiftIndex.load(doctorCards.all(), version, rebuild=False)
+            await outbox.registry.flush()
+        except Exception as e:
+            logger.exception(f"Ошибка обновления данных воркера: {e}")
 
-# async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-#     """Отправляет приветственное сообщение с кнопкой FAQ"""
-#     keyboard = [
-#         [InlineKeyboardButton("FAQ - Частые вопросы", callback_data="open_faq")]
-#     ]
-#     reply_markup = InlineKeyboardMarkup(keyboard)
-#     await update.message.reply_text(
-#         "Добро пожаловать в бот поликлиники №17! "
-#         "Нажмите на кнопку ниже, чтобы открыть список часто задаваемых вопросов.",
-#         reply_markup=reply_markup
-#     )
 
-# async def open_faq(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-#     """Открывает меню FAQ с инлайн-клавиатурой"""
-#     query = update.callback_query
-#     await query.answer()
-    
-#     # Создаем кнопки для FAQ (по 2 в ряд)
-#     keyboard = []
-#     faq_items = list(FAQ_SCRIPTS.keys())
-    
-#     for i in range(0, len(faq_items), 2):
-#         row = []
-#         if i < len(faq_items):
-#             row.append(InlineKeyboardButton(faq_items[i], callback_data=f"faq_{i}"))
-#         if i+1 < len(faq_items):
-#             row.append(InlineKeyboardButton(faq_items[i+1], callback_data=f"faq_{i+1}"))
-#         keyboard.append(row)
-    
-#     # Добавляем кнопку "Назад" если это не главное меню
-#     if query.data != "open_faq":
-#         keyboard.append([InlineKeyboardButton("Назад", callback_data="open_faq")])
-    
-#     reply_markup = InlineKeyboardMarkup(keyboard)
-#     await query.edit_message_text(
-#         text="Выберите интересующий вас вопрос из списка:",
-#         reply_markup=reply_markup
-#     )
+async def runWorker(updates, stats):
+    """Процесс-воркер: обрабатывает обновления своей доли чатов из очереди фронта"""
+    await loadLocalSnapshot()
+    if IS_PRIMARY_WORKER:
+        background = asyncio.create_task(scheduleSync.runForever(SCHEDULE_SYNC_INTERVAL))
+        outbox.start(bot)
+    else:
+        background = asyncio.create_task(watchDataVersion())
+    ratingQueue.start()
+    metrics_runner = await startMetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    if slowUpdateProfiler is not None:
+        slowUpdateProfiler.start()
+    await dp.emit_startup(bot=bot)
+    try:
+        await serveUpdates(
+            dp, bot, updates, stats,
+            max_concurrent=WEBHOOK_MAX_CONCURRENT_UPDATES,
+            supersedes=callbackSupersedes,
+        )
+    finally:
+        background.cancel()
+        if slowUpdateProfiler is not None:
+            slowUpdateProfiler.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await ratingQueue.stop()
+        if IS_PRIMARY_WORKER:
+            await outbox.stop()
+        else:
+            await outbox.registry.flush()
+        # Закрывает хранилище FSM, дописывая состояния
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+        closeDatabase()
+
+
+def runBotWorker(updates, stats):
+    """Точка входа процесса-воркера"""
+    # Ctrl+C получает вся группа процессов; остановкой воркеров управляет фронт
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(runWorker(updates, stats))
+
+
+async def runWorkers():
+    """Фронт многопроцессного режима: принимает обновления и раздаёт их воркерам"""
+    # Схема создаётся один раз, до запуска воркеров
+    await dbWrite(initDatabase)
+    workerPool = WorkerPool(BOT_WORKERS, runBotWorker)
+    registry.gauge(
+        'bot_worker_queue_depth', 'Обновления, ожидающие обработки в воркере',
+        ('worker',), function=lambda: {str(index): workerPool.queueDepth(index) for index in range(workerPool.count)},
+    )
+    registry.counter(
+        'bot_worker_restarts_total', 'Перезапуски упавших воркеров',
+        ('worker',), function=lambda: {str(index): restarts for index, restarts in enumerate(workerPool.restarts)},
+    )
+    metrics_runner = await startMetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    try:
+        await runFront(
+            workerPool, bot, BOT_MODE, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+            url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+        )
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        closeDatabase()
 
-# async def faq_answer(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-#     """Отправляет ответ на выбранный вопрос FAQ"""
-#     query = update.callback_query
-#     await query.answer()
-    
-#     # Получаем индекс вопроса из callback_data
-#     question_index = int(query.data.split("_")[1])
-#     question = list(FAQ_SCRIPTS.keys())[question_index]
-#     answer = FAQ_SCRIPTS[question]
-    
-#     # Создаем клавиатуру с кнопкой "Назад"
-#     keyboard = [[InlineKeyboardButton("Назад", callback_data="open_faq")]]
-#     reply_markup = InlineKeyboardMarkup(keyboard)
-    
-#     await query.edit_message_text(
-#         text=f"<b>{question}</b>\n\n{answer}",
-#         reply_markup=reply_markup,
-#         parse_mode="HTML"
-#     )
 
-# async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-#     """Обрабатывает текстовые сообщения"""
-#     text = update.message.text.lower()
-    
-#     # Проверяем триггерные слова для экстренной помощи
-#     emergency_words = ["плохо", "скорая", "умираю", "боль", "давление", "травма", "сердце", "задыхаюсь"]
-#     if any(word in text for word in emergency_words):
-#         await update.message.reply_text(
-#             "❗ **ВНИМАНИЕ! ЭТО ОПАСНОЕ СОСТОЯНИЕ!** ❌ ЧАТ-БОТ НЕ МОЖЕТ ВЫЗВАТЬ СКОРУЮ ПОМОЩЬ. ❌\n\n"
-#             "*НЕМЕДЛЕННО ПОЗВОНИТЕ ПО ТЕЛЕФОНУ:*\n"
-#             "*103 или 112* (с мобильного)\n"
-#             "*03* (со стационарного телефона)\n\n"
-#             "Четко сообщите диспетчеру: **1. ЧТО СЛУЧИЛОСЬ? 2. ГДЕ ВЫ НАХОДИТЕСЬ? (Адрес!) 3. КТО ПОСТРАДАВШИЙ? (ФИО, возраст, состояние).**\n\n"
-#             "*НЕ ТЕРЯЙТЕ ВРЕМЯ НА ЧАТ С БОТОМ! ЗВОНИТЕ 103/112 СЕЙЧАС ЖЕ!*",
-#             parse_mode="HTML"
-#         )
-#     else:
-#         # Предлагаем открыть FAQ для других сообщений
-#         keyboard = [[InlineKeyboardButton("FAQ - Частые вопросы", callback_data="open_faq")]]
-#         reply_markup = InlineKeyboardMarkup(keyboard)
-#         await update.message.reply_text(
-#             "Извините, я не совсем понял ваш вопрос. Пожалуйста, выберите интересующий вас вопрос из списка FAQ:",
-#             reply_markup=reply_markup
-#         )
+async def main():
+    if BOT_WORKERS > 1:
+        await runWorkers()
+        return
+    await loadLocalSnapshot()
+    # Расписание из Google Sheets обновляется в фоне и не задерживает запуск
+    sync_task = asyncio.create_task(scheduleSync.runForever(SCHEDULE_SYNC_INTERVAL))
+    ratingQueue.start()
+    outbox.start(bot)
+    metrics_runner = await startMetricsServer(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+    if slowUpdateProfiler is not None:
+        slowUpdateProfiler.start()
+    try:
+        if BOT_MODE == "webhook":
+            await runWebhook(
+                dp, bot, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+                url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                max_concurrent=WEBHOOK_MAX_CONCURRENT_UPDATES,
+                supersedes=callbackSupersedes,
+            )
+        else:
+            await dp.start_polling(bot)
+    finally:
+        sync_task.cancel()
+        if slowUpdateProfiler is not None:
+            slowUpdateProfiler.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # Дописываем накопленные оценки до закрытия базы
+        await ratingQueue.stop()
+        # Неотправленные сообщения остаются в базе до следующего запуска
+        await outbox.stop()
+        # Дожидаемся незавершённых запросов и закрываем соединения
+        closeDatabase()
 
+if __name__ == '__main__':
+    asyncio.run(main())
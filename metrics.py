@@ -0,0 +1,352 @@
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as StackCounter, deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatLabels(names: Tuple[str, ...], values: Tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """
+    Метрика с фиксированным набором меток; значения можно менять из любых потоков.
+
+    Если передана function, значение читается при каждом экспорте: число
+    или словарь {значение метки (или кортеж значений): число}.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), function: Callable = None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.function = function
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple:
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self) -> list:
+        if self.function is not None:
+            value = self.function()
+            values = value if isinstance(value, dict) else {(): value}
+            with self._lock:
+                self._values = {key if isinstance(key, tuple) else (key,): val for key, val in values.items()}
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_formatLabels(self.labels, key)} {value}')
+        return lines
+
+
+class Counter(Metric):
+    """Монотонно растущее значение; function - для счётчиков, которые ведёт сам объект (sync.runs и т.п.)"""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Текущее значение, может и расти, и уменьшаться"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Счётчики по корзинам (последняя - +Inf), сумма и количество
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_formatLabels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_formatLabels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{_formatLabels(self.labels, key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса, экспортируемых в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f'Метрика {metric.name} уже зарегистрирована')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = (), function: Callable = None) -> Counter:
+        return self._add(Counter(name, help_text, labels, function))
+
+    def gauge(self, name: str, help_text: str, labels: Tuple[str, ...] = (), function: Callable = None) -> Gauge:
+        return self._add(Gauge(name, help_text, labels, function))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.warning(f"Не удалось получить метрику {metric.name}: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+updatesTotal = registry.counter('bot_updates_total', 'Обработанные обновления Telegram', ('type',))
+updateDuration = registry.histogram('bot_update_duration_seconds', 'Полное время обработки обновления', ('type',))
+slowUpdatesTotal = registry.counter('bot_slow_updates_total', 'Обновления дольше порога профилировщика')
+handlerDuration = registry.histogram('bot_handler_duration_seconds', 'Время работы обработчика', ('handler',))
+handlerErrors = registry.counter('bot_handler_errors_total', 'Исключения в обработчиках', ('handler',))
+apiDuration = registry.histogram('bot_api_request_duration_seconds', 'Время запроса к Bot API', ('method',))
+apiErrors = registry.counter('bot_api_errors_total', 'Ошибки запросов к Bot API', ('method',))
+dbDuration = registry.histogram('bot_db_query_duration_seconds', 'Время выполнения функции базы данных', ('function', 'mode'))
+dbWait = registry.histogram('bot_db_queue_wait_seconds', 'Ожидание свободного потока базы данных', ('mode',))
+dbRows = registry.counter('bot_db_rows_total', 'Строки, возвращённые функциями базы данных', ('function',))
+dbErrors = registry.counter('bot_db_errors_total', 'Ошибки функций базы данных', ('function',))
+
+
+class SlowUpdateProfiler:
+    """
+    Выборочный профилировщик медленных обновлений.
+
+    Пока обрабатывается хотя бы одно обновление, фоновый поток раз в
+    interval секунд снимает стек потока event loop. Если обновление
+    обрабатывалось дольше threshold, стеки за это время сворачиваются и
+    самые частые попадают в лог, а при заданном output_dir - ещё и в файл
+    в формате folded stacks (для flamegraph.pl или speedscope).
+    """
+
+    def __init__(self, threshold: float, interval: float = 0.005, output_dir: str = None, max_samples: int = 20000):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_dir = output_dir
+        self._samples = deque(maxlen=max_samples)
+        self._active = 0
+        self._target = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Вызывается из потока event loop - его стек и профилируется"""
+        self._target = threading.get_ident()
+        self._running = True
+        self._thread = threading.Thread(target=self._sampleLoop, name='slow-update-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def enter(self):
+        self._active += 1
+
+    def leave(self):
+        self._active -= 1
+
+    def _sampleLoop(self):
+        while self._running:
+            time.sleep(self.interval)
+            if not self._active:
+                continue
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None and len(stack) < 64:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self._samples.append((time.perf_counter(), ';'.join(reversed(stack))))
+
+    def report(self, started: float, finished: float, label: str):
+        stacks = StackCounter(stack for moment, stack in list(self._samples) if started <= moment <= finished)
+        total = sum(stacks.values())
+        if not total:
+            return
+        # В лог - верхушки самых частых стеков, полные стеки - в файл
+        top = "\n".join(
+            f"  {count / total:6.1%}  {' > '.join(stack.split(';')[-4:])}"
+            for stack, count in stacks.most_common(5)
+        )
+        logger.warning(f"Медленное обновление {label}: {(finished - started) * 1000:.0f} мс, выборок {total}\n{top}")
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"slow-{time.strftime('%Y%m%d-%H%M%S')}-{label}.folded")
+            with open(path, 'w', encoding='utf-8') as file:
+                file.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: полное время обработки каждого обновления"""
+
+    def __init__(self, profiler: Optional[SlowUpdateProfiler] = None):
+        self.profiler = profiler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        update_type = event.event_type
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.enter()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            finished = time.perf_counter()
+            updatesTotal.inc(type=update_type)
+            updateDuration.observe(finished - started, type=update_type)
+            if profiler is not None:
+                profiler.leave()
+                if finished - started >= profiler.threshold:
+                    slowUpdatesTotal.inc()
+                    profiler.report(started, finished, f"{update_type}-{event.update_id}")
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: время работы сработавшего обработчика"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object is not None else 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            handlerErrors.inc(handler=name)
+            raise
+        finally:
+            handlerDuration.observe(time.perf_counter() - started, handler=name)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время ответа Bot API по методам"""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            apiErrors.inc(method=name)
+            raise
+        finally:
+            apiDuration.observe(time.perf_counter() - started, method=name)
+
+
+def observeDatabase(mode: str, function: str, wait: float, duration: float, result, error):
+    """Наблюдатель ConnectionPool: время запросов, ожидание потока, число строк"""
+    dbWait.observe(wait, mode=mode)
+    dbDuration.observe(duration, function=function, mode=mode)
+    if error is not None:
+        dbErrors.inc(function=function)
+    elif isinstance(result, list):
+        dbRows.inc(len(result), function=function)
+
+
+def instrumentDatabase(pool):
+    pool.observer = observeDatabase
+    registry.gauge('bot_db_connections_in_use', 'Занятые соединения SQLite', function=lambda: pool.inUse)
+    registry.gauge('bot_db_connections_open', 'Открытые соединения SQLite', function=lambda: pool.created)
+
+
+def instrumentScheduleSync(sync):
+    registry.counter('bot_sync_runs_total', 'Успешные синхронизации расписания', function=lambda: sync.runs)
+    registry.counter('bot_sync_errors_total', 'Неудачные синхронизации расписания', function=lambda: sync.errors)
+    registry.gauge('bot_sync_rows', 'Строк в последней синхронизации', function=lambda: sync.lastRows)
+    registry.gauge('bot_sync_last_success_timestamp_seconds', 'Время последней успешной синхронизации', function=lambda: sync.lastSuccessAt)
+    registry.gauge(
+        'bot_sync_last_duration_seconds', 'Длительность фаз последней синхронизации (Google Sheets, запись в базу, обработчики)',
+        ('phase',), function=lambda: dict(sync.lastTimings),
+    )
+    registry.gauge(
+        'bot_sync_source_fetch_seconds', 'Время чтения каждого источника расписания при последней синхронизации',
+        ('source',), function=lambda: dict(sync.schedule.lastFetchTimings),
+    )
+    registry.gauge(
+        'bot_sync_failed_sources', 'Источники, не прочитанные при последней синхронизации; их филиалы не изменялись',
+        function=lambda: len(sync.schedule.lastFailedSources),
+    )
+
+
+async def startMetricsServer(host: str, port: int) -> web.AppRunner:
+    """Отдаёт метрики на http://host:port/metrics в формате Prometheus"""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,201 @@
+"""
+Версионные миграции схемы database.db и профили PRAGMA соединений.
+
+Таблицы создаются функциями create* из database.py (CREATE TABLE IF NOT
+EXISTS), а всё, что меняет уже существующие таблицы - столбцы, индексы,
+ограничения, - оформляется миграцией с номером. Номер последней
+применённой миграции хранится в таблице meta (ключ schema_version);
+каждая миграция выполняется в своей транзакции вместе с записью номера,
+поэтому прерванный запуск не оставляет схему наполовину изменённой, а
+несколько воркеров, запущенных одновременно, применяют её один раз.
+
+Запуск из корня репозитория:
+    python migrations.py status
+    python migrations.py migrate
+"""
+import argparse
+import logging
+import sqlite3
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_KEY = 'schema_version'
+
+# Настройки соединения по профилям, выбираются переменной окружения BOT_DATABASE_PROFILE
+PRAGMA_PROFILES = {
+    # Бот: WAL, без fsync на каждой фиксации (теряются только последние транзакции
+    # при отключении питания, но не при падении процесса), кеш 8 МБ и mmap на соединение
+    'default': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -8192,
+        'mmap_size': 256 * 2 ** 20,
+        'temp_store': 'MEMORY',
+    },
+    # То же, но каждая фиксация переживает отключение питания
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -8192,
+        'mmap_size': 256 * 2 ** 20,
+        'temp_store': 'MEMORY',
+    },
+    # Массовая загрузка (бенчмарки, восстановление из выгрузки): без fsync и с большим кешем
+    'bulk': {
+        'journal_mode': 'WAL',
+        'synchronous': 'OFF',
+        'cache_size': -65536,
+        'mmap_size': 1024 * 2 ** 20,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def applyPragmas(conn: sqlite3.Connection, profile: str = 'default'):
+    """Настраивает соединение по профилю из PRAGMA_PROFILES"""
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Неизвестный профиль PRAGMA: {profile}")
+    for name, value in PRAGMA_PROFILES[profile].items():
+        conn.execute(f'PRAGMA {name}={value}')
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def addDoctorsRowHash(conn: sqlite3.Connection):
+    # Отпечаток строки таблицы, по которому синхронизация находит изменения.
+    # Столбец мог появиться до учёта версий схемы, поэтому проверяется его наличие
+    if 'row_hash' not in _columns(conn, 'doctors'):
+        conn.execute('ALTER TABLE doctors ADD COLUMN row_hash TEXT')
+
+
+def addDoctorsBranch(conn: sqlite3.Connection):
+    # Филиал (поликлиническое отделение), к которому относится строка расписания
+    if 'branch' not in _columns(conn, 'doctors'):
+        conn.execute("ALTER TABLE doctors ADD COLUMN branch TEXT NOT NULL DEFAULT ''")
+
+
+def uniqueDoctorPerBranch(conn: sqlite3.Connection):
+    """
+    Уникальное ФИО врача в филиале.
+
+    Дубликаты от старой построчной загрузки удаляются так же, как при
+    синхронизации: остаётся строка с наименьшим id, оценки и подписки
+    удалённых строк переходят к ней (database.mergeDoctorDuplicates), а
+    версия данных увеличивается, чтобы воркеры перечитали справочник.
+    """
+    from database import mergeDoctorDuplicates
+
+    duplicates = conn.execute('''
+        SELECT d.id, k.id
+        FROM doctors d
+        JOIN (SELECT branch, doctor_name, MIN(id) AS id FROM doctors GROUP BY branch, doctor_name) k
+          ON k.branch = d.branch AND k.doctor_name = d.doctor_name
+        WHERE d.id != k.id
+    ''').fetchall()
+    if duplicates:
+        mergeDoctorDuplicates(conn, duplicates)
+        conn.execute('''
+            INSERT INTO meta (key, value) VALUES ('data_version', '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+        ''')
+        logger.warning(f"Удалено дубликатов врачей: {len(duplicates)}")
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_doctors_branch_name ON doctors (branch, doctor_name)')
+
+
+def addRatingsIndexes(conn: sqlite3.Connection):
+    # Выгрузка и аналитика читают оценки по времени: врача - по первому индексу, всех - по второму
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_doctor_time ON ratings (doctor_id, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_time ON ratings (timestamp)')
+    # Итоги по врачу (rebuildRatingStats) читаются из индекса, не обращаясь к строкам таблицы
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_ratings_doctor_visited ON ratings (doctor_id, visited, rating)')
+
+
+def addCallbackQueriesExpiryIndex(conn: sqlite3.Connection):
+    # Удаление устаревших запросов при каждом сохранении новых
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_callback_queries_saved ON callback_queries (saved_at)')
+
+
+# (номер, описание, функция(conn)); номера идут подряд, применённые миграции не меняются
+MIGRATIONS = (
+    (1, 'doctors.row_hash', addDoctorsRowHash),
+    (2, 'doctors.branch', addDoctorsBranch),
+    (3, 'уникальное ФИО врача в филиале', uniqueDoctorPerBranch),
+    (4, 'индексы ratings', addRatingsIndexes),
+    (5, 'индекс callback_queries.saved_at', addCallbackQueriesExpiryIndex),
+)
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schemaVersion(conn: sqlite3.Connection) -> int:
+    """Номер последней применённой миграции; 0 - ни одной"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'meta'").fetchone() is None:
+        return 0
+    row = conn.execute('SELECT value FROM meta WHERE key = ?', (SCHEMA_VERSION_KEY,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def migrate(conn: sqlite3.Connection, target: int = LATEST_VERSION) -> List[Dict]:
+    """
+    Применяет миграции с номерами от текущей версии схемы до target.
+
+    Требует таблицу meta и базовые таблицы (database.initDatabase создаёт их
+    до вызова). Каждая миграция - отдельная транзакция BEGIN IMMEDIATE:
+    версия перечитывается под блокировкой записи, поэтому миграцию,
+    уже применённую другим процессом, повторно не выполняет никто.
+
+    :return: Применённые миграции: [{'version', 'description', 'seconds'}]
+    """
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    for version, description, func in MIGRATIONS:
+        if version > target or version <= schemaVersion(conn):
+            continue
+        started = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= schemaVersion(conn):
+                conn.rollback()
+                continue
+            func(conn)
+            conn.execute('''
+                INSERT INTO meta (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (SCHEMA_VERSION_KEY, str(version)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Миграция {version} ({description}) не применена")
+            raise
+        applied.append({'version': version, 'description': description, 'seconds': time.perf_counter() - started})
+        logger.info(f"Применена миграция {version}: {description}")
+    if applied:
+        # Статистика для планировщика по новым индексам
+        conn.execute('PRAGMA optimize')
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('status', 'migrate'))
+    parser.add_argument('--target', type=int, default=LATEST_VERSION, help='применить миграции до этого номера')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    from database import initDatabase, pool
+
+    if args.command == 'migrate':
+        initDatabase(target=args.target)
+    with pool.connection() as conn:
+        current = schemaVersion(conn)
+    for version, description, _ in MIGRATIONS:
+        print(f"{'+' if version <= current else ' '} {version:>3} {description}")
+    print(f"Версия схемы: {current} из {LATEST_VERSION}")
+
+
+if __name__ == '__main__':
+    main()
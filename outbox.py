@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from aiogram import BaseMiddleware, Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, TelegramObject
+from database import (
+    dbRead, dbWrite, rememberChats, getActiveChatIds, markChatsBlocked, enqueueOutbox, createBroadcast,
+    claimOutbox, completeOutbox, resetOutboxClaims, purgeOutbox, getBroadcastProgress,
+)
+from throttling import backgroundRequest
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньшее число отправляется раньше
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NOTIFICATION = 1
+PRIORITY_BROADCAST = 2
+
+
+class ChatRegistry:
+    """
+    Список чатов - получателей рассылок.
+
+    Известные чаты держатся в памяти, в базу пачкой дописываются только новые.
+    """
+
+    def __init__(self):
+        self._known = set()
+        self._new: Dict[int, float] = {}
+
+    async def load(self):
+        self._known.update(await dbRead(getActiveChatIds))
+
+    def seen(self, chat_id: int):
+        if chat_id not in self._known:
+            self._known.add(chat_id)
+            self._new[chat_id] = time.time()
+
+    def forget(self, chat_ids: List[int]):
+        self._known.difference_update(chat_ids)
+
+    async def flush(self):
+        if self._new:
+            rows, self._new = list(self._new.items()), {}
+            await dbWrite(rememberChats, rows)
+
+
+class ChatRegistryMiddleware(BaseMiddleware):
+    """Запоминает каждый чат, написавший боту"""
+
+    def __init__(self, registry: ChatRegistry):
+        self.registry = registry
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get('event_chat')
+        if chat is not None:
+            self.registry.seen(chat.id)
+        return await handler(event, data)
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений: уведомления и рассылки.
+
+    Сообщения сохраняются в таблицу outbox и переживают перезапуск. Фоновая
+    задача забирает их пачками по приоритету (интерактивные, уведомления,
+    рассылки), так что новое важное сообщение ждёт не дольше одной пачки.
+    Частоту отправки ограничивает RateLimitMiddleware сессии бота; запросы
+    очереди помечены как фоновые и не занимают запас, оставленный ответам
+    пользователям. Ошибки сети и flood control повторяются с экспоненциальной
+    задержкой и случайным разбросом, ошибки самого сообщения - нет.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 30,
+        max_attempts: int = 5,
+        poll_interval: float = 1.0,
+        retry_delay: float = 2.0,
+        max_retry_delay: float = 600.0,
+        keep_finished: float = 7 * 24 * 3600,
+    ):
+        """
+        :param batch_size: Сколько сообщений забирается за раз; порядка лимита Telegram в секунду
+        :param max_attempts: После стольких неудачных попыток сообщение считается недоставленным
+        :param poll_interval: Как часто проверять отложенные повторы, секунды
+        :param keep_finished: Сколько хранить обработанные сообщения, секунды
+        """
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.keep_finished = keep_finished
+        self.registry = ChatRegistry()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._bot: Optional[Bot] = None
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = None
+        self._purged_at = 0.0
+
+    def start(self, bot: Bot):
+        self._bot = bot
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Дожидается отправки текущей пачки; остальное останется в базе до запуска"""
+        self._stopping = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.registry.flush()
+
+    async def send(
+        self,
+        chat_id: int,
+        text: str,
+        priority: int = PRIORITY_NOTIFICATION,
+        reply_markup: InlineKeyboardMarkup = None,
+    ) -> int:
+        """Ставит сообщение в очередь; :return: id сообщения в очереди"""
+        return (await self.sendMany([(chat_id, text)], priority, reply_markup))[0]
+
+    async def sendMany(
+        self,
+        messages: List[tuple],
+        priority: int = PRIORITY_NOTIFICATION,
+        reply_markup: InlineKeyboardMarkup = None,
+    ) -> List[int]:
+        """
+        Ставит в очередь несколько сообщений одной транзакцией.
+
+        :param messages: Пары (chat_id, text)
+        """
+        markup = self._dumpMarkup(reply_markup)
+        ids = await dbWrite(
+            enqueueOutbox, [(chat_id, text, markup, priority) for chat_id, text in messages], time.time()
+        )
+        self._wake.set()
+        return ids
+
+    async def broadcast(
+        self,
+        text: str,
+        title: str = '',
+        priority: int = PRIORITY_BROADCAST,
+        reply_markup: InlineKeyboardMarkup = None,
+    ) -> Dict:
+        """
+        Рассылка всем, кто писал боту и не заблокировал его.
+
+        :return: {'id': номер рассылки, 'total': число получателей}
+        """
+        await self.registry.flush()
+        result = await dbWrite(createBroadcast, title or text[:50], text, self._dumpMarkup(reply_markup), priority, time.time())
+        logger.info(f"Рассылка {result['id']} поставлена в очередь: {result['total']} получателей")
+        self._wake.set()
+        return result
+
+    async def progress(self, broadcast_id: int) -> Optional[Dict]:
+        """:return: {'id', 'title', 'total', 'sent', 'failed', 'pending'} или None"""
+        return await dbRead(getBroadcastProgress, broadcast_id)
+
+    @staticmethod
+    def _dumpMarkup(reply_markup: Optional[InlineKeyboardMarkup]) -> Optional[str]:
+        return reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else None
+
+    async def _run(self):
+        requeued = await dbWrite(resetOutboxClaims)
+        if requeued:
+            logger.info(f"Возвращено в очередь {requeued} неотправленных сообщений")
+        while not self._stopping:
+            try:
+                await self.registry.flush()
+                await self._purge()
+                # Сбрасываем до выборки, чтобы не пропустить сообщение, поставленное во время неё
+                self._wake.clear()
+                rows = await dbWrite(claimOutbox, time.time(), self.batch_size)
+                if rows:
+                    await self._deliverBatch(rows)
+                    continue
+            except Exception as e:
+                logger.exception(f"Ошибка очереди исходящих сообщений: {e}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliverBatch(self, rows: List[tuple]):
+        results = await asyncio.gather(*(self._deliver(row) for row in rows))
+        now = time.time()
+        sent, retry, failed, blocked = [], [], [], []
+        for row, (outcome, detail) in zip(rows, results):
+            message_id, chat_id, attempts = row[0], row[1], row[6]
+            if outcome == 'sent':
+                sent.append((now, message_id))
+            elif outcome == 'retry' and attempts + 1 < self.max_attempts:
+                delay, error = detail
+                retry.append((now + delay, error, message_id))
+            else:
+                if outcome == 'blocked':
+                    blocked.append(chat_id)
+                failed.append((detail if isinstance(detail, str) else detail[1], message_id))
+        await dbWrite(completeOutbox, sent, retry, failed)
+        if blocked:
+            self.registry.forget(blocked)
+            await dbWrite(markChatsBlocked, blocked)
+        self.sent += len(sent)
+        self.retried += len(retry)
+        self.failed += len(failed)
+
+        for broadcast_id in {row[5] for row in rows if row[5] is not None}:
+            progress = await self.progress(broadcast_id)
+            if progress and not progress['pending']:
+                logger.info(
+                    f"Рассылка {broadcast_id} завершена: доставлено {progress['sent']} "
+                    f"из {progress['total']}, не доставлено {progress['failed']}"
+                )
+
+    async def _deliver(self, row: tuple):
+        """:return: (исход: sent/retry/blocked/failed, ошибка или (задержка, ошибка))"""
+        _, chat_id, text, reply_markup, priority, _, attempts = row
+        # Контекст задачи gather изолирован, флаг не влияет на обработчики
+        backgroundRequest.set(priority > PRIORITY_INTERACTIVE)
+        try:
+            await self._bot.send_message(
+                chat_id, text,
+                reply_markup=InlineKeyboardMarkup.model_validate_json(reply_markup) if reply_markup else None,
+            )
+            return 'sent', None
+        except TelegramForbiddenError as e:
+            return 'blocked', str(e)
+        except TelegramRetryAfter as e:
+            return 'retry', (e.retry_after + random.uniform(0, 1), str(e))
+        except TelegramBadRequest as e:
+            return 'failed', str(e)
+        except Exception as e:
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** attempts)
+            return 'retry', (delay * random.uniform(0.5, 1.5), f"{type(e).__name__}: {e}")
+
+    async def _purge(self):
+        now = time.time()
+        if now - self._purged_at < 3600:
+            return
+        self._purged_at = now
+        removed = await dbWrite(purgeOutbox, now - self.keep_finished)
+        if removed:
+            logger.info(f"Удалено {removed} обработанных сообщений из очереди")
+
+
+outbox = Outbox()
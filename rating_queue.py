@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import os
+from database import dbWrite, saveRatingsBatch
+
+logger = logging.getLogger(__name__)
+
+# Оценки, которые не удалось записать в базу при остановке; дописываются при следующем запуске
+RATING_SPILL_FILE = os.getenv('RATING_SPILL_FILE', 'ratings_spill.jsonl')
+
+
+class RatingWriteQueue:
+    """
+    Отложенная пакетная запись оценок врачей.
+
+    Обработчики только кладут оценку в ограниченную очередь, а фоновая задача
+    сохраняет накопленное одной транзакцией - по достижении batch_size или
+    через flush_interval секунд после первой оценки в пачке. Если очередь
+    заполнена, put ждёт освобождения места. При остановке очередь
+    дописывается в базу полностью.
+
+    Пока процесс работает, пачка записывается повторно с растущей паузой,
+    пока не получится. Если база недоступна и при остановке (5 попыток),
+    пачка дописывается в файл spill_path, и start сохраняет её в базу при
+    следующем запуске - оценки не теряются. Время таких оценок в базе -
+    время повторной записи.
+    """
+
+    def __init__(self, max_size: int = 10000, batch_size: int = 500, flush_interval: float = 0.5,
+                 spill_path: str = RATING_SPILL_FILE):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self.spilled = 0
+        self._queue = asyncio.Queue(maxsize=max_size)
+        self._stopping = False
+        self._task = None
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, user_id: int, doctor_id: int, doctor_name: str, visited: bool, rating: int = None):
+        if self._stopping:
+            raise RuntimeError('Очередь записи оценок остановлена')
+        await self._queue.put((user_id, doctor_id, doctor_name, visited, rating))
+
+    async def stop(self):
+        """Прекращает приём оценок и дожидается записи всего накопленного"""
+        self._stopping = True
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        await self._replay()
+        while not (self._stopping and self._queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._write(batch)
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            # Ждём недолго, чтобы вовремя заметить остановку
+            batch.append(await asyncio.wait_for(self._queue.get(), self.flush_interval))
+        except asyncio.TimeoutError:
+            return batch
+
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if self._stopping or timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: list):
+        delay = 0.1
+        attempt = 1
+        while True:
+            try:
+                await dbWrite(saveRatingsBatch, batch)
+                return
+            except Exception as e:
+                if self._stopping and attempt >= 5:
+                    self._spill(batch, e)
+                    return
+                logger.warning(f"Ошибка записи пачки оценок (попытка {attempt}): {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+                attempt += 1
+
+    def _spill(self, batch: list, error: Exception):
+        """Дописывает пачку в файл spill_path; в лог она попадает, только если не удалось и это"""
+        try:
+            with open(self.spill_path, 'a', encoding='utf-8') as file:
+                file.writelines(json.dumps(rating, ensure_ascii=False) + '\n' for rating in batch)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить {len(batch)} оценок ни в базу ({error}), ни в {self.spill_path} ({e}): {batch}")
+            return
+        self.spilled += len(batch)
+        logger.error(f"Не удалось сохранить {len(batch)} оценок при остановке: {error}; "
+                     f"они записаны в {self.spill_path} и будут сохранены при следующем запуске")
+
+    async def _replay(self):
+        """Сохраняет оценки, отложенные в spill_path при прошлой остановке"""
+        # Файл сначала переименовывается, чтобы его не подхватил второй воркер
+        path = f"{self.spill_path}.{os.getpid()}"
+        try:
+            os.replace(self.spill_path, path)
+        except FileNotFoundError:
+            return
+        with open(path, encoding='utf-8') as file:
+            ratings = [tuple(json.loads(line)) for line in file if line.strip()]
+        for start in range(0, len(ratings), self.batch_size):
+            await self._write(ratings[start:start + self.batch_size])
+        os.remove(path)
+        logger.info(f"Сохранено оценок, отложенных при прошлой остановке: {len(ratings)}")
+
+
+ratingQueue = RatingWriteQueue()
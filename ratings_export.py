@@ -0,0 +1,277 @@
+"""
+Выгрузка оценок врачей и аналитика по скользящим окнам.
+
+Оценки читаются страницами по индексу (doctor_id, timestamp) или (timestamp)
+и сразу записываются в файл, поэтому память не зависит от размера
+таблицы ratings. В боте страницы читаются через пул соединений, а запись
+в файл идёт в пуле потоков, и event loop не блокируется.
+
+Запуск из корня репозитория (бот может работать одновременно):
+    python ratings_export.py export --format csv --from 2026-01-01 --to 2026-03-31 --output ratings.csv
+    python ratings_export.py summary --until 2026-03-31
+    python ratings_export.py rolling --doctor 5 --from 2026-01-01 --to 2026-03-31
+"""
+import argparse
+import asyncio
+import csv
+import json
+import sys
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, TextIO
+from database import dbRead, getDailyRatings, getRatingsPage, getRatingWindows
+from today_index import clinicNow, clinicTimezone
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_COLUMNS = ('id', 'timestamp', 'doctor_id', 'doctor_name', 'visited', 'rating', 'user_id')
+EXPORT_CHUNK_SIZE = 5000
+SHORT_WINDOW_DAYS = 7
+LONG_WINDOW_DAYS = 30
+
+
+def parseDate(text: str) -> date:
+    """Дата из 'YYYY-MM-DD' или 'DD.MM.YYYY'"""
+    for pattern in ('%Y-%m-%d', '%d.%m.%Y'):
+        try:
+            return datetime.strptime(text.strip(), pattern).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Неверная дата: {text}")
+
+
+def parseExportArgs(text: str, today: date) -> tuple:
+    """
+    Разбирает аргументы команды бота: [csv|jsonl] [с] [по] [id врача].
+
+    Без дат выгружаются последние 30 дней, с одной датой - с неё по сегодня.
+
+    :return: (формат, первый день, последний день, id врача или None)
+    """
+    args = (text or '').split()
+    fmt = args.pop(0).lower() if args and args[0].lower() in EXPORT_FORMATS else 'csv'
+    doctor_id = int(args.pop()) if args and args[-1].isdigit() else None
+    if len(args) > 2:
+        raise ValueError("Слишком много аргументов")
+    dates = [parseDate(arg) for arg in args]
+    date_to = dates[1] if len(dates) == 2 else today
+    date_from = dates[0] if dates else date_to - timedelta(days=LONG_WINDOW_DAYS - 1)
+    if date_from > date_to:
+        raise ValueError("Начало периода позже конца")
+    return fmt, date_from, date_to, doctor_id
+
+
+def utcBound(day: date) -> str:
+    """
+    Начало дня по часовому поясу поликлиники в формате столбца timestamp.
+
+    Столбец ratings.timestamp заполняется CURRENT_TIMESTAMP, то есть в UTC,
+    а дни в командах - дни поликлиники (clinicNow): граница переводится в
+    UTC, и запрос по-прежнему идёт по индексу времени.
+    """
+    return datetime.combine(day, time(), clinicTimezone).astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def clinicOffsetMinutes(day: date) -> int:
+    """Смещение часового пояса поликлиники от UTC в минутах на начало дня day"""
+    return int(datetime.combine(day, time(), clinicTimezone).utcoffset().total_seconds() // 60)
+
+
+def periodBounds(date_from: date, date_to: date) -> tuple:
+    """Границы периода в формате столбца timestamp: [начало первого дня, начало дня после последнего)"""
+    return utcBound(date_from), utcBound(date_to + timedelta(days=1))
+
+
+class RatingsWriter:
+    """Пишет строки getRatingsPage в CSV или JSON Lines"""
+
+    def __init__(self, file: TextIO, fmt: str = 'csv'):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+        self.file = file
+        self.fmt = fmt
+        self.rows = 0
+        if fmt == 'csv':
+            self._csv = csv.writer(file)
+            self._csv.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows: List[tuple]):
+        if self.fmt == 'csv':
+            self._csv.writerows(rows)
+        else:
+            self.file.writelines(
+                json.dumps(dict(zip(EXPORT_COLUMNS, row[:4] + (bool(row[4]),) + row[5:])), ensure_ascii=False) + '\n'
+                for row in rows
+            )
+        self.rows += len(rows)
+
+
+def iterRatingPages(
+    date_from: date, date_to: date, doctor_id: int = None, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[List[tuple]]:
+    """Страницы оценок за период включительно (синхронно, для командной строки)"""
+    start, end = periodBounds(date_from, date_to)
+    after = None
+    while True:
+        rows = getRatingsPage(after, start, end, doctor_id, chunk_size)
+        if rows:
+            yield rows
+        if len(rows) < chunk_size:
+            return
+        after = (rows[-1][1], rows[-1][0])
+
+
+def exportRatings(file: TextIO, fmt: str, date_from: date, date_to: date, doctor_id: int = None) -> int:
+    """:return: Число выгруженных оценок"""
+    writer = RatingsWriter(file, fmt)
+    for rows in iterRatingPages(date_from, date_to, doctor_id):
+        writer.write(rows)
+    return writer.rows
+
+
+async def exportRatingsToFile(path: str, fmt: str, date_from: date, date_to: date, doctor_id: int = None) -> int:
+    """
+    Выгружает оценки в файл из работающего бота.
+
+    Каждая страница читается отдельным запросом к пулу соединений, так что
+    выгрузка не занимает поток чтения надолго и не мешает пользователям.
+
+    :return: Число выгруженных оценок
+    """
+    loop = asyncio.get_running_loop()
+    start, end = periodBounds(date_from, date_to)
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = RatingsWriter(file, fmt)
+        after = None
+        while True:
+            rows = await dbRead(getRatingsPage, after, start, end, doctor_id, EXPORT_CHUNK_SIZE)
+            if rows:
+                await loop.run_in_executor(None, writer.write, rows)
+            if len(rows) < EXPORT_CHUNK_SIZE:
+                return writer.rows
+            after = (rows[-1][1], rows[-1][0])
+
+
+def _average(rating_sum: int, count: int) -> Optional[float]:
+    return round(rating_sum / count, 2) if count else None
+
+
+def summarizeWindows(rows: List[tuple]) -> List[Dict]:
+    """Строки getRatingWindows в словари со средними и долей посещений"""
+    summary = []
+    for doctor_id, name, sum_short, count_short, sum_long, count_long, visited, not_visited in rows:
+        answers = visited + not_visited
+        summary.append({
+            'doctor_id': doctor_id,
+            'doctor_name': name,
+            f'avg_{SHORT_WINDOW_DAYS}d': _average(sum_short, count_short),
+            f'count_{SHORT_WINDOW_DAYS}d': count_short,
+            f'avg_{LONG_WINDOW_DAYS}d': _average(sum_long, count_long),
+            f'count_{LONG_WINDOW_DAYS}d': count_long,
+            'visited': visited,
+            'not_visited': not_visited,
+            'visit_ratio': round(visited / answers, 3) if answers else None,
+        })
+    return summary
+
+
+def windowBounds(until: date) -> tuple:
+    """(начало длинного окна, начало короткого окна, конец) в UTC для окон, заканчивающихся днём поликлиники until"""
+    end = until + timedelta(days=1)
+    return (
+        utcBound(end - timedelta(days=LONG_WINDOW_DAYS)),
+        utcBound(end - timedelta(days=SHORT_WINDOW_DAYS)),
+        utcBound(end),
+    )
+
+
+def ratingSummary(until: date, doctor_id: int = None) -> List[Dict]:
+    """Средние за 7 и 30 дней по день until включительно и доля посещений за 30 дней по врачам"""
+    return summarizeWindows(getRatingWindows(*windowBounds(until), doctor_id))
+
+
+def rollingSeries(daily: List[tuple], date_from: date, date_to: date) -> List[Dict]:
+    """
+    Скользящие средние по дням периода.
+
+    :param daily: Строки getDailyRatings, начиная не позже чем за LONG_WINDOW_DAYS - 1 дней до date_from
+    """
+    days = (date_to - date_from).days + 1
+    origin = date_from - timedelta(days=LONG_WINDOW_DAYS - 1)
+    # Префиксные суммы по плотному ряду дней: окно любой длины считается за O(1)
+    totals = [[0, 0, 0, 0] for _ in range(days + LONG_WINDOW_DAYS)]
+    for day, rating_sum, count, visited, not_visited in daily:
+        offset = (date.fromisoformat(day) - origin).days
+        if 0 <= offset < len(totals) - 1:
+            totals[offset + 1] = [rating_sum, count, visited, not_visited]
+    for offset in range(1, len(totals)):
+        totals[offset] = [a + b for a, b in zip(totals[offset - 1], totals[offset])]
+
+    def window(end: int, length: int) -> list:
+        return [a - b for a, b in zip(totals[end], totals[max(0, end - length)])]
+
+    series = []
+    for number in range(days):
+        end = LONG_WINDOW_DAYS + number
+        short, long = window(end, SHORT_WINDOW_DAYS), window(end, LONG_WINDOW_DAYS)
+        answers = long[2] + long[3]
+        series.append({
+            'day': (date_from + timedelta(days=number)).isoformat(),
+            f'avg_{SHORT_WINDOW_DAYS}d': _average(short[0], short[1]),
+            f'avg_{LONG_WINDOW_DAYS}d': _average(long[0], long[1]),
+            f'count_{LONG_WINDOW_DAYS}d': long[1],
+            'visit_ratio': round(long[2] / answers, 3) if answers else None,
+        })
+    return series
+
+
+def ratingRolling(date_from: date, date_to: date, doctor_id: int = None) -> List[Dict]:
+    """Скользящие средние по дням для врача (или по всем врачам)"""
+    start = date_from - timedelta(days=LONG_WINDOW_DAYS - 1)
+    daily = getDailyRatings(*periodBounds(start, date_to), doctor_id, clinicOffsetMinutes(date_to))
+    return rollingSeries(daily, date_from, date_to)
+
+
+def writeDicts(file: TextIO, rows: List[Dict], fmt: str):
+    if fmt == 'csv':
+        if rows:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    today = clinicNow().date()
+
+    export = commands.add_parser('export', help='выгрузка оценок за период')
+    export.add_argument('--from', dest='date_from', type=parseDate, default=today - timedelta(days=LONG_WINDOW_DAYS - 1))
+    export.add_argument('--to', dest='date_to', type=parseDate, default=today)
+    summary = commands.add_parser('summary', help='средние за 7 и 30 дней и доля посещений по врачам')
+    summary.add_argument('--until', type=parseDate, default=today)
+    rolling = commands.add_parser('rolling', help='скользящие средние по дням')
+    rolling.add_argument('--from', dest='date_from', type=parseDate, default=today - timedelta(days=LONG_WINDOW_DAYS - 1))
+    rolling.add_argument('--to', dest='date_to', type=parseDate, default=today)
+    for command in (export, summary, rolling):
+        command.add_argument('--doctor', type=int, help='id врача; по умолчанию - все врачи')
+        command.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        command.add_argument('--output', help='файл; по умолчанию - стандартный вывод')
+    args = parser.parse_args()
+
+    file = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        if args.command == 'export':
+            count = exportRatings(file, args.format, args.date_from, args.date_to, args.doctor)
+            print(f"Выгружено оценок: {count}", file=sys.stderr)
+        elif args.command == 'summary':
+            writeDicts(file, ratingSummary(args.until, args.doctor), args.format)
+        else:
+            writeDicts(file, ratingRolling(args.date_from, args.date_to, args.doctor), args.format)
+    finally:
+        if file is not sys.stdout:
+            file.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,392 @@
+import asyncio
+import csv
+import hashlib
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+from database import applyDoctorSnapshot, dbRead, dbWrite, getDoctorCountsByBranch
+
+logger = logging.getLogger(__name__)
+
+WEEKDAY_COLUMNS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+def recordsFromValues(values: List[list]) -> List[Dict]:
+    """
+    Превращает значения листа (первая строка - заголовки) в записи «заголовок -> значение».
+
+    Заголовки приводятся к нижнему регистру, короткие строки дополняются
+    пустыми ячейками, полностью пустые строки пропускаются.
+    """
+    if not values:
+        return []
+    header = [str(title).strip().lower() for title in values[0]]
+    records = []
+    for row in values[1:]:
+        cells = ['' if cell is None else cell for cell in row]
+        if not any(str(cell).strip() for cell in cells):
+            continue
+        cells += [''] * (len(header) - len(cells))
+        records.append(dict(zip(header, cells)))
+    return records
+
+
+class ScheduleSource(ABC):
+    """
+    Источник расписания для DoctorSchedule.
+
+    fetch выполняется в пуле потоков и может блокироваться на сети или диске.
+    Возвращает сырые записи по филиалам: {филиал: [{заголовок: значение}]}.
+    Источник без fetch не создаётся (TypeError), а не падает посреди синхронизации.
+    """
+
+    name = 'source'
+
+    @abstractmethod
+    def fetch(self) -> Dict[str, List[Dict]]:
+        """:return: {филиал: [{заголовок: значение}]}"""
+
+
+class GoogleSheetSource(ScheduleSource):
+    def __init__(self, credentials_file: str, sheet_key: str, worksheets: Dict[str, str] = None, branch: str = ''):
+        """
+        Листы одной Google таблицы; все листы читаются одним запросом values_batch_get
+
+        :param credentials_file: Путь к файлу с учетными данными Google API
+        :param sheet_key: Ключ Google Sheets документа
+        :param worksheets: {название листа: филиал}; по умолчанию - первый лист
+        :param branch: Филиал первого листа, если worksheets не задан
+        """
+        self.credentials_file = credentials_file
+        self.sheet_key = sheet_key
+        self.worksheets = worksheets
+        self.branch = branch
+        self.name = f'sheets:{sheet_key}'
+        self.spreadsheet = None
+
+    def _connect_to_google_sheets(self):
+        """Устанавливает соединение с Google Sheets"""
+        try:
+            # Тяжёлые библиотеки Google загружаются только при первой синхронизации
+            import gspread
+            from google.oauth2.service_account import Credentials
+
+            scope = [
+                "https://spreadsheets.google.com/feeds",
+                "https://www.googleapis.com/auth/drive"
+            ]
+            creds = Credentials.from_service_account_file(
+                self.credentials_file,
+                scopes=scope
+            )
+            client = gspread.authorize(creds)
+            return client.open_by_key(self.sheet_key)
+        except Exception as e:
+            logger.error(f"Ошибка подключения к Google Sheets: {e}")
+            raise
+
+    def fetch(self) -> Dict[str, List[Dict]]:
+        if self.spreadsheet is None:
+            self.spreadsheet = self._connect_to_google_sheets()
+        worksheets = self.worksheets or {self.spreadsheet.sheet1.title: self.branch}
+        titles = list(worksheets)
+        # Название листа в A1-нотации берётся в кавычки, кавычки внутри удваиваются
+        ranges = ["'" + title.replace("'", "''") + "'" for title in titles]
+        response = self.spreadsheet.values_batch_get(ranges)
+        return {
+            worksheets[title]: recordsFromValues(value_range.get('values', []))
+            for title, value_range in zip(titles, response.get('valueRanges', []))
+        }
+
+
+class CsvScheduleSource(ScheduleSource):
+    def __init__(self, path: str, branch: str = None):
+        """
+        :param path: CSV-файл с теми же столбцами, что и лист расписания
+        :param branch: Филиал; по умолчанию - имя файла без расширения
+        """
+        self.path = path
+        self.branch = os.path.splitext(os.path.basename(path))[0] if branch is None else branch
+        self.name = f'csv:{path}'
+
+    def fetch(self) -> Dict[str, List[Dict]]:
+        with open(self.path, encoding='utf-8-sig', newline='') as file:
+            sample = file.read(4096)
+            file.seek(0)
+            try:
+                # Excel с русской локалью сохраняет CSV через точку с запятой
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            return {self.branch: recordsFromValues(list(csv.reader(file, dialect)))}
+
+
+class XlsxScheduleSource(ScheduleSource):
+    def __init__(self, path: str, sheets: Dict[str, str] = None):
+        """
+        :param path: Книга Excel; каждый лист - расписание одного филиала
+        :param sheets: {название листа: филиал}; по умолчанию - все листы, филиал - название листа
+        """
+        self.path = path
+        self.sheets = sheets
+        self.name = f'xlsx:{path}'
+
+    def fetch(self) -> Dict[str, List[Dict]]:
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            sheets = self.sheets or {title: title for title in workbook.sheetnames}
+            return {
+                branch: recordsFromValues([list(row) for row in workbook[title].iter_rows(values_only=True)])
+                for title, branch in sheets.items()
+            }
+        finally:
+            workbook.close()
+
+
+def fileScheduleSource(path: str) -> ScheduleSource:
+    """Локальный источник расписания по расширению файла (.csv или .xlsx)"""
+    if path.lower().endswith('.xlsx'):
+        return XlsxScheduleSource(path)
+    return CsvScheduleSource(path)
+
+
+class DoctorSchedule:
+    """
+    Расписание врачей из нескольких источников.
+
+    Источники читаются параллельно в собственном пуле из max_workers потоков,
+    поэтому синхронизация длится примерно как чтение самого медленного
+    источника. Филиалы источника, который не прочитан, и филиалы, пришедшие
+    пустыми, в снимок не входят: их врачи остаются в базе как были, а не
+    удаляются.
+    """
+
+    def __init__(self, sources: List[ScheduleSource], max_workers: int = 4):
+        self.sources = list(sources)
+        self.max_workers = max_workers
+        self._executor = None
+        # Время чтения каждого источника при последней синхронизации, секунды
+        self.lastFetchTimings: Dict[str, float] = {}
+        # Источники, не прочитанные при последней синхронизации
+        self.lastFailedSources: List[str] = []
+
+    def fetch_source(self, source: ScheduleSource) -> Tuple[List[Dict], List[str]]:
+        """
+        Блокирующее чтение одного источника, выполняется вне event loop
+
+        :return: (записи врачей, филиалы источника, пришедшие без единой строки)
+        """
+        started = time.perf_counter()
+        try:
+            branches = source.fetch()
+        except Exception as e:
+            logger.error(f"Ошибка получения данных врачей ({source.name}): {e}")
+            raise
+        doctors = [
+            self._format_doctor_record(record, branch)
+            for branch, records in branches.items()
+            for record in records
+        ]
+        empty = [branch for branch, records in branches.items() if not records]
+        for branch in empty:
+            logger.warning(f"Филиал «{branch}» в источнике {source.name} пуст и пропущен")
+        self.lastFetchTimings[source.name] = time.perf_counter() - started
+        return doctors, empty
+
+    async def fetch_snapshot(self) -> Tuple[List[Dict], Set[str], bool]:
+        """
+        Читает все источники.
+
+        :return: (записи врачей, филиалы, которые есть в записях, прочитаны ли все источники и филиалы)
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='schedule-source')
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self.fetch_source, source) for source in self.sources
+        ), return_exceptions=True)
+        failed = [
+            (source, result) for source, result in zip(self.sources, results) if isinstance(result, BaseException)
+        ]
+        self.lastFailedSources = [source.name for source, _ in failed]
+        if len(failed) == len(self.sources):
+            raise failed[0][1]
+        doctors, complete = [], not failed
+        for result in results:
+            if not isinstance(result, BaseException):
+                doctors.extend(result[0])
+                complete = complete and not result[1]
+        return doctors, {doctor['branch'] for doctor in doctors}, complete
+
+    async def get_all_doctors_data(self) -> List[Dict]:
+        return (await self.fetch_snapshot())[0]
+
+    def _format_doctor_record(self, record: Dict, branch: str = '') -> Dict:
+
+        return {
+            # Столбец «филиал» позволяет держать несколько филиалов на одном листе
+            'branch': str(record.get('филиал') or branch).strip(),
+            'doctor_name': str(record['фио врача']),
+            'speciality' : str(record['специализация']),
+            'mon': str(record.get('пн', 'выходной')),
+            'tue': str(record.get('вт', 'выходной')),
+            'wed': str(record.get('ср', 'выходной')),
+            'thu': str(record.get('чт', 'выходной')),
+            'fri': str(record.get('пт', 'выходной')),
+            'sat': str(record.get('сб', 'выходной')),
+            'sun': str(record.get('вс', 'выходной'))
+        }
+
+
+def fingerprintDoctor(doctor: Dict) -> str:
+    """Отпечаток записи врача: меняется при изменении любого поля"""
+    values = [doctor['branch'], doctor['doctor_name'], doctor['speciality']] + [doctor[day] for day in WEEKDAY_COLUMNS]
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def doctorRowsWithFingerprints(doctors: List[Dict]) -> List[tuple]:
+    """Готовит строки для applyDoctorSnapshot; при повторе ФИО в филиале побеждает последняя строка"""
+    rows = {}
+    for doctor in doctors:
+        if not doctor['doctor_name']:
+            continue
+        rows[(doctor['branch'], doctor['doctor_name'])] = (
+            doctor['branch'], doctor['doctor_name'], doctor['speciality'],
+            *(doctor[day] for day in WEEKDAY_COLUMNS),
+            fingerprintDoctor(doctor),
+        )
+    return list(rows.values())
+
+
+class SnapshotRejected(Exception):
+    """Снимок расписания похож на пустое или оборванное чтение и не применяется"""
+
+
+def checkSnapshot(rows: List[tuple], current: Dict[str, int], max_shrink: float):
+    """
+    Проверяет снимок перед применением; при подозрительном снимке бросает SnapshotRejected.
+
+    Пустой лист, оборванный файл или неполный ответ API выглядят как
+    удаление врачей, а вместе с ними - подписок, интервалов и карточек.
+    Поэтому снимок отклоняется, если в нём нет строк или если число врачей
+    в целом или в каком-либо филиале уменьшилось больше чем на долю max_shrink.
+
+    :param rows: Строки doctorRowsWithFingerprints
+    :param current: {филиал: число врачей} в базе
+    """
+    if not rows:
+        raise SnapshotRejected("источники вернули 0 строк")
+    counts = Counter(row[0] for row in rows)
+    before = sum(current.values())
+    if len(rows) < before * (1 - max_shrink):
+        raise SnapshotRejected(f"врачей было {before}, в снимке {len(rows)}")
+    for branch, count in current.items():
+        # Строки без филиала переходят к филиалам при первой загрузке с разделением по филиалам
+        if branch == '' and '' not in counts:
+            continue
+        if counts[branch] < count * (1 - max_shrink):
+            raise SnapshotRejected(f"в филиале «{branch}» было врачей {count}, в снимке {counts[branch]}")
+
+
+class ScheduleSync:
+    """
+    Фоновая синхронизация таблицы doctors с расписанием из источников DoctorSchedule.
+
+    Каждая синхронизация записывает только изменившиеся строки одной
+    транзакцией и увеличивает версию данных. Подписчики (кэши, индексы)
+    получают результат синхронизации только если данные изменились.
+    Снимок, не прошедший checkSnapshot, не применяется: данные остаются
+    прежними, а синхронизация считается неудачной. Врач, которого нет в
+    снимке, удаляется (а подписчики получают уведомление) только если его
+    нет и в следующем принятом снимке: единичное неполное чтение не
+    отменяет подписки.
+    """
+
+    def __init__(self, schedule: DoctorSchedule, max_shrink: float = 0.5):
+        """
+        :param schedule: Источники расписания
+        :param max_shrink: Допустимая доля врачей, удаляемых одной синхронизацией (в целом и в филиале)
+        """
+        self.schedule = schedule
+        self.max_shrink = max_shrink
+        self.version = 0
+        self._listeners: List[Callable[[Dict], Awaitable]] = []
+        # Статистика для мониторинга: длительность фаз последней синхронизации, секунды
+        self.runs = 0
+        self.errors = 0
+        self.lastTimings: Dict[str, float] = {}
+        self.lastRows = 0
+        self.lastSuccessAt = 0.0
+        # Врачи, которых не было в последнем принятом снимке; удаляются, если не вернутся в следующем
+        self.missing: Set[int] = set()
+
+    def addListener(self, callback: Callable[[Dict], Awaitable]):
+        """
+        Регистрирует корутину, вызываемую после синхронизации с изменениями.
+
+        :param callback: Принимает словарь результата applyDoctorSnapshot
+        """
+        self._listeners.append(callback)
+
+    async def syncOnce(self) -> Dict:
+        started = time.perf_counter()
+        doctors, branches, complete = await self.schedule.fetch_snapshot()
+        fetched = time.perf_counter()
+        rows = doctorRowsWithFingerprints(doctors)
+        counts = await dbRead(getDoctorCountsByBranch)
+        if complete:
+            # Полностью прочитанные источники отвечают и за строки без филиала, не перешедшие к филиалам
+            branches.add('')
+        checkSnapshot(rows, {branch: count for branch, count in counts.items() if branch in branches}, self.max_shrink)
+        result = await dbWrite(applyDoctorSnapshot, rows, branches, self.missing)
+        self.missing = set(result['missing'])
+        if self.missing:
+            logger.warning(
+                f"Нет в расписании врачей: {len(self.missing)}; будут удалены, если их не будет и в следующей синхронизации"
+            )
+        applied = time.perf_counter()
+        changed = result['inserted'] or result['updated'] or result['deleted']
+
+        if changed or result['version'] != self.version:
+            logger.info(
+                f"Синхронизация расписания: версия {result['version']}, "
+                f"добавлено {len(result['inserted'])}, изменено {len(result['updated'])}, "
+                f"удалено {len(result['deleted'])}"
+            )
+            self.version = result['version']
+            for callback in self._listeners:
+                try:
+                    await callback(result)
+                except Exception as e:
+                    logger.exception(f"Ошибка обработчика синхронизации: {e}")
+
+        self.runs += 1
+        self.lastRows = len(doctors)
+        self.lastSuccessAt = time.time()
+        self.lastTimings = {
+            'fetch': fetched - started,
+            'apply': applied - fetched,
+            'listeners': time.perf_counter() - applied,
+        }
+        return result
+
+    async def runForever(self, interval: float, immediate: bool = True):
+        """Периодически синхронизирует расписание; ошибки не останавливают цикл"""
+        if not immediate:
+            await asyncio.sleep(interval)
+        while True:
+            try:
+                await self.syncOnce()
+            except SnapshotRejected as e:
+                self.errors += 1
+                logger.error(f"Синхронизация расписания отменена, данные не изменены: {e}")
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Ошибка синхронизации расписания: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,201 @@
+import heapq
+import re
+from itertools import groupby, islice
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+DoctorRow = Tuple[int, str, str]
+
+_NON_LETTERS = re.compile(r"[^0-9a-zа-я]+")
+
+# Минимальная доля общих триграмм (коэффициент Дайса) для нечёткого совпадения
+FUZZY_THRESHOLD = 0.45
+# Триграммы, встречающиеся чаще, не используются для отбора кандидатов
+MAX_POSTING_SHARE = 0.1
+
+
+def normalizeName(text: str) -> str:
+    """Приводит ФИО к виду для поиска: нижний регистр, ё -> е, только буквы и цифры"""
+    text = text.casefold().replace('ё', 'е')
+    return _NON_LETTERS.sub(' ', text).strip()
+
+
+def trigrams(token: str) -> set:
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SurnameIndex:
+    """
+    Поисковый индекс врачей по ФИО.
+
+    Строится при синхронизации расписания и хранит нормализованные слова ФИО:
+    отсортированный список уникальных слов для поиска по префиксу и списки
+    вхождений триграмм для поиска с опечатками. Результаты ранжируются:
+    точное совпадение фамилии, префикс фамилии, совпадение другого слова ФИО,
+    нечёткое совпадение.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._doctors: List[DoctorRow] = []
+        self._tokens: List[str] = []
+        # Для каждого слова: врачи, у которых оно фамилия, и врачи, у которых имя/отчество
+        self._token_docs: List[Tuple[List[int], List[int]]] = []
+        self._token_trigrams: List[set] = []
+        self._postings: Dict[str, List[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._doctors)
+
+    def build(self, doctors: List[DoctorRow], version: int = 0):
+        """
+        Перестраивает индекс.
+
+        :param doctors: Строки (id, doctor_name, speciality)
+        :param version: Версия данных, по которой построен индекс
+        """
+        # Врачи нумеруются в алфавитном порядке, поэтому списки номеров уже отсортированы по ФИО
+        doctors = sorted(doctors, key=lambda doctor: (normalizeName(doctor[1]), doctor[0]))
+        occurrences = defaultdict(lambda: ([], []))
+        for doc_idx, (_, name, _) in enumerate(doctors):
+            for position, token in enumerate(normalizeName(name).split()):
+                docs = occurrences[token][0 if position == 0 else 1]
+                if not docs or docs[-1] != doc_idx:
+                    docs.append(doc_idx)
+
+        tokens = sorted(occurrences)
+        token_trigrams = []
+        postings = defaultdict(list)
+        for token_idx, token in enumerate(tokens):
+            grams = trigrams(token)
+            token_trigrams.append(grams)
+            for gram in grams:
+                postings[gram].append(token_idx)
+
+        self._doctors = doctors
+        self._tokens = tokens
+        self._token_docs = [occurrences[token] for token in tokens]
+        self._token_trigrams = token_trigrams
+        self._postings = dict(postings)
+        self.version = version
+
+    def search(self, query: str, limit: int = 20, offset: int = 0) -> Tuple[List[DoctorRow], int]:
+        """
+        Ищет врачей по началу фамилии (или другого слова ФИО) с учётом опечаток.
+
+        :return: (страница результатов, общее число найденных врачей)
+        """
+        groups = self._groups(query)
+        page = list(islice(self._ranked(groups), offset, offset + limit))
+        return [self._doctors[doc_idx] for doc_idx in page], self._total(groups)
+
+    def searchPage(
+        self, query: str, after_id: int = 0, before_id: int = None, limit: int = 10
+    ) -> Optional[Tuple[List[DoctorRow], bool, bool, int]]:
+        """
+        Страница результатов поиска по ключу: после врача after_id или перед врачом before_id.
+
+        Курсор - id врача, а не номер страницы, поэтому страницы не съезжают,
+        если между нажатиями в выдаче что-то изменилось.
+
+        :return: (врачи страницы, есть ли предыдущая, есть ли следующая, всего найдено)
+                 или None, если врача-курсора больше нет в выдаче
+        """
+        groups = self._groups(query)
+        ranked = self._ranked(groups)
+        doctors = self._doctors
+        if before_id is not None:
+            preceding = []
+            for doc_idx in ranked:
+                if doctors[doc_idx][0] == before_id:
+                    page = preceding[-limit:]
+                    return [doctors[i] for i in page], len(preceding) > limit, True, self._total(groups)
+                preceding.append(doc_idx)
+            return None
+
+        position = 0
+        if after_id:
+            for doc_idx in ranked:
+                position += 1
+                if doctors[doc_idx][0] == after_id:
+                    break
+            else:
+                return None
+        page = list(islice(ranked, limit + 1))
+        return [doctors[i] for i in page[:limit]], position > 0, len(page) > limit, self._total(groups)
+
+    @staticmethod
+    def _ranked(groups: List[Tuple[float, List[int]]]) -> Iterator[int]:
+        """Номера найденных врачей по убыванию релевантности, внутри группы - по алфавиту"""
+        # Группы с одинаковой оценкой сливаются в алфавитном порядке,
+        # и перебирается только нужное для страницы число врачей
+        groups.sort(key=lambda group: -group[0])
+        seen = set()
+        for _, tier in groupby(groups, key=lambda group: group[0]):
+            for doc_idx in heapq.merge(*(docs for _, docs in tier)):
+                if doc_idx not in seen:
+                    seen.add(doc_idx)
+                    yield doc_idx
+
+    @staticmethod
+    def _total(groups: List[Tuple[float, List[int]]]) -> int:
+        matched = set()
+        for _, docs in groups:
+            matched.update(docs)
+        return len(matched)
+
+    def _groups(self, query: str) -> List[Tuple[float, List[int]]]:
+        """Найденные врачи, сгруппированные по оценке релевантности"""
+        words = normalizeName(query).split()
+        if not words:
+            return []
+        # Ищем по самому длинному слову запроса, обычно это фамилия
+        word = max(words, key=len)
+
+        token_scores: Dict[int, float] = {}
+        tokens = self._tokens
+        for token_idx in range(bisect_left(tokens, word), len(tokens)):
+            token = tokens[token_idx]
+            if not token.startswith(word):
+                break
+            token_scores[token_idx] = 2.0 if token == word else 1.0
+
+        if len(word) >= 3:
+            for token_idx, similarity in self._fuzzy(word):
+                token_scores.setdefault(token_idx, similarity - 1.0)
+
+        groups = []
+        for token_idx, score in token_scores.items():
+            surname_docs, other_docs = self._token_docs[token_idx]
+            # Совпадение фамилии (первого слова) важнее имени и отчества
+            if surname_docs:
+                groups.append((score + 2.0, surname_docs))
+            if other_docs:
+                groups.append((score, other_docs))
+        return groups
+
+    def _fuzzy(self, word: str):
+        """Слова ФИО, похожие на word по триграммам (коэффициент Дайса)"""
+        query_grams = trigrams(word)
+        max_posting = max(16, int(len(self._tokens) * MAX_POSTING_SHARE))
+        lists = sorted((self._postings.get(gram, ()) for gram in query_grams), key=len)
+        selective = [posting for posting in lists if len(posting) <= max_posting]
+        if not selective:
+            # Все триграммы частые - отбираем кандидатов по двум самым редким
+            selective = lists[:2]
+
+        # Кандидат должен разделять с запросом хотя бы одну редкую триграмму
+        candidates = set()
+        for posting in selective:
+            candidates.update(posting)
+
+        for token_idx in candidates:
+            grams = self._token_trigrams[token_idx]
+            similarity = 2 * len(query_grams & grams) / (len(query_grams) + len(grams))
+            if similarity >= FUZZY_THRESHOLD:
+                yield token_idx, similarity
+
+
+surnameIndex = SurnameIndex()
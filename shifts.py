@@ -0,0 +1,267 @@
+import logging
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from database import dbRead, dbWrite, getDoctorShifts, getShiftParseErrorCount, getShiftsVersion, replaceDoctorShifts
+from doctor_cards import WEEKDAY_LABELS
+from today_index import WEEKDAY_NAMES, isDayOff
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# 8:00-14:00, 8.00 - 14.00, 9-18, с 9 до 18
+_TIME_RANGE = re.compile(r'(\d{1,2})(?:[:.](\d{2}))?\s*(?:-|до)\s*(\d{1,2})(?:[:.](\d{2}))?')
+# То, что может остаться между интервалами
+_SEPARATORS = re.compile(r'[\s,;/]+|\bс\b|\bи\b')
+_TIME = re.compile(r'^(\d{1,2})[:.](\d{2})$')
+
+Interval = Tuple[int, int, int]  # начало, конец (в минутах от начала недели), id врача
+
+
+def parseShifts(value: str) -> Tuple[List[Tuple[int, int]], Optional[str]]:
+    """
+    Разбирает ячейку расписания в интервалы приёма.
+
+    Понимает "8:00-14:00", "9-18", "с 9 до 18", несколько интервалов через
+    запятую или пробел и ночные смены ("20:00-08:00" заканчивается на
+    следующий день, конец больше 24:00).
+
+    :return: (интервалы (начало, конец) в минутах от начала дня, ошибка или None)
+    """
+    text = str(value).strip().casefold().replace('–', '-').replace('—', '-')
+    if isDayOff(text):
+        return [], None
+
+    intervals = []
+    for match in _TIME_RANGE.finditer(text):
+        start_hour, start_minute, end_hour, end_minute = (int(part or 0) for part in match.groups())
+        if start_hour > 24 or end_hour > 24 or start_minute > 59 or end_minute > 59:
+            return [], f'неверное время "{match.group(0)}"'
+        start = start_hour * 60 + start_minute
+        end = end_hour * 60 + end_minute
+        if start == end:
+            return [], f'пустой интервал "{match.group(0)}"'
+        if end < start:
+            end += MINUTES_PER_DAY
+        intervals.append((start, end))
+
+    leftover = _SEPARATORS.sub('', _TIME_RANGE.sub('', text))
+    if not intervals:
+        return [], 'не найдено время приёма'
+    if leftover:
+        return [], f'непонятный текст "{leftover}"'
+    return sorted(intervals), None
+
+
+def formatMinutes(minutes: int) -> str:
+    minutes %= MINUTES_PER_DAY
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parseMoment(text: str, now: datetime) -> Tuple[datetime, str]:
+    """
+    Разбирает аргументы вида "[день] [ЧЧ:ММ] [специализация]".
+
+    День - название или сокращение ("ср", "среда"); ближайший такой день,
+    начиная с сегодняшнего. Без времени берётся текущее.
+
+    :return: (момент, специализация или пустая строка)
+    """
+    moment = now
+    rest = []
+    for word in (text or '').split():
+        key = word.casefold().rstrip('.,')
+        time_match = _TIME.match(key)
+        weekday = next(
+            (day for day, (label, name) in enumerate(zip(WEEKDAY_LABELS, WEEKDAY_NAMES)) if key in (label.casefold(), name)),
+            None
+        )
+        if time_match and int(time_match.group(1)) < 24 and int(time_match.group(2)) < 60:
+            moment = moment.replace(hour=int(time_match.group(1)), minute=int(time_match.group(2)), second=0, microsecond=0)
+        elif weekday is not None and not rest:
+            moment += timedelta(days=(weekday - moment.weekday()) % 7)
+        else:
+            rest.append(word)
+    return moment, ' '.join(rest)
+
+
+class IntervalTree:
+    """
+    Статическое центрированное дерево интервалов [начало, конец).
+
+    Поиск интервалов, пересекающих отрезок, стоит O(log n + k), где k -
+    число найденных интервалов.
+    """
+
+    def __init__(self, intervals: List[Interval]):
+        self.size = len(intervals)
+        self._root = self._build(sorted(intervals))
+
+    def _build(self, intervals: List[Interval]):
+        if not intervals:
+            return None
+        center = intervals[len(intervals) // 2][0]
+        here, left, right = [], [], []
+        for interval in intervals:
+            if interval[1] <= center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        by_end = sorted(here, key=lambda interval: -interval[1])
+        return center, here, by_end, self._build(left), self._build(right)
+
+    def overlapping(self, start: int, end: int) -> Iterator[Interval]:
+        """Интервалы, пересекающие [start, end)"""
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            center, by_start, by_end, left, right = node
+            if end <= center:
+                # Все интервалы узла содержат center, значит заканчиваются после start
+                for interval in by_start:
+                    if interval[0] >= end:
+                        break
+                    yield interval
+                stack.append(left)
+            elif start > center:
+                for interval in by_end:
+                    if interval[1] <= start:
+                        break
+                    yield interval
+                stack.append(right)
+            else:
+                yield from by_start
+                stack.append(left)
+                stack.append(right)
+
+
+class ShiftIndex:
+    """
+    Интервалы приёма врачей и поиск "кто принимает в момент T".
+
+    Ячейки mon..sun разбираются при синхронизации расписания в таблицу
+    doctor_shifts (интервалы в минутах), ячейки, которые разобрать не
+    удалось, записываются в shift_parse_errors. В памяти по интервалам
+    строятся деревья - общее и по каждой специализации, - так что запрос
+    не перебирает всех врачей.
+    """
+
+    def __init__(self):
+        self.version = 0
+        # Ячеек расписания, которые не удалось разобрать
+        self.errors = 0
+        self.specialities: Tuple[str, ...] = ()
+        self._doctors: Dict[int, Tuple[str, str]] = {}
+        self._trees: Dict[Optional[str], IntervalTree] = {None: IntervalTree([])}
+
+    def __len__(self) -> int:
+        return self._trees[None].size
+
+    async def load(self, cards: Dict[int, Dict], version: int, rebuild: bool = True):
+        """
+        Поднимает интервалы из базы; если они построены по другой версии данных, разбирает заново.
+
+        :param rebuild: False - не разбирать, а взять то, что есть в базе (воркер, который
+                        не пишет расписание); version индекса тогда остаётся версией из базы
+        """
+        stored = await dbRead(getShiftsVersion)
+        if stored != version and rebuild:
+            await self.rebuild(cards, version)
+            return
+        self.errors = await dbRead(getShiftParseErrorCount)
+        self._build(cards, await dbRead(getDoctorShifts), stored)
+
+    async def rebuild(self, cards: Dict[int, Dict], version: int, doctor_ids: List[int] = None):
+        """
+        Разбирает расписание и сохраняет интервалы в базу.
+
+        :param doctor_ids: Разобрать только этих врачей; по умолчанию - всех
+        """
+        ids = list(cards) if doctor_ids is None else [doctor_id for doctor_id in doctor_ids if doctor_id in cards]
+        shifts, errors = [], []
+        for doctor_id in ids:
+            for weekday, value in enumerate(cards[doctor_id]['days']):
+                intervals, error = parseShifts(value)
+                if error:
+                    errors.append((doctor_id, weekday, str(value), error))
+                shifts.extend((doctor_id, weekday, start, end) for start, end in intervals)
+        if errors:
+            examples = "; ".join(f"{cards[doctor_id]['name']}, день {weekday + 1}: {error}" for doctor_id, weekday, _, error in errors[:5])
+            logger.warning(f"Не удалось разобрать {len(errors)} ячеек расписания: {examples}")
+
+        result = await dbWrite(replaceDoctorShifts, doctor_ids, shifts, errors, version)
+        self.errors = result['errors']
+        self._build(cards, result['shifts'], version)
+
+    async def apply(self, result: Dict, cards: Dict[int, Dict]):
+        """Обработчик синхронизации: заново разбираются только изменённые врачи"""
+        changed = result['inserted'] + result['updated'] + result['deleted']
+        await self.rebuild(cards, result['version'], changed)
+
+    def _build(self, cards: Dict[int, Dict], rows: List[tuple], version: int):
+        doctors = {doctor_id: (card['speciality'].casefold(), card['name']) for doctor_id, card in cards.items()}
+        per_speciality: Dict[Optional[str], List[Interval]] = {None: []}
+        for doctor_id, weekday, start, end in rows:
+            if doctor_id not in doctors:
+                continue
+            week_start = weekday * MINUTES_PER_DAY + start
+            week_end = weekday * MINUTES_PER_DAY + end
+            pieces = [(week_start, min(week_end, MINUTES_PER_WEEK), doctor_id)]
+            if week_end > MINUTES_PER_WEEK:
+                # Ночная смена воскресенья заканчивается в понедельник
+                pieces.append((0, week_end - MINUTES_PER_WEEK, doctor_id))
+            speciality = doctors[doctor_id][0]
+            per_speciality[None].extend(pieces)
+            per_speciality.setdefault(speciality, []).extend(pieces)
+
+        self._trees = {speciality: IntervalTree(intervals) for speciality, intervals in per_speciality.items()}
+        self._doctors = doctors
+        self.specialities = tuple(sorted(speciality for speciality in per_speciality if speciality is not None))
+        self.version = version
+
+    def findSpeciality(self, text: str) -> Optional[str]:
+        """Специализация по названию или его началу, например "кардио" - кардиолог"""
+        key = text.strip().casefold()
+        if not key:
+            return None
+        if key in self._trees:
+            return key
+        return next((speciality for speciality in self.specialities if speciality.startswith(key)), None)
+
+    def working(self, at: datetime, window: int = 0, speciality: str = None) -> List[tuple]:
+        """
+        Врачи, принимающие в момент at или в ближайшие window минут.
+
+        :param speciality: Только эта специализация (без учёта регистра)
+        :return: Записи (специализация, ФИО, id врача, начало, конец) - ближайший
+                 подходящий интервал каждого врача, по специализации и ФИО
+        """
+        tree = self._trees.get(speciality.casefold() if speciality else None)
+        if tree is None:
+            return []
+        start = at.weekday() * MINUTES_PER_DAY + at.hour * 60 + at.minute
+        end = start + max(window, 1)
+        found = list(tree.overlapping(start, min(end, MINUTES_PER_WEEK)))
+        if end > MINUTES_PER_WEEK:
+            found.extend(tree.overlapping(0, end - MINUTES_PER_WEEK))
+
+        best: Dict[int, Interval] = {}
+        for interval in found:
+            doctor_id = interval[2]
+            if doctor_id not in best or interval[0] < best[doctor_id][0]:
+                best[doctor_id] = interval
+        entries = [
+            (*self._doctors[doctor_id], doctor_id, interval[0], interval[1])
+            for doctor_id, interval in best.items()
+        ]
+        entries.sort()
+        return entries
+
+
+shiftIndex = ShiftIndex()
@@ -0,0 +1,85 @@
+import logging
+from collections import defaultdict
+from typing import Dict, List
+from database import dbRead, dbWrite, getDoctorSubscribers, deleteDoctorSubscriptions
+from doctor_cards import WEEKDAY_LABELS
+from outbox import outbox, PRIORITY_NOTIFICATION
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Telegram на длину сообщения (с запасом)
+MAX_MESSAGE_LENGTH = 4000
+
+
+def describeChanges(name: str, days: List[tuple]) -> str:
+    """Блок сообщения об изменениях расписания одного врача"""
+    lines = [f"👨‍⚕️ {name}"]
+    lines.extend(f"{WEEKDAY_LABELS[day]}: {old} → {new}" for day, old, new in days)
+    return "\n".join(lines)
+
+
+def composeMessages(blocks: List[str], header: str = "📅 Изменилось расписание врачей, на которых вы подписаны:") -> List[str]:
+    """
+    Собирает блоки в одно сообщение; несколько - только если не помещается в лимит Telegram.
+    """
+    messages = []
+    current = header
+    for block in blocks:
+        if len(current) + len(block) + 2 > MAX_MESSAGE_LENGTH and current != header:
+            messages.append(current)
+            current = header
+        current += "\n\n" + block
+    messages.append(current)
+    return messages
+
+
+class ScheduleNotifier:
+    """
+    Рассылка подписчикам изменений расписания после синхронизации.
+
+    Читаются только подписки врачей, у которых изменились дни приёма,
+    поэтому стоимость зависит от числа затронутых подписчиков, а не от
+    числа пользователей бота. Каждый подписчик получает одно сообщение
+    обо всех изменениях сразу; сообщения ставятся в очередь outbox
+    одной транзакцией.
+
+    Об удалённых врачах сообщается только по результату ScheduleSync:
+    снимок прошёл проверку checkSnapshot, а врача не было в двух принятых
+    снимках подряд, поэтому оборванное чтение не отменяет подписки.
+    """
+
+    def __init__(self):
+        self.notified = 0
+
+    async def notify(self, result: Dict):
+        """Обработчик ScheduleSync: принимает результат applyDoctorSnapshot"""
+        changes = result.get('schedule_changes') or {}
+        removed = result.get('removed') or {}
+        if not changes and not removed:
+            return
+
+        blocks = {doctor_id: describeChanges(change['name'], change['days']) for doctor_id, change in changes.items()}
+        for doctor_id, name in removed.items():
+            blocks[doctor_id] = f"👨‍⚕️ {name}\nВрач больше не ведёт приём, подписка отменена"
+
+        per_chat = defaultdict(list)
+        for chat_id, doctor_id in await dbRead(getDoctorSubscribers, list(blocks)):
+            per_chat[chat_id].append(doctor_id)
+        if removed:
+            await dbWrite(deleteDoctorSubscriptions, list(removed))
+        if not per_chat:
+            return
+
+        messages = []
+        for chat_id, doctor_ids in per_chat.items():
+            for text in composeMessages([blocks[doctor_id] for doctor_id in sorted(doctor_ids)]):
+                messages.append((chat_id, text))
+        await outbox.sendMany(messages, PRIORITY_NOTIFICATION)
+        self.notified += len(per_chat)
+        logger.info(
+            f"Изменения расписания {len(blocks)} врачей отправлены {len(per_chat)} подписчикам "
+            f"({len(messages)} сообщений)"
+        )
+
+
+scheduleNotifier = ScheduleNotifier()
@@ -0,0 +1,91 @@
+"""
+Проверка экстренных фраз: сообщения со словами-триггерами из исходного
+списка бота должны получать предупреждение 103/112 и не доходить до роутеров.
+
+Запуск из корня репозитория:
+    python -m unittest tests.test_emergency
+"""
+import asyncio
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from emergency import EmergencyMiddleware
+from texts import Messages
+
+# Слова-триггеры из прежнего обработчика handle_message и сообщения с ними
+TRIGGER_MESSAGES = (
+    'плохо', 'маме плохо', 'ребенку плохо', 'мне очень плохо',
+    'скорая', 'нужна скорая', 'вызовите скорую',
+    'сердце болит', 'болит сердце', 'что-то с сердцем',
+    'давление 180', 'высокое давление',
+    'боль в груди', 'сильная боль', 'болит голова',
+    'умираю', 'травма ноги', 'задыхаюсь',
+)
+ORDINARY_MESSAGES = (
+    '/start', 'Расписание врачей', 'Сегодняшнее расписание', 'Иванов',
+    'как получить больничный', 'запись к терапевту',
+    # Фамилии и слова с основами слов-триггеров
+    'Сердцев', 'Плохов', 'Скоров', 'скоро приду', 'Болотов', 'Давлетов',
+)
+# Одно слово при поиске врача по фамилии - фамилия, фразы проверяются и там
+SURNAME_STATE = 'DoctorSearch:waiting_for_surname'
+
+
+class FakeMessage(SimpleNamespace):
+    """Сообщение с тем, что читает EmergencyMiddleware; ответы складываются в answers"""
+
+    def __init__(self, text: str):
+        super().__init__(text=text, caption=None, chat=SimpleNamespace(id=1), answers=[])
+
+    async def answer(self, text: str, **kwargs):
+        self.answers.append(text)
+
+
+class EmergencyMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.middleware = EmergencyMiddleware(name_states=(SURNAME_STATE,))
+
+    def run_middleware(self, text: str, state: str = None) -> tuple:
+        """:return: (дошло ли сообщение до обработчика, ответы бота)"""
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event)
+
+        message = FakeMessage(text)
+        asyncio.run(self.middleware(handler, message, {'raw_state': state}))
+        return bool(handled), message.answers
+
+    def test_trigger_messages_get_warning(self):
+        for text in TRIGGER_MESSAGES:
+            with self.subTest(text=text):
+                handled, answers = self.run_middleware(text)
+                self.assertFalse(handled)
+                self.assertEqual(answers, [Messages.EMERGENCY_MESSAGE])
+
+    def test_ordinary_messages_reach_handler(self):
+        for text in ORDINARY_MESSAGES:
+            with self.subTest(text=text):
+                handled, answers = self.run_middleware(text)
+                self.assertTrue(handled)
+                self.assertEqual(answers, [])
+
+    def test_single_words_are_surnames_in_search(self):
+        for text in ('Плохо', 'Боль', 'Травма'):
+            with self.subTest(text=text):
+                handled, answers = self.run_middleware(text, SURNAME_STATE)
+                self.assertTrue(handled)
+                self.assertEqual(answers, [])
+
+    def test_phrases_trigger_in_search(self):
+        handled, answers = self.run_middleware('не могу дышать', SURNAME_STATE)
+        self.assertFalse(handled)
+        self.assertEqual(answers, [Messages.EMERGENCY_MESSAGE])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+Проверка планов запросов: ни один запрос из database.py и main.py не должен
+читать таблицу целиком, кроме перечисленных в EXPECTED_SCANS
+(benchmarks/query_plans.py).
+
+Запуск из корня репозитория:
+    python -m unittest tests.test_query_plans
+"""
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import query_plans
+
+
+class QueryPlansTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.mkdtemp()
+        path = os.path.join(cls.tmp, 'plans.db')
+        database = sys.modules.get('database')
+        if database is not None and database.databaseFilename != path:
+            # Пул уже открыт на другой базе; проверять на ней схему нельзя
+            shutil.rmtree(cls.tmp)
+            raise unittest.SkipTest('database.py уже импортирован с другой базой')
+        os.environ['BOT_DATABASE'] = path
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    def test_no_full_scans(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            failures = query_plans.check(['database.py', 'main.py'])
+        self.assertEqual(failures, 0, output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,16 @@ class Messages:
 Я - виртуальный помощник поликлиники. Чем могу помочь?\n\n
 """
 
+    EMERGENCY_MESSAGE = (
+        "❗ <b>ВНИМАНИЕ! ЭТО ОПАСНОЕ СОСТОЯНИЕ!</b> ❌ ЧАТ-БОТ НЕ МОЖЕТ ВЫЗВАТЬ СКОРУЮ ПОМОЩЬ. ❌\n\n"
+        "<b>НЕМЕДЛЕННО ПОЗВОНИТЕ ПО ТЕЛЕФОНУ:</b>\n"
+        "<b>103 или 112</b> (с мобильного)\n"
+        "<b>03</b> (со стационарного телефона)\n\n"
+        "Четко сообщите диспетчеру: <b>1. ЧТО СЛУЧИЛОСЬ? 2. ГДЕ ВЫ НАХОДИТЕСЬ? (Адрес!) "
+        "3. КТО ПОСТРАДАВШИЙ? (ФИО, возраст, состояние).</b>\n\n"
+        "<b>НЕ ТЕРЯЙТЕ ВРЕМЯ НА ЧАТ С БОТОМ! ЗВОНИТЕ 103/112 СЕЙЧАС ЖЕ!</b>"
+    )
+
 
 class Buttons: 
     TIMETABLE_BUTTON = "Расписание врачей"
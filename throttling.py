@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+# Фоновые запросы (рассылки, уведомления) пропускают вперёд ответы пользователям
+backgroundRequest: ContextVar[bool] = ContextVar('backgroundRequest', default=False)
+
+
+class CallbackDebounceMiddleware(BaseMiddleware):
+    """
+    Схлопывает серии нажатий кнопок под одним сообщением.
+
+    Пока обрабатывается нажатие под сообщением, новые нажатия под ним ждут,
+    и выполняется только последнее из них; промежуточные лишь получают
+    ответ на callback, чтобы у пользователя пропали "часики".
+    Первое нажатие обрабатывается без задержки.
+    """
+
+    def __init__(self):
+        self._generations: Dict[Tuple[int, int], int] = {}
+        self._locks: Dict[Tuple[int, int], asyncio.Lock] = {}
+        self.coalesced = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+        event: CallbackQuery,
+        data: Dict[str, Any],
+    ) -> Any:
+        if event.message is None:
+            return await handler(event, data)
+
+        key = (event.message.chat.id, event.message.message_id)
+        generation = self._generations.get(key, 0) + 1
+        self._generations[key] = generation
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                if self._generations[key] != generation:
+                    # Пока ждали, пришло более новое нажатие - выполнится оно
+                    self.coalesced += 1
+                    await event.answer()
+                    return None
+                return await handler(event, data)
+        finally:
+            if self._generations.get(key) == generation and not lock.locked():
+                del self._generations[key]
+                del self._locks[key]
+
+
+def callbackSupersedes(queued: Dict[str, Any], update: Dict[str, Any]) -> bool:
+    """
+    Заменяет ли сырое обновление update ещё не обработанное queued.
+
+    Используется очередью webhook, где обновления одного чата выполняются
+    строго по очереди: нажатие под тем же сообщением вытесняет ожидающее.
+    """
+    old, new = queued.get('callback_query'), update.get('callback_query')
+    if not old or not new or not old.get('message') or not new.get('message'):
+        return False
+    return (
+        old['message']['chat']['id'] == new['message']['chat']['id']
+        and old['message']['message_id'] == new['message']['message_id']
+    )
+
+
+async def editReplyMarkup(callback: CallbackQuery, reply_markup: InlineKeyboardMarkup) -> bool:
+    """
+    Меняет клавиатуру сообщения, только если она действительно изменилась.
+
+    :return: True, если Telegram заменил клавиатуру; False, если она уже была такой -
+             по сохранённому сообщению или по ответу Telegram «message is not modified»
+    """
+    if callback.message is not None and callback.message.reply_markup == reply_markup:
+        return False
+    try:
+        await callback.message.edit_reply_markup(reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if 'message is not modified' not in str(e):
+            raise
+        return False
+    return True
+
+
+class TokenBucket:
+    """Ведро токенов: rate запросов в секунду с запасом на всплеск capacity"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self._tokens >= self.capacity and now >= self._blocked_until
+
+    def pause(self, seconds: float):
+        """Запрещает запросы на seconds секунд (ответ Telegram retry_after)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self, reserve: float = 0):
+        """
+        Ждёт разрешения на один запрос.
+
+        :param reserve: Сколько токенов оставить нетронутыми для более
+                        важных запросов; фоновые запросы ждут, пока запас не накопится
+        """
+        while True:
+            now = time.monotonic()
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1 + reserve:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 + reserve - self._tokens) / self.rate)
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """
+    Ограничение исходящих запросов к Bot API.
+
+    Каждый запрос проходит через общее ведро (~30 запросов в секунду на
+    бота), а адресованный чату - ещё и через ведро этого чата (~1 в секунду
+    с небольшим запасом).
+    Если Telegram всё же ответил retry_after, соответствующее ведро
+    приостанавливается на указанное время и запрос повторяется.
+    Фоновые запросы (см. backgroundRequest) не расходуют последние
+    background_reserve токенов общего ведра, оставляя их ответам пользователям.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+        max_chat_buckets: int = 10000,
+        background_reserve: float = 5,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.background_reserve = min(background_reserve, global_rate - 1)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+        self._chat_buckets: "OrderedDict[Any, TokenBucket]" = OrderedDict()
+        self.retries = 0
+
+    def _chatBucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chat_buckets) > self.max_chat_buckets:
+                # Забываем самые давние чаты, чьи вёдра уже снова полны
+                for old_chat_id in list(self._chat_buckets)[:len(self._chat_buckets) // 10]:
+                    if self._chat_buckets[old_chat_id].idle:
+                        del self._chat_buckets[old_chat_id]
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        chat_id = getattr(method, 'chat_id', None)
+        chat_bucket: Optional[TokenBucket] = self._chatBucket(chat_id) if chat_id is not None else None
+        reserve = self.background_reserve if backgroundRequest.get() else 0
+
+        attempt = 0
+        while True:
+            if chat_bucket is not None:
+                await chat_bucket.acquire()
+            await self.global_bucket.acquire(reserve)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"Flood control: {type(method).__name__}, повтор через {e.retry_after} с")
+                # Пауза ведра выдерживается при следующем acquire
+                (chat_bucket or self.global_bucket).pause(e.retry_after)
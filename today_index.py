@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+CLINIC_TIMEZONE = 'Europe/Moscow'
+DOCTORS_PER_TODAY_PAGE = 8
+
+WEEKDAY_NAMES = ('понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье')
+DAY_OFF_VALUES = {'', '-', '—', 'выходной', 'вых', 'вых.', 'нет', 'не работает'}
+
+try:
+    from zoneinfo import ZoneInfo
+    clinicTimezone = ZoneInfo(CLINIC_TIMEZONE)
+except Exception:
+    # Нет базы часовых поясов (например, Windows без tzdata) - Петербург живёт по UTC+3
+    clinicTimezone = timezone(timedelta(hours=3), CLINIC_TIMEZONE)
+
+TodayEntry = Tuple[str, str, int, str]
+
+
+def clinicNow() -> datetime:
+    return datetime.now(clinicTimezone)
+
+
+def currentWeekday() -> int:
+    """День недели по часовому поясу поликлиники (0 - понедельник), меняется в полночь"""
+    return clinicNow().weekday()
+
+
+def isDayOff(value: str) -> bool:
+    return str(value).strip().casefold() in DAY_OFF_VALUES
+
+
+class TodayIndex:
+    """
+    Индекс "кто работает в этот день недели".
+
+    Для каждого дня недели хранит работающих врачей, отсортированных по
+    специализации и ФИО, - так страница "Сегодняшнего расписания" выбирается
+    без чтения таблицы. Страницы выбираются по id врача, как в общем списке.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._days: List[List[TodayEntry]] = [[] for _ in range(7)]
+        self._positions: List[Dict[int, int]] = [{} for _ in range(7)]
+
+    def build(self, cards: Dict[int, Dict], version: int = 0):
+        """
+        :param cards: id врача -> карточка с полями name, speciality, days
+        """
+        days = [[] for _ in range(7)]
+        for doctor_id, card in cards.items():
+            for weekday, hours in enumerate(card['days']):
+                if not isDayOff(hours):
+                    days[weekday].append((card['speciality'].casefold(), card['name'], doctor_id, str(hours).strip()))
+        for entries in days:
+            entries.sort()
+
+        self._days = days
+        self._positions = [{entry[2]: i for i, entry in enumerate(entries)} for entries in days]
+        self.version = version
+
+    def count(self, weekday: int) -> int:
+        return len(self._days[weekday])
+
+    def page(self, weekday: int, after_id: int = None, before_id: int = None, limit: int = DOCTORS_PER_TODAY_PAGE):
+        """
+        Страница врачей, работающих в этот день.
+
+        :return: (записи (специализация, ФИО, id, часы), есть ли предыдущая, есть ли следующая)
+        """
+        entries = self._days[weekday]
+        positions = self._positions[weekday]
+        if before_id is not None:
+            end = positions.get(before_id, 0)
+            start = max(0, end - limit)
+        elif after_id is not None:
+            start = positions[after_id] + 1 if after_id in positions else 0
+        else:
+            start = 0
+        end = start + limit
+        return entries[start:end], start > 0, end < len(entries)
+
+
+todayIndex = TodayIndex()
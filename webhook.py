@@ -0,0 +1,212 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import setup_application
+
+logger = logging.getLogger(__name__)
+
+UPDATE_EVENT_TYPES = (
+    'message', 'edited_message', 'callback_query', 'channel_post', 'edited_channel_post',
+    'business_message', 'edited_business_message', 'my_chat_member', 'chat_member',
+    'chat_join_request', 'inline_query', 'chosen_inline_result', 'shipping_query',
+    'pre_checkout_query', 'poll_answer', 'message_reaction',
+)
+
+
+def updateChatId(update: Dict[str, Any]) -> int:
+    """
+    Чат, к которому относится сырое обновление Telegram.
+
+    Для событий без чата используется пользователь, а если нет и его -
+    update_id, чтобы такие обновления не выстраивались в одну очередь.
+    """
+    for event_type in UPDATE_EVENT_TYPES:
+        event = update.get(event_type)
+        if not event:
+            continue
+        chat = event.get('chat') or (event.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+        break
+    return update.get('update_id', 0)
+
+
+class UpdateScheduler:
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются одновременно (не больше
+    max_concurrent), а обновления одного чата - строго по очереди, поэтому
+    состояние FSM пользователя не обгоняет его же сообщения.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable],
+        max_concurrent: int = 64,
+        max_pending: int = 10000,
+        supersedes: Optional[Callable[[Dict[str, Any], Dict[str, Any]], bool]] = None,
+    ):
+        """
+        :param handler: Корутина обработки одного сырого обновления
+        :param max_concurrent: Сколько обновлений обрабатывается одновременно
+        :param max_pending: Сколько обновлений может ждать обработки; сверх этого submit отказывает
+        :param supersedes: supersedes(queued, update) - заменяет ли новое обновление
+                           последнее ожидающее в очереди чата (например, повторное нажатие кнопки)
+        """
+        self._handler = handler
+        self._supersedes = supersedes
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._chats: Dict[int, deque] = {}
+        self._tasks = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._accepting = True
+        self.pending = 0
+        self.processed = 0
+        self.failed = 0
+        self.superseded = 0
+
+    @property
+    def activeChats(self) -> int:
+        return len(self._chats)
+
+    def submit(self, chat_id: int, update: Dict[str, Any]) -> bool:
+        """
+        Ставит обновление в очередь его чата.
+
+        :return: False, если приём остановлен или очередь переполнена
+        """
+        if not self._accepting:
+            return False
+        queue = self._chats.get(chat_id)
+        # queue[0] уже обрабатывается, заменять можно только ожидающие
+        if queue is not None and len(queue) > 1 and self._supersedes and self._supersedes(queue[-1], update):
+            queue[-1] = update
+            self.superseded += 1
+            return True
+        if self.pending >= self.max_pending:
+            return False
+        self.pending += 1
+        self._idle.clear()
+
+        if queue is not None:
+            queue.append(update)
+        else:
+            self._chats[chat_id] = deque([update])
+            task = asyncio.create_task(self._processChat(chat_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _processChat(self, chat_id: int):
+        queue = self._chats[chat_id]
+        try:
+            while queue:
+                # Обновление остаётся в очереди до конца обработки, чтобы новые
+                # обновления этого чата встали за ним, а не запустили вторую задачу
+                update = queue[0]
+                async with self._semaphore:
+                    try:
+                        await self._handler(update)
+                        self.processed += 1
+                    except Exception as e:
+                        self.failed += 1
+                        logger.exception(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+                queue.popleft()
+                self.pending -= 1
+        finally:
+            del self._chats[chat_id]
+            if not self.pending:
+                self._idle.set()
+
+    async def drain(self, timeout: float = 30.0) -> bool:
+        """
+        Прекращает приём и дожидается обработки уже принятых обновлений.
+
+        :return: False, если за timeout секунд обработать всё не удалось
+        """
+        self._accepting = False
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались обработки {self.pending} обновлений при остановке")
+            return False
+
+
+def createWebhookApp(
+    dp: Dispatcher,
+    bot: Bot,
+    path: str = '/webhook',
+    secret_token: Optional[str] = None,
+    max_concurrent: int = 64,
+    drain_timeout: float = 30.0,
+    supersedes: Optional[Callable[[Dict[str, Any], Dict[str, Any]], bool]] = None,
+) -> web.Application:
+    """
+    aiohttp-приложение, принимающее обновления Telegram на path.
+
+    Ответ Telegram отправляется сразу после постановки обновления в очередь,
+    а сама обработка идёт в UpdateScheduler. При остановке приложение
+    перестаёт принимать обновления и дожидается обработки принятых.
+    """
+    scheduler = UpdateScheduler(
+        lambda update: dp.feed_raw_update(bot, update),
+        max_concurrent=max_concurrent,
+        supersedes=supersedes,
+    )
+
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return web.Response(status=401)
+        update = await request.json()
+        if not scheduler.submit(updateChatId(update), update):
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        return web.Response()
+
+    async def on_shutdown(app: web.Application):
+        await scheduler.drain(drain_timeout)
+
+    app = web.Application()
+    app['scheduler'] = scheduler
+    app.router.add_post(path, handle)
+    # Сначала дожидаемся обработки, затем останавливаем диспетчер (и запись FSM)
+    app.on_shutdown.append(on_shutdown)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def runWebhook(
+    dp: Dispatcher,
+    bot: Bot,
+    host: str,
+    port: int,
+    path: str = '/webhook',
+    url: Optional[str] = None,
+    secret_token: Optional[str] = None,
+    max_concurrent: int = 64,
+    supersedes: Optional[Callable[[Dict[str, Any], Dict[str, Any]], bool]] = None,
+):
+    """Запускает приём обновлений через webhook и работает до отмены"""
+    app = createWebhookApp(dp, bot, path, secret_token, max_concurrent, supersedes=supersedes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        if url:
+            await bot.set_webhook(url + path, secret_token=secret_token, max_connections=min(max_concurrent, 100))
+        logger.info(f"Webhook слушает {host}:{port}{path}, параллельно до {max_concurrent} обновлений")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
@@ -0,0 +1,299 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from webhook import UpdateScheduler, updateChatId
+
+logger = logging.getLogger(__name__)
+
+# Номер воркера и число воркеров передаются процессу через окружение,
+# чтобы настройки модуля main учли их ещё при импорте
+WORKER_INDEX_VARIABLE = 'BOT_WORKER_INDEX'
+WORKERS_VARIABLE = 'BOT_WORKERS'
+
+# Ячейки общей памяти со статистикой воркера; пишет только сам воркер
+STAT_PROCESSED, STAT_FAILED, STAT_SUPERSEDED, STAT_IN_PROGRESS, STAT_HEARTBEAT = range(5)
+
+
+def shardOf(chat_id: int, count: int) -> int:
+    """Номер воркера для чата; один чат всегда попадает к одному воркеру"""
+    return zlib.crc32(str(chat_id).encode()) % count
+
+
+class WorkerPool:
+    """
+    Процессы-воркеры бота, между которыми чаты делятся по хэшу chat id.
+
+    Фронт (webhook или polling) только принимает обновления и кладёт их в
+    очередь воркера своего чата. Все обновления чата обрабатывает один
+    процесс, поэтому порядок сообщений и состояние FSM не расходятся между
+    процессами. Каждый воркер публикует в общей памяти счётчики и отметку
+    времени, по ним считаются глубина очереди и здоровье; упавший воркер
+    перезапускается и продолжает разбирать ту же очередь.
+    """
+
+    def __init__(self, count: int, target: Callable, max_pending: int = 10000, heartbeat_timeout: float = 15.0):
+        """
+        :param target: target(updates, stats) - точка входа процесса воркера (функция уровня модуля)
+        :param max_pending: Сколько обновлений может ждать один воркер; сверх этого submit отказывает
+        :param heartbeat_timeout: Через сколько секунд без отметки воркер считается зависшим
+        """
+        self.count = count
+        self.target = target
+        self.max_pending = max_pending
+        self.heartbeat_timeout = heartbeat_timeout
+        # spawn: воркер не наследует потоки и event loop фронта
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue() for _ in range(count)]
+        self._stats = [self._context.Array('d', 5, lock=False) for _ in range(count)]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * count
+        self._stopping = False
+        self.submitted = [0] * count
+        self.restarts = [0] * count
+        self.rejected = 0
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+        logger.info(f"Запущено воркеров: {self.count}")
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=self.target, args=(self._queues[index], self._stats[index]), name=f'bot-worker-{index}'
+        )
+        previous = {name: os.environ.get(name) for name in (WORKER_INDEX_VARIABLE, WORKERS_VARIABLE)}
+        os.environ[WORKER_INDEX_VARIABLE] = str(index)
+        os.environ[WORKERS_VARIABLE] = str(self.count)
+        try:
+            process.start()
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        self._processes[index] = process
+
+    def handled(self, index: int) -> int:
+        stats = self._stats[index]
+        return int(stats[STAT_PROCESSED] + stats[STAT_FAILED] + stats[STAT_SUPERSEDED])
+
+    def queueDepth(self, index: int) -> int:
+        """Обновления, отданные воркеру и ещё не обработанные (в очереди и в работе)"""
+        return max(0, self.submitted[index] - self.handled(index))
+
+    @property
+    def pending(self) -> int:
+        return sum(self.queueDepth(index) for index in range(self.count))
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        """
+        Отдаёт сырое обновление воркеру его чата.
+
+        :return: False, если очередь воркера переполнена
+        """
+        index = shardOf(updateChatId(update), self.count)
+        if self.queueDepth(index) >= self.max_pending:
+            self.rejected += 1
+            return False
+        self._queues[index].put(update)
+        self.submitted[index] += 1
+        return True
+
+    def health(self) -> List[Dict]:
+        now = time.time()
+        workers = []
+        for index, process in enumerate(self._processes):
+            stats = self._stats[index]
+            heartbeat_age = now - stats[STAT_HEARTBEAT] if stats[STAT_HEARTBEAT] else None
+            workers.append({
+                'index': index,
+                'pid': process.pid if process else None,
+                'alive': bool(process and process.is_alive()),
+                'ready': heartbeat_age is not None and heartbeat_age < self.heartbeat_timeout,
+                'queue_depth': self.queueDepth(index),
+                'in_progress': int(stats[STAT_IN_PROGRESS]),
+                'processed': int(stats[STAT_PROCESSED]),
+                'failed': int(stats[STAT_FAILED]),
+                'restarts': self.restarts[index],
+                'heartbeat_age': round(heartbeat_age, 1) if heartbeat_age is not None else None,
+            })
+        return workers
+
+    @property
+    def healthy(self) -> bool:
+        return all(worker['alive'] and worker['ready'] for worker in self.health())
+
+    async def monitor(self, interval: float = 1.0):
+        """Перезапускает упавших воркеров"""
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            for index, process in enumerate(self._processes):
+                if self._stopping or process is None or process.is_alive():
+                    continue
+                # Обновления, которые воркер успел взять в работу, потеряны; оставшиеся в очереди дождутся нового
+                lost = int(self._stats[index][STAT_IN_PROGRESS])
+                self.submitted[index] -= lost
+                self._stats[index][STAT_IN_PROGRESS] = 0
+                self.restarts[index] += 1
+                logger.error(
+                    f"Воркер {index} завершился с кодом {process.exitcode}, потеряно обновлений: {lost}; перезапуск"
+                )
+                self._spawn(index)
+
+    async def stop(self, timeout: float = 30.0):
+        """Просит воркеров доработать принятое и дожидается их завершения"""
+        self._stopping = True
+        loop = asyncio.get_running_loop()
+        for updates in self._queues:
+            updates.put(None)
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Воркер {index} не завершился за {timeout} с, останавливаем принудительно")
+                process.terminate()
+
+
+async def serveUpdates(
+    dp: Dispatcher,
+    bot: Bot,
+    updates,
+    stats,
+    max_concurrent: int = 64,
+    supersedes: Optional[Callable[[Dict[str, Any], Dict[str, Any]], bool]] = None,
+    publish_interval: float = 0.5,
+):
+    """
+    Цикл процесса-воркера: обрабатывает обновления из очереди фронта, пока не придёт None.
+
+    Очередь читается в отдельном потоке, обработка идёт в UpdateScheduler,
+    как в режиме webhook, поэтому обновления одного чата идут по порядку.
+    """
+    loop = asyncio.get_running_loop()
+    scheduler = UpdateScheduler(
+        lambda update: dp.feed_raw_update(bot, update),
+        max_concurrent=max_concurrent,
+        # Глубину очереди ограничивает фронт
+        max_pending=10 ** 9,
+        supersedes=supersedes,
+    )
+    stopped = asyncio.Event()
+
+    def pump():
+        while True:
+            update = updates.get()
+            if update is None:
+                loop.call_soon_threadsafe(stopped.set)
+                return
+            loop.call_soon_threadsafe(scheduler.submit, updateChatId(update), update)
+
+    # После перезапуска воркера счётчики продолжаются с прежних значений
+    base = (stats[STAT_PROCESSED], stats[STAT_FAILED], stats[STAT_SUPERSEDED])
+
+    def publish():
+        stats[STAT_PROCESSED] = base[0] + scheduler.processed
+        stats[STAT_FAILED] = base[1] + scheduler.failed
+        stats[STAT_SUPERSEDED] = base[2] + scheduler.superseded
+        stats[STAT_IN_PROGRESS] = scheduler.pending
+        stats[STAT_HEARTBEAT] = time.time()
+
+    threading.Thread(target=pump, name='updates-pump', daemon=True).start()
+    publish()
+    while not stopped.is_set():
+        try:
+            await asyncio.wait_for(stopped.wait(), publish_interval)
+        except asyncio.TimeoutError:
+            pass
+        publish()
+    await scheduler.drain()
+    publish()
+
+
+def createFrontApp(
+    pool: WorkerPool,
+    path: Optional[str] = '/webhook',
+    secret_token: Optional[str] = None,
+) -> web.Application:
+    """
+    aiohttp-приложение фронта: приём webhook на path (если задан) и состояние воркеров на /health.
+    """
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return web.Response(status=401)
+        if not pool.submit(await request.json()):
+            # Telegram повторит доставку позже
+            return web.Response(status=503)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        workers = pool.health()
+        healthy = all(worker['alive'] and worker['ready'] for worker in workers)
+        return web.json_response(
+            {'healthy': healthy, 'pending': pool.pending, 'rejected': pool.rejected, 'workers': workers},
+            status=200 if healthy else 503,
+        )
+
+    app = web.Application()
+    if path:
+        app.router.add_post(path, handle)
+    app.router.add_get('/health', health)
+    return app
+
+
+async def pollUpdates(pool: WorkerPool, bot: Bot, timeout: int = 30):
+    """Получает обновления через getUpdates и раздаёт их воркерам"""
+    await bot.delete_webhook()
+    offset = None
+    while True:
+        updates = await bot.get_updates(offset=offset, timeout=timeout)
+        for update in updates:
+            raw = update.model_dump(mode='json', by_alias=True, exclude_none=True)
+            while not pool.submit(raw):
+                # Воркер перегружен: ждём, а не теряем обновление
+                await asyncio.sleep(0.05)
+            offset = update.update_id + 1
+
+
+async def runFront(
+    pool: WorkerPool,
+    bot: Bot,
+    mode: str,
+    host: str,
+    port: int,
+    path: str = '/webhook',
+    url: Optional[str] = None,
+    secret_token: Optional[str] = None,
+):
+    """
+    Запускает воркеров и фронт и работает до отмены.
+
+    В режиме webhook фронт принимает обновления на host:port/path, в режиме
+    polling сам опрашивает Telegram; /health доступен в обоих режимах.
+    """
+    pool.start()
+    app = createFrontApp(pool, path if mode == 'webhook' else None, secret_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    monitor = asyncio.create_task(pool.monitor())
+    try:
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Фронт слушает {host}:{port}, воркеров: {pool.count}, режим {mode}")
+        if mode == 'webhook':
+            if url:
+                await bot.set_webhook(url + path, secret_token=secret_token, max_connections=100)
+            await asyncio.Event().wait()
+        else:
+            await pollUpdates(pool, bot)
+    finally:
+        monitor.cancel()
+        await runner.cleanup()
+        await pool.stop()
+        await bot.session.close()